@@ -0,0 +1,115 @@
+"""
+Avaliação dos alertas (Alert) sobre os valores novos das métricas.
+
+Formato de ``Alert.condition``::
+
+    {"operator": "gt", "threshold": 1000,
+     "for": 3,          # avaliações seguidas fora do limite antes de disparar
+     "cooldown": 3600}  # segundos mínimos entre dois disparos
+
+Todos os alertas ativos das métricas recalculadas vêm numa consulta, as
+condições são avaliadas em memória e ``last_triggered`` e a sequência de
+violações (``metadata['breach_streak']``) são gravados com um ``bulk_update``.
+Alertas com ``for``/``cooldown`` inválidos são ignorados (com aviso no log),
+sem derrubar a avaliação dos demais nem a atualização das métricas.
+"""
+import logging
+import operator
+
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from core import notifications
+from .models import Alert
+
+
+logger = logging.getLogger(__name__)
+
+OPERATORS = {
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+    'eq': operator.eq,
+    'ne': operator.ne,
+}
+DEFAULT_COOLDOWN = 60 * 60
+STREAK_KEY = 'breach_streak'
+NOTIFICATION_TYPE = 'analytics.alert'
+# Quem recebe os alertas na empresa
+ACCESS_LEVELS = ('admin', 'manager')
+BULK_SIZE = 1000
+
+
+def is_breached(condition, value):
+    if value is None or not isinstance(condition, dict):
+        return False
+    compare = OPERATORS.get(condition.get('operator', 'gt'))
+    try:
+        return compare is not None and compare(float(value), float(condition['threshold']))
+    except (KeyError, TypeError, ValueError):
+        return False
+
+
+def condition_settings(condition):
+    """``(avaliações seguidas exigidas, cooldown em segundos)``; ValueError/TypeError se inválidos"""
+    if not isinstance(condition, dict):
+        raise TypeError(f"Alert condition must be an object, not {type(condition).__name__}")
+    required = int(condition.get('for', 1))
+    cooldown = float(condition.get('cooldown', DEFAULT_COOLDOWN))
+    if cooldown != cooldown:
+        raise ValueError("Alert cooldown cannot be NaN")
+    return max(required, 1), cooldown
+
+
+def evaluate(values, now=None):
+    """
+    Avalia os alertas das métricas em ``values`` (``{metric_id: valor}``).
+
+    Retorna os alertas disparados.
+    """
+    if not values:
+        return []
+    now = now or timezone.now()
+    changed, fired = [], []
+    alerts = Alert.objects.filter(metric_id__in=list(values), is_active=True).select_related('metric')
+    for alert in alerts:
+        metadata = alert.metadata if isinstance(alert.metadata, dict) else {}
+        try:
+            required, cooldown = condition_settings(alert.condition)
+            streak = int(metadata.get(STREAK_KEY, 0))
+        except (TypeError, ValueError, OverflowError) as error:
+            logger.warning("Skipping alert %s with invalid condition %r: %s", alert.pk, alert.condition, error)
+            continue
+        value = values[alert.metric_id]
+        new_streak = streak + 1 if is_breached(alert.condition, value) else 0
+        cooled_down = alert.last_triggered is None or (now - alert.last_triggered).total_seconds() >= cooldown
+        should_fire = new_streak >= required and cooled_down
+        if new_streak != streak or should_fire:
+            alert.metadata = {**metadata, STREAK_KEY: new_streak}
+            if should_fire:
+                alert.last_triggered = now
+                fired.append((alert, value))
+            changed.append(alert)
+    Alert.objects.bulk_update(changed, ['metadata', 'last_triggered'], batch_size=BULK_SIZE)
+    dispatch(fired)
+    return [alert for alert, _value in fired]
+
+
+def dispatch(fired):
+    """Notifica as empresas dos alertas disparados: destinatários lidos uma vez por empresa, um único insert"""
+    recipients, messages = {}, []
+    for alert, value in fired:
+        if alert.company_id not in recipients:
+            recipients[alert.company_id] = list(notifications.company_recipients(alert.company_id, ACCESS_LEVELS))
+        channels = [channel for channel in alert.notification_channels or [] if isinstance(channel, str)]
+        messages.append((
+            recipients[alert.company_id],
+            NOTIFICATION_TYPE,
+            _("Alert: %(name)s") % {'name': alert.name},  # FR: Alerte : %(name)s
+            _("%(metric)s is %(value)s") % {'metric': alert.metric.name, 'value': value},  # FR: %(metric)s vaut %(value)s
+            {'alert': str(alert.pk), 'metric': str(alert.metric_id), 'value': value, 'severity': alert.severity},
+            channels or notifications.DEFAULT_CHANNELS,
+        ))
+    if messages:
+        notifications.deliver_many(messages)
@@ -0,0 +1,35 @@
+"""
+API dos dashboards.
+
+O endpoint de dados devolve o layout e o resultado de todos os widgets numa
+única resposta (ver ``analytics.dashboards``), depois de conferir
+``Dashboard.permissions`` para o membro da empresa.
+"""
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from companies.models import CompanyUser
+from .dashboards import can_view, resolve_widgets
+from .models import Dashboard
+
+
+class DashboardDataView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        dashboard = get_object_or_404(Dashboard, pk=pk)
+        member = CompanyUser.objects.filter(company_id=dashboard.company_id, user=request.user, status='active').first()
+        if member is None:
+            raise Http404
+        if not can_view(dashboard, member):
+            raise PermissionDenied
+        return Response({
+            'id': str(dashboard.pk),
+            'name': dashboard.name,
+            'layout': dashboard.layout,
+            'widgets': resolve_widgets(dashboard),
+        })
@@ -0,0 +1,9 @@
+from django.urls import path
+
+from .api import DashboardDataView
+
+app_name = 'analytics-api'
+
+urlpatterns = [
+    path('dashboards/<uuid:pk>/data/', DashboardDataView.as_view(), name='dashboard_data'),
+]
@@ -0,0 +1,174 @@
+"""
+Dados dos widgets de um Dashboard.
+
+Formato de cada item de ``Dashboard.widgets``::
+
+    {"id": "vendas", "metric": "<uuid>", "type": "value",   # value | series | breakdown
+     "range": "30d", "interval": "day", "dimension": "status"}
+
+Os resultados de cada widget ficam no cache por um tempo ligado ao
+``update_frequency`` da métrica. Os widgets que faltam no cache são agrupados
+pela consulta que precisam (mesmo modelo, filtros, período e formato) e cada
+grupo vira uma única consulta agregada; os grupos rodam em paralelo num pool
+de threads, então o dashboard demora o tempo da consulta mais lenta.
+"""
+import hashlib
+import logging
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import cache
+from django.db import connections
+
+from . import metrics as metric_engine
+from .models import Metric
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY = 'dashboard-widget:{digest}'
+CACHE_TIMEOUTS = {
+    'realtime': 30,
+    'hourly': 60 * 60,
+    'daily': 24 * 60 * 60,
+    'weekly': 7 * 24 * 60 * 60,
+    'monthly': 30 * 24 * 60 * 60,
+}
+DEFAULT_TIMEOUT = 5 * 60
+MAX_WORKERS = 4
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='dashboard')
+
+
+def widget_shape(widget):
+    kind = widget.get('type', 'value')
+    if kind == 'series':
+        return ('series', widget.get('interval', 'day'))
+    if kind == 'breakdown':
+        if not widget.get('dimension'):
+            raise metric_engine.MetricError("Breakdown widgets need a dimension")
+        return ('breakdown', widget['dimension'])
+    if kind == 'value':
+        return ('value',)
+    raise metric_engine.MetricError(f"Invalid widget type {kind!r}")
+
+
+def cache_key(metric, shape, period):
+    # updated_at entra na chave: editar a métrica invalida os widgets dela
+    raw = f'{metric.pk}:{metric.updated_at.timestamp()}:{":".join(shape)}:{period.key}'
+    return CACHE_KEY.format(digest=hashlib.md5(raw.encode()).hexdigest())
+
+
+def _uuid(value):
+    try:
+        return str(uuid.UUID(str(value)))
+    except ValueError:
+        return None
+
+
+def _run_group(key, group_metrics):
+    """Executa um grupo numa thread do pool, fechando a conexão da thread no fim"""
+    try:
+        return metric_engine.run_query(key, group_metrics)
+    finally:
+        connections.close_all()
+
+
+def can_view(dashboard, member):
+    """
+    Se o membro (``CompanyUser`` ativo da empresa) pode ver o dashboard.
+
+    ``Dashboard.permissions`` vazio libera todos os membros; senão basta estar
+    numa das listas::
+
+        {"access_levels": ["admin", "manager"], "departments": ["Ventes"], "users": ["<uuid do CompanyUser>"]}
+
+    Admins e o autor sempre veem; chaves desconhecidas não liberam ninguém.
+    """
+    if member is None or member.company_id != dashboard.company_id:
+        return False
+    permissions = dashboard.permissions if isinstance(dashboard.permissions, dict) else {}
+    if not permissions or member.access_level == 'admin' or member.pk == dashboard.created_by_id:
+        return True
+    allowed = {key: values for key, values in permissions.items() if isinstance(values, list)}
+    return (
+        member.access_level in allowed.get('access_levels', ())
+        or member.department in allowed.get('departments', ())
+        or str(member.pk) in {str(value) for value in allowed.get('users', ())}
+    )
+
+
+def resolve_widgets(dashboard, now=None):
+    """``{widget_id: dados}`` de todos os widgets; erros ficam no próprio widget"""
+    widgets = [widget for widget in (dashboard.widgets or []) if isinstance(widget, dict)]
+    metric_ids = {_uuid(widget.get('metric')) for widget in widgets} - {None}
+    metrics = {
+        str(metric.pk): metric
+        for metric in Metric.objects.filter(company_id=dashboard.company_id, pk__in=metric_ids, is_active=True)
+    } if metric_ids else {}
+
+    results, pending = {}, {}
+    for position, widget in enumerate(widgets):
+        widget_id = str(widget.get('id', position))
+        metric = metrics.get(_uuid(widget.get('metric')))
+        if metric is None:
+            results[widget_id] = {'error': 'metric not found'}
+            continue
+        try:
+            shape = widget_shape(widget)
+            # Uma métrica inválida não pode derrubar a consulta do grupo
+            metric_engine.aggregate_for(metric)
+            period = metric_engine.resolve_period(widget.get('range'), now)
+            key = metric_engine.query_key(metric, period, shape)
+        except metric_engine.MetricError as error:
+            results[widget_id] = {'error': str(error)}
+            continue
+        pending[widget_id] = (metric, shape, period, key, cache_key(metric, shape, period))
+
+    cached = cache.get_many([entry[4] for entry in pending.values()])
+    groups = defaultdict(dict)
+    for widget_id, (metric, shape, period, key, entry_key) in pending.items():
+        if entry_key in cached:
+            results[widget_id] = {**cached[entry_key], 'cached': True}
+        else:
+            groups[key][metric.pk] = metric
+
+    computed = {}
+    if len(groups) == 1:
+        key, group = next(iter(groups.items()))
+        computed[key] = _safe_run(lambda: metric_engine.run_query(key, list(group.values())))
+    elif groups:
+        futures = {key: _executor.submit(_run_group, key, list(group.values())) for key, group in groups.items()}
+        for key, future in futures.items():
+            computed[key] = _safe_run(future.result)
+
+    to_cache = defaultdict(dict)
+    for widget_id, (metric, shape, period, key, entry_key) in pending.items():
+        if widget_id in results:
+            continue
+        values = computed[key]
+        if isinstance(values, Exception):
+            results[widget_id] = {'error': str(values)}
+            continue
+        data = {
+            'metric': str(metric.pk),
+            'name': metric.name,
+            'type': shape[0],
+            'start': period.start,
+            'end': period.end,
+            'value': values[metric.pk],
+        }
+        results[widget_id] = {**data, 'cached': False}
+        to_cache[CACHE_TIMEOUTS.get(metric.update_frequency, DEFAULT_TIMEOUT)][entry_key] = data
+    for timeout, entries in to_cache.items():
+        cache.set_many(entries, timeout)
+    return results
+
+
+def _safe_run(function):
+    try:
+        return function()
+    except Exception as error:
+        logger.exception("Dashboard widget query failed")
+        return error
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from analytics.rollup import refresh
+
+
+class Command(BaseCommand):
+    help = "Recalcula os valores das métricas ativas e avalia os alertas"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--frequency', choices=['realtime', 'hourly', 'daily', 'weekly', 'monthly'])
+
+    def handle(self, *args, **options):
+        changed = refresh(frequency=options['frequency'])
+        self.stdout.write(self.style.SUCCESS(f"{len(changed)} metrics changed."))
@@ -0,0 +1,181 @@
+"""
+Cálculo das métricas (Metric) a partir de ``calculation``.
+
+Formato de ``Metric.calculation``::
+
+    {"source": "commerce.Order",         # modelo com campo ``company``
+     "field": "total",                    # campo agregado (sum/average)
+     "date_field": "created_at",
+     "filters": {"status__in": ["confirmed", "delivered"]},
+     "numerator": {"payment_status": "paid"}}   # só para percentage
+
+``Metric.filters`` é somado a ``calculation['filters']``. Quebras só aceitam
+dimensões listadas em ``Metric.dimensions`` (nomes de campo ou
+``{"field": ...}``). Métricas com o
+mesmo modelo, filtros, período e formato (valor, série ou quebra por
+dimensão) são calculadas juntas numa única consulta agregada.
+"""
+import json
+from dataclasses import dataclass
+from datetime import datetime, time, timedelta
+
+from django.apps import apps
+from django.db.models import Avg, Count, F, FloatField, Q, Sum
+from django.db.models.functions import Cast, NullIf, TruncDay, TruncMonth, TruncWeek
+from django.utils import timezone
+
+
+TRUNCATE = {'day': TruncDay, 'week': TruncWeek, 'month': TruncMonth}
+DEFAULT_RANGE = '30d'
+
+
+class MetricError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class Period:
+    start: datetime
+    end: datetime
+
+    @property
+    def key(self):
+        return f'{self.start.isoformat()}/{self.end.isoformat()}'
+
+
+def resolve_period(value=None, now=None):
+    """
+    Período [início, fim) em dias inteiros, para que o mesmo intervalo relativo
+    dê a mesma chave o dia todo: ``"today"``, ``"7d"``, ``"30d"``, ``"mtd"``,
+    ``"ytd"`` ou ``{"start": "2026-01-01", "end": "2026-02-01"}``.
+    """
+    now = timezone.localtime(now or timezone.now())
+    tomorrow = timezone.make_aware(datetime.combine(now.date() + timedelta(days=1), time.min))
+    value = value or DEFAULT_RANGE
+    if isinstance(value, dict):
+        try:
+            start = datetime.fromisoformat(value['start'])
+            end = datetime.fromisoformat(value['end'])
+        except (KeyError, TypeError, ValueError) as error:
+            raise MetricError(f"Invalid range {value!r}") from error
+        return Period(
+            start if timezone.is_aware(start) else timezone.make_aware(start),
+            end if timezone.is_aware(end) else timezone.make_aware(end),
+        )
+    if value == 'today':
+        return Period(tomorrow - timedelta(days=1), tomorrow)
+    if value == 'mtd':
+        return Period(timezone.make_aware(datetime.combine(now.date().replace(day=1), time.min)), tomorrow)
+    if value == 'ytd':
+        return Period(timezone.make_aware(datetime.combine(now.date().replace(month=1, day=1), time.min)), tomorrow)
+    if isinstance(value, str) and value.endswith('d') and value[:-1].isdigit():
+        return Period(tomorrow - timedelta(days=int(value[:-1])), tomorrow)
+    raise MetricError(f"Invalid range {value!r}")
+
+
+def source_model(calculation):
+    try:
+        model = apps.get_model(calculation['source'])
+    except (KeyError, LookupError, ValueError) as error:
+        raise MetricError(f"Invalid metric source {calculation.get('source')!r}") from error
+    if not any(field.name == 'company' for field in model._meta.get_fields()):
+        raise MetricError(f"Metric source {model._meta.label} has no company")
+    return model
+
+
+def aggregate_for(metric):
+    """Expressão de agregação da métrica"""
+    calculation = metric.calculation if isinstance(metric.calculation, dict) else {}
+    if metric.metric_type == 'count':
+        return Count('pk')
+    if metric.metric_type in ('sum', 'average'):
+        if not calculation.get('field'):
+            raise MetricError(f"Metric {metric.pk} needs calculation['field']")
+        return (Sum if metric.metric_type == 'sum' else Avg)(calculation['field'])
+    if metric.metric_type == 'percentage':
+        numerator = Count('pk', filter=Q(**(calculation.get('numerator') or {})))
+        return Cast(numerator, FloatField()) * 100.0 / NullIf(Cast(Count('pk'), FloatField()), 0.0)
+    raise MetricError(f"Metric type {metric.metric_type!r} cannot be calculated")
+
+
+def allowed_dimensions(metric):
+    return {
+        item.get('field') if isinstance(item, dict) else item
+        for item in (metric.dimensions if isinstance(metric.dimensions, list) else [])
+    } - {None, ''}
+
+
+def check_dimension(metric, dimension):
+    # A dimensão vem do JSON do widget: sem a lista, qualquer caminho de relação seria exposto
+    if not isinstance(dimension, str) or dimension not in allowed_dimensions(metric):
+        raise MetricError(f"Dimension {dimension!r} is not available for metric {metric.pk}")
+
+
+@dataclass(frozen=True)
+class QueryKey:
+    """Tudo o que precisa ser igual para duas métricas caberem na mesma consulta"""
+    company_id: object
+    source: str
+    date_field: str
+    filters: str
+    period: Period
+    shape: tuple  # ('value',) | ('series', intervalo) | ('breakdown', dimensão)
+
+
+def query_key(metric, period, shape=('value',)):
+    calculation = metric.calculation if isinstance(metric.calculation, dict) else {}
+    model = source_model(calculation)
+    if shape[0] == 'breakdown':
+        check_dimension(metric, shape[1])
+    filters = {**(calculation.get('filters') or {}), **(metric.filters or {})}
+    return QueryKey(
+        company_id=metric.company_id,
+        source=model._meta.label_lower,
+        date_field=calculation.get('date_field', 'created_at'),
+        filters=json.dumps(filters, sort_keys=True, default=str),
+        period=period,
+        shape=tuple(shape),
+    )
+
+
+def run_query(key, metrics):
+    """
+    Uma consulta para todas as métricas do grupo.
+
+    Retorna ``{metric_id: valor}``; para séries, ``{metric_id: [(data, valor)]}``
+    e para quebras ``{metric_id: {dimensão: valor}}``.
+    """
+    model = apps.get_model(key.source)
+    queryset = model._default_manager.filter(
+        company_id=key.company_id,
+        **{f'{key.date_field}__gte': key.period.start, f'{key.date_field}__lt': key.period.end},
+        **json.loads(key.filters),
+    ).order_by()
+    aggregates = {f'm{index}': aggregate_for(metric) for index, metric in enumerate(metrics)}
+    kind = key.shape[0]
+    if kind == 'value':
+        row = queryset.aggregate(**aggregates)
+        return {metric.pk: row[f'm{index}'] for index, metric in enumerate(metrics)}
+    if kind == 'series':
+        truncate = TRUNCATE.get(key.shape[1])
+        if truncate is None:
+            raise MetricError(f"Invalid interval {key.shape[1]!r}")
+        rows = list(
+            queryset.annotate(bucket=truncate(key.date_field)).values('bucket').annotate(**aggregates).order_by('bucket')
+        )
+        return {
+            metric.pk: [(row['bucket'], row[f'm{index}']) for row in rows]
+            for index, metric in enumerate(metrics)
+        }
+    if kind == 'breakdown':
+        rows = list(queryset.values(dimension=F(key.shape[1])).annotate(**aggregates))
+        return {
+            # Chaves em texto: FK (UUID) ou data não são chaves válidas em JSON
+            metric.pk: {_dimension_key(row['dimension']): row[f'm{index}'] for row in rows}
+            for index, metric in enumerate(metrics)
+        }
+    raise MetricError(f"Invalid widget shape {kind!r}")
+
+
+def _dimension_key(value):
+    return value if value is None or isinstance(value, str) else str(value)
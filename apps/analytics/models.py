@@ -47,6 +47,13 @@ class ReportExecution(BaseModel):
     result_data = models.JSONField(null=True)
     error_message = models.TextField(blank=True)
     file_output = models.JSONField(default=dict)  # Informações do arquivo gerado
+    # Hash de (relatório, parâmetros normalizados, marca d'água dos dados); ver analytics.report_cache
+    cache_key = models.CharField(max_length=64, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['report', 'cache_key', 'status']),
+        ]
 
 class Dashboard(BaseModel):
     """Dashboard personalizado"""
@@ -88,6 +95,8 @@ class Metric(BaseModel):
         ]
     )
     alerts = models.ManyToManyField('Alert', related_name='metrics', blank=True)
+    # Valor da última atualização (analytics.rollup), sobre calculation['window']
+    current_value = models.FloatField(null=True, blank=True)
     last_updated = models.DateTimeField(null=True)
     is_active = models.BooleanField(default=True)
 
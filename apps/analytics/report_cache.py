@@ -0,0 +1,216 @@
+"""
+Reaproveitamento de resultados de relatórios entre execuções.
+
+A chave é a hash de (relatório, template, parâmetros normalizados, marca
+d'água dos dados). A marca d'água é o ``MAX(updated_at)`` e a contagem de
+linhas, na empresa, do modelo do relatório e de cada modelo relacionado que
+as colunas e filtros leem (``plan.related``), uma consulta agregada por
+modelo: inclusões, exclusões e alterações feitas com ``save()`` mudam a
+chave. Uma execução concluída com a mesma chave é devolvida sem rodar o
+relatório.
+
+Gravações que não tocam ``updated_at`` (``update()``, ``bulk_update`` sem o
+campo) não mudam a marca d'água; por isso uma execução só é reaproveitada
+por ``REPORT_CACHE_MAX_AGE`` segundos (15 minutos por padrão).
+
+Pedidos idênticos simultâneos rodam uma vez só: no processo, os seguintes
+esperam o primeiro; entre processos, uma trava no cache (``cache.add``) faz
+os demais aguardarem a execução aparecer no banco. Essa trava só vale entre
+processos com um cache compartilhado (Redis/Memcached em ``CACHES``); com o
+padrão do projeto (LocMem, um cache por processo) cada processo roda a sua
+execução. ReportExecution fica fora da auditoria (``core.audit``). Resultados acima de
+``INLINE_LIMIT`` bytes vão comprimidos para ``REPORT_RESULTS_DIR`` e a
+execução guarda só o caminho em ``file_output``.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from . import reports
+from .models import Report, ReportExecution
+
+
+INLINE_LIMIT = 256 * 1024
+LOCK_KEY = 'report-run:{key}'
+LOCK_TIMEOUT = 10 * 60
+WAIT_TIMEOUT = 5 * 60
+POLL_INTERVAL = 0.5
+MAX_AGE = 15 * 60
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def results_dir():
+    return str(getattr(settings, 'REPORT_RESULTS_DIR', os.path.join(settings.BASE_DIR, 'report_results')))
+
+
+def max_age():
+    return timedelta(seconds=getattr(settings, 'REPORT_CACHE_MAX_AGE', MAX_AGE))
+
+
+def _model_watermark(model, company_id):
+    fields = {field.name for field in model._meta.concrete_fields}
+    aggregates = {'rows': Count('pk')}
+    if 'updated_at' in fields:
+        aggregates['changed'] = Max('updated_at')
+    queryset = model._default_manager.all()
+    if 'company' in fields:
+        queryset = queryset.filter(company_id=company_id)
+    values = queryset.aggregate(**aggregates)
+    return [values.get('changed'), values['rows']]
+
+
+def watermark(plan, company_id):
+    """(última alteração, quantidade de linhas) na empresa da origem e dos modelos relacionados do plano"""
+    return [
+        [label, *_model_watermark(apps.get_model(label), company_id)]
+        for label in (plan.source, *plan.related)
+    ]
+
+
+def cache_key(report, plan, params):
+    raw = json.dumps(
+        [str(report.pk), plan.template_hash, params, watermark(plan, report.company_id)],
+        sort_keys=True, cls=DjangoJSONEncoder,
+    )
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _fresh_execution(report, key, now):
+    return (
+        ReportExecution.objects
+        .filter(report=report, cache_key=key, status='completed', end_time__gte=now - max_age())
+        .order_by('-end_time')
+        .first()
+    )
+
+
+def load_result(execution):
+    """ReportResult guardado na execução (no JSON ou no arquivo comprimido)"""
+    if execution.result_data is not None:
+        payload = execution.result_data
+    else:
+        with gzip.open(execution.file_output['path'], 'rt', encoding='utf-8') as source:
+            payload = json.load(source)
+    return reports.ReportResult(**payload)
+
+
+def _store(execution, result):
+    payload = json.dumps(result.as_dict(), cls=DjangoJSONEncoder)
+    if len(payload) <= INLINE_LIMIT:
+        execution.result_data = json.loads(payload)
+        execution.file_output = {'storage': 'inline', 'row_count': result.row_count}
+        return
+    directory = os.path.join(results_dir(), str(execution.report_id))
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{execution.pk}.json.gz')
+    with gzip.open(f'{path}.tmp', 'wt', encoding='utf-8') as output:
+        output.write(payload)
+    os.replace(f'{path}.tmp', path)
+    execution.result_data = None
+    execution.file_output = {
+        'storage': 'file',
+        'path': path,
+        'size': len(payload),
+        'compressed_size': os.path.getsize(path),
+        'row_count': result.row_count,
+    }
+
+
+def _compute(report, plan, params, key, executed_by):
+    start = timezone.now()
+    execution = ReportExecution(
+        report=report, executed_by=executed_by, start_time=start, status='running',
+        parameters_used=params, cache_key=key,
+    )
+    try:
+        result = reports.execute(plan, report.company_id, reports.bind_parameters(plan, params))
+    except Exception as error:
+        execution.status, execution.end_time, execution.error_message = 'failed', timezone.now(), str(error)
+        execution.save()
+        raise
+    _store(execution, result)
+    execution.status, execution.end_time = 'completed', timezone.now()
+    execution.save()
+    Report.objects.filter(pk=report.pk).update(last_generated=execution.end_time)
+    return execution
+
+
+def _wait_other_process(report, key):
+    """Espera a execução de outro processo; None se a trava sumir ou o tempo acabar"""
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        execution = _fresh_execution(report, key, timezone.now())
+        if execution is not None:
+            return execution
+        if cache.get(LOCK_KEY.format(key=key)) is None:
+            return None
+    return None
+
+
+def _single_flight(report, plan, params, key, executed_by):
+    lock_key = LOCK_KEY.format(key=key)
+    locked = cache.add(lock_key, 1, LOCK_TIMEOUT)
+    if not locked:
+        execution = _wait_other_process(report, key)
+        if execution is not None:
+            return execution
+    try:
+        return _fresh_execution(report, key, timezone.now()) or _compute(report, plan, params, key, executed_by)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+
+
+def get_or_run(report, params=None, executed_by=None, now=None):
+    """
+    Resultado do relatório, reaproveitando uma execução igual e recente.
+
+    Retorna ``(ReportResult, ReportExecution, reaproveitado)``.
+    """
+    plan = reports.plans.get(report.template)
+    normalized = reports.normalize_parameters(plan, report.parameters, params)
+    key = cache_key(report, plan, normalized)
+    execution = _fresh_execution(report, key, now or timezone.now())
+    if execution is not None:
+        return load_result(execution), execution, True
+
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = {'done': threading.Event(), 'execution': None, 'error': None}
+    if not leader:
+        flight['done'].wait()
+        if flight['error'] is not None:
+            raise flight['error']
+        return load_result(flight['execution']), flight['execution'], True
+    try:
+        flight['execution'] = _single_flight(report, plan, normalized, key, executed_by)
+    except Exception as error:
+        flight['error'] = error
+        raise
+    finally:
+        flight['done'].set()
+        with _flights_lock:
+            _flights.pop(key, None)
+    return load_result(flight['execution']), flight['execution'], False
+
+
+def delete_result_file(execution):
+    path = (execution.file_output or {}).get('path')
+    if path and os.path.exists(path):
+        os.remove(path)
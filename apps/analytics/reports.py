@@ -0,0 +1,417 @@
+"""
+Motor de relatórios (Report).
+
+``Report.template`` é compilado uma vez num plano validado (campos, agregações,
+filtros e parâmetros conferidos contra o modelo) e o plano fica em memória
+pela hash do template: execuções repetidas só ligam os parâmetros e rodam a
+consulta. O resultado é colunar (``{"coluna": [valores]}``) e é o mesmo para
+HTML, CSV e JSON.
+
+Formato do template::
+
+    {"source": "commerce.Order",
+     "columns": [{"name": "status", "field": "status"},
+                 {"name": "pedidos", "aggregate": "count"},
+                 {"name": "receita", "aggregate": "sum", "field": "total"}],
+     "filters": [{"field": "created_at", "op": "gte", "param": "start"},
+                 {"field": "status", "op": "in", "value": ["confirmed", "delivered"]}],
+     "params": {"start": {"type": "date", "required": true}},
+     "order_by": ["-receita"],
+     "limit": 1000}
+
+Colunas com ``field`` e sem ``aggregate`` agrupam as agregadas; sem nenhuma
+agregação o relatório lista as linhas. ``Report.parameters`` tem os valores
+padrão, sobrescritos pelos passados na execução.
+
+Só os modelos e caminhos de ``REPORT_SOURCES`` (mais ``settings.REPORT_SOURCES``)
+podem ser usados em colunas e filtros: usuários, senhas e dados de pagamento
+ficam fora dos relatórios mesmo quando alcançáveis por uma relação.
+"""
+import csv
+import hashlib
+import io
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Avg, Count, F, Max, Min, Sum
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.html import escape
+from django.utils.translation import gettext as _
+
+
+# Muda quando o formato do plano compilado muda, para não reaproveitar planos antigos
+PLAN_VERSION = 2
+PLAN_CACHE_SIZE = 256
+MAX_LIMIT = 50000
+DEFAULT_LIMIT = 1000
+AGGREGATES = {'count': Count, 'sum': Sum, 'avg': Avg, 'min': Min, 'max': Max}
+OPERATORS = {'eq': 'exact', 'ne': 'exact', 'gt': 'gt', 'gte': 'gte', 'lt': 'lt', 'lte': 'lte',
+             'in': 'in', 'contains': 'icontains', 'isnull': 'isnull'}
+PARAM_TYPES = ('str', 'int', 'float', 'decimal', 'bool', 'date', 'datetime', 'list')
+# Caminhos liberados em colunas e filtros, por modelo de origem (label em minúsculas)
+REPORT_SOURCES = {
+    'commerce.order': (
+        'created_at', 'order_number', 'status', 'payment_status', 'subtotal', 'tax_total', 'shipping_total',
+        'total', 'is_active', 'customer', 'customer__first_name', 'customer__last_name',
+        'customer__company_name', 'customer__customer_type',
+    ),
+    'commerce.product': (
+        'created_at', 'name', 'sku_prefix', 'view_count', 'base_price', 'tax_class', 'requires_shipping',
+        'is_active', 'catalog', 'catalog__name',
+    ),
+    'commerce.customer': (
+        'created_at', 'customer_type', 'first_name', 'last_name', 'company_name', 'email', 'phone',
+        'lifetime_value', 'is_active',
+    ),
+    'finacial.invoice': (
+        'created_at', 'invoice_number', 'issue_date', 'due_date', 'subtotal', 'tax_total', 'total', 'status',
+        'is_active', 'customer', 'customer__first_name', 'customer__last_name', 'customer__company_name',
+        'order', 'order__order_number',
+    ),
+    'marketing.leadmanagement': (
+        'created_at', 'source', 'status', 'score', 'is_active', 'campaign', 'campaign__name',
+        'campaign__campaign_type', 'customer',
+    ),
+    'marketing.marketingcampaign': (
+        'created_at', 'name', 'campaign_type', 'status', 'start_date', 'end_date', 'budget', 'actual_spend',
+        'is_active',
+    ),
+    'projects.project': (
+        'created_at', 'name', 'status', 'priority', 'start_date', 'end_date', 'budget', 'actual_cost',
+        'is_active', 'customer', 'customer__company_name',
+    ),
+}
+
+
+class ReportError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class Column:
+    name: str
+    path: str | None
+    aggregate: str | None
+
+
+@dataclass(frozen=True)
+class Filter:
+    lookup: str
+    negate: bool
+    value: object
+    param: str | None
+
+
+@dataclass(frozen=True)
+class CompiledPlan:
+    template_hash: str
+    source: str
+    columns: tuple
+    filters: tuple
+    params: tuple  # (nome, tipo, obrigatório, padrão)
+    order_by: tuple
+    limit: int
+    related: tuple  # labels dos modelos alcançados pelos caminhos, além da origem
+
+    @property
+    def dimensions(self):
+        return [column for column in self.columns if column.aggregate is None]
+
+    @property
+    def aggregates(self):
+        return [column for column in self.columns if column.aggregate is not None]
+
+
+@dataclass
+class ReportResult:
+    """Resultado colunar: ``data[coluna]`` é a lista de valores da coluna"""
+    columns: list
+    data: dict
+    row_count: int
+
+    def rows(self):
+        return zip(*(self.data[name] for name in self.columns))
+
+    def as_dict(self):
+        return {'columns': self.columns, 'data': self.data, 'row_count': self.row_count}
+
+
+def template_hash(template):
+    canonical = json.dumps([PLAN_VERSION, template], sort_keys=True, separators=(',', ':'), cls=DjangoJSONEncoder)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def report_fields(model):
+    """Caminhos liberados para o modelo, ou None se ele não pode ser origem de relatório"""
+    sources = {**REPORT_SOURCES, **getattr(settings, 'REPORT_SOURCES', {})}
+    fields = sources.get(model._meta.label_lower)
+    return frozenset(fields) if fields is not None else None
+
+
+def _check_path(model, path, allowed, related):
+    """
+    Confere um caminho ``campo__relacao__campo`` contra a lista liberada e os
+    modelos; os modelos cujos campos o caminho lê vão para ``related``.
+    """
+    if not isinstance(path, str) or path not in allowed:
+        raise ReportError(f"Field {path!r} is not available in reports")
+    current = model
+    parts = path.split('__')
+    for index, part in enumerate(parts):
+        try:
+            field = current._meta.get_field(part)
+        except FieldDoesNotExist as error:
+            raise ReportError(f"Unknown field {path!r}") from error
+        if field.is_relation and field.related_model is not None:
+            current = field.related_model
+            if index != len(parts) - 1:
+                related.add(current._meta.label_lower)
+        elif index != len(parts) - 1:
+            raise ReportError(f"Unknown field {path!r}")
+    return path
+
+
+def compile_template(template):
+    """Valida o template e devolve o plano; não consulta o banco"""
+    if not isinstance(template, dict):
+        raise ReportError("Report template must be an object")
+    try:
+        model = apps.get_model(template['source'])
+    except (KeyError, LookupError, ValueError) as error:
+        raise ReportError(f"Invalid report source {template.get('source')!r}") from error
+    if not any(field.name == 'company' for field in model._meta.get_fields()):
+        raise ReportError(f"Report source {model._meta.label} has no company")
+    allowed = report_fields(model)
+    if allowed is None:
+        raise ReportError(f"Report source {model._meta.label} is not available")
+    related = set()
+
+    columns = []
+    for spec in template.get('columns') or []:
+        if not isinstance(spec, dict) or not spec.get('name'):
+            raise ReportError("Every column needs a name")
+        aggregate = spec.get('aggregate')
+        if aggregate is not None and aggregate not in AGGREGATES:
+            raise ReportError(f"Unknown aggregate {aggregate!r}")
+        path = spec.get('field')
+        if path is None and aggregate != 'count':
+            raise ReportError(f"Column {spec['name']!r} needs a field")
+        columns.append(Column(str(spec['name']), _check_path(model, path, allowed, related) if path else None, aggregate))
+    if not columns:
+        raise ReportError("Report template has no columns")
+    names = [column.name for column in columns]
+    if len(set(names)) != len(names):
+        raise ReportError("Column names must be unique")
+
+    params = []
+    for name, spec in (template.get('params') or {}).items():
+        spec = spec if isinstance(spec, dict) else {'type': spec}
+        kind = spec.get('type', 'str')
+        if kind not in PARAM_TYPES:
+            raise ReportError(f"Unknown parameter type {kind!r}")
+        params.append((name, kind, bool(spec.get('required')), spec.get('default')))
+    declared = {name for name, *_rest in params}
+
+    filters = []
+    for spec in template.get('filters') or []:
+        if not isinstance(spec, dict) or 'field' not in spec:
+            raise ReportError("Every filter needs a field")
+        op = spec.get('op', 'eq')
+        if op not in OPERATORS:
+            raise ReportError(f"Unknown filter operator {op!r}")
+        param = spec.get('param')
+        if param is not None and param not in declared:
+            raise ReportError(f"Filter uses undeclared parameter {param!r}")
+        lookup = f"{_check_path(model, spec['field'], allowed, related)}__{OPERATORS[op]}"
+        filters.append(Filter(lookup, op == 'ne', spec.get('value'), param))
+
+    order_by = []
+    for item in template.get('order_by') or []:
+        if str(item).lstrip('-') not in names:
+            raise ReportError(f"Cannot order by unknown column {item!r}")
+        order_by.append(str(item))
+    try:
+        limit = min(int(template.get('limit', DEFAULT_LIMIT)), MAX_LIMIT)
+    except (TypeError, ValueError) as error:
+        raise ReportError("Invalid limit") from error
+
+    return CompiledPlan(
+        template_hash=template_hash(template),
+        source=model._meta.label_lower,
+        columns=tuple(columns),
+        filters=tuple(filters),
+        params=tuple(params),
+        order_by=tuple(order_by),
+        limit=limit,
+        related=tuple(sorted(related)),
+    )
+
+
+class PlanCache:
+    """Planos compilados por hash do template, com descarte do menos usado"""
+
+    def __init__(self, size=PLAN_CACHE_SIZE):
+        self.size = size
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, template):
+        key = template_hash(template)
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+                return plan
+        plan = compile_template(template)
+        with self._lock:
+            self._plans[key] = plan
+            while len(self._plans) > self.size:
+                self._plans.popitem(last=False)
+        return plan
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+
+
+plans = PlanCache()
+
+
+def _coerce(name, kind, value):
+    if value is None:
+        return None
+    try:
+        if kind == 'int':
+            return int(value)
+        if kind == 'float':
+            return float(value)
+        if kind == 'decimal':
+            return Decimal(str(value))
+        if kind == 'bool':
+            return value if isinstance(value, bool) else str(value).lower() in ('1', 'true', 'yes', 'on')
+        if kind == 'date':
+            parsed = value if isinstance(value, date) else parse_date(str(value))
+        elif kind == 'datetime':
+            parsed = value if isinstance(value, datetime) else parse_datetime(str(value))
+        elif kind == 'list':
+            return list(value) if isinstance(value, (list, tuple)) else [item.strip() for item in str(value).split(',')]
+        else:
+            return str(value)
+    except (TypeError, ValueError, InvalidOperation) as error:
+        raise ReportError(f"Invalid value for parameter {name!r}") from error
+    if parsed is None:
+        raise ReportError(f"Invalid value for parameter {name!r}")
+    return parsed
+
+
+def bind_parameters(plan, defaults=None, values=None):
+    """Valores dos parâmetros do plano, já convertidos; ignora os não declarados"""
+    supplied = {**(defaults or {}), **(values or {})}
+    bound = {}
+    for name, kind, required, default in plan.params:
+        value = supplied.get(name, default)
+        if value in (None, '') and required:
+            raise ReportError(f"Missing required parameter {name!r}")
+        bound[name] = _coerce(name, kind, value if value != '' else None)
+    return bound
+
+
+def normalize_parameters(plan, defaults=None, values=None):
+    """Parâmetros ligados em forma canônica (JSON), para comparar execuções"""
+    return json.loads(json.dumps(bind_parameters(plan, defaults, values), sort_keys=True, cls=DjangoJSONEncoder))
+
+
+def execute(plan, company_id, params):
+    """Roda o plano para a empresa com os parâmetros já ligados; devolve ReportResult"""
+    model = apps.get_model(plan.source)
+    queryset = model._default_manager.filter(company_id=company_id)
+    for item in plan.filters:
+        value = params.get(item.param) if item.param else item.value
+        if item.param and value is None:
+            # Parâmetro opcional sem valor: o filtro não se aplica
+            continue
+        condition = {item.lookup: value}
+        queryset = queryset.exclude(**condition) if item.negate else queryset.filter(**condition)
+
+    aliases = {column.name: f'c{index}' for index, column in enumerate(plan.columns)}
+    dimensions = {aliases[column.name]: F(column.path) for column in plan.dimensions}
+    aggregates = {
+        aliases[column.name]: AGGREGATES[column.aggregate](column.path or 'pk')
+        for column in plan.aggregates
+    }
+    ordering = [f"{'-' if item.startswith('-') else ''}{aliases[item.lstrip('-')]}" for item in plan.order_by]
+    if aggregates and not dimensions:
+        row = queryset.aggregate(**aggregates)
+        rows = [tuple(row[aliases[column.name]] for column in plan.columns)]
+    else:
+        queryset = queryset.values(**dimensions)
+        if aggregates:
+            queryset = queryset.annotate(**aggregates)
+        queryset = queryset.order_by(*ordering) if ordering else queryset.order_by()
+        rows = list(queryset.values_list(*(aliases[column.name] for column in plan.columns))[:plan.limit])
+
+    names = [column.name for column in plan.columns]
+    columns = list(zip(*rows)) if rows else [() for _name in names]
+    return ReportResult(names, {name: list(values) for name, values in zip(names, columns)}, len(rows))
+
+
+def run(report, params=None):
+    """Compila (ou reaproveita) o plano do relatório, liga os parâmetros e executa"""
+    plan = plans.get(report.template)
+    return execute(plan, report.company_id, bind_parameters(plan, report.parameters, params))
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def render_json(result):
+    return json.dumps(result.as_dict(), cls=DjangoJSONEncoder)
+
+
+def render_csv(result):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(result.columns)
+    for row in result.rows():
+        writer.writerow([_text(value) for value in row])
+    return output.getvalue()
+
+
+def render_html(result, title=''):
+    head = ''.join(f'<th>{escape(name)}</th>' for name in result.columns)
+    body = ''.join(
+        '<tr>' + ''.join(f'<td>{escape(_text(value))}</td>' for value in row) + '</tr>'
+        for row in result.rows()
+    )
+    caption = f'<caption>{escape(title)}</caption>' if title else ''
+    empty = '' if result.row_count else f'<p>{escape(_("No data for this report."))}</p>'  # FR: Aucune donnée pour ce rapport.
+    return f'<table class="table report">{caption}<thead><tr>{head}</tr></thead><tbody>{body}</tbody></table>{empty}'
+
+
+RENDERERS = {
+    'json': ('application/json', render_json),
+    'csv': ('text/csv', render_csv),
+    'html': ('text/html', render_html),
+}
+
+
+def render(result, output_format='json'):
+    """(content_type, conteúdo) no formato pedido"""
+    try:
+        content_type, renderer = RENDERERS[output_format]
+    except KeyError as error:
+        raise ReportError(f"Unknown report format {output_format!r}") from error
+    return content_type, renderer(result)
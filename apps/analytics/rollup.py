@@ -0,0 +1,77 @@
+"""
+Atualização periódica dos valores das métricas.
+
+Cada métrica é calculada sobre ``calculation['window']`` (padrão ``"30d"``);
+as métricas que compartilham a consulta são calculadas juntas. Os valores
+vão para ``Metric.current_value`` num ``bulk_update``, os alertas de todas
+as métricas recalculadas são avaliados em seguida (a sequência de violações
+conta avaliações, mesmo com o valor parado) e os painéis abertos recebem as
+métricas que mudaram.
+"""
+import logging
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from core import push
+from . import alerts
+from . import metrics as metric_engine
+from .models import Metric
+
+
+logger = logging.getLogger(__name__)
+
+BULK_SIZE = 1000
+
+
+def compute(metrics, now=None):
+    """``{metric_id: valor}``; métricas com cálculo inválido ficam de fora"""
+    groups = defaultdict(list)
+    for metric in metrics:
+        calculation = metric.calculation if isinstance(metric.calculation, dict) else {}
+        try:
+            metric_engine.aggregate_for(metric)
+            period = metric_engine.resolve_period(calculation.get('window'), now)
+            groups[metric_engine.query_key(metric, period)].append(metric)
+        except metric_engine.MetricError as error:
+            logger.warning("Skipping metric %s: %s", metric.pk, error)
+    values = {}
+    for key, group in groups.items():
+        try:
+            values.update(metric_engine.run_query(key, group))
+        except Exception:
+            logger.exception("Metric query failed for %s", key.source)
+    return values
+
+
+def refresh(metrics=None, frequency=None, now=None):
+    """Recalcula as métricas ativas (opcionalmente só de uma frequência); retorna as alteradas"""
+    now = now or timezone.now()
+    if metrics is None:
+        metrics = Metric.objects.filter(is_active=True)
+        if frequency:
+            metrics = metrics.filter(update_frequency=frequency)
+    metrics = list(metrics)
+    values = compute(metrics, now)
+    changed = []
+    for metric in metrics:
+        if metric.pk not in values:
+            continue
+        value = None if values[metric.pk] is None else float(values[metric.pk])
+        metric.last_updated = now
+        if value != metric.current_value:
+            metric.current_value = value
+            changed.append(metric)
+    with transaction.atomic():
+        Metric.objects.bulk_update(
+            [metric for metric in metrics if metric.pk in values], ['current_value', 'last_updated'], batch_size=BULK_SIZE,
+        )
+        alerts.evaluate({metric.pk: metric.current_value for metric in metrics if metric.pk in values}, now)
+    transaction.on_commit(lambda: publish(changed))
+    return changed
+
+
+def publish(metrics):
+    for metric in metrics:
+        push.publish_metric(metric)
@@ -0,0 +1,19 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core import push
+
+from . import report_cache
+from .models import Metric, ReportExecution
+
+
+@receiver(post_save, sender=Metric)
+def push_metric_update(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(lambda: push.publish_metric(instance))
+
+
+@receiver(post_delete, sender=ReportExecution)
+def delete_report_result_file(sender, instance, **kwargs):
+    transaction.on_commit(lambda: report_cache.delete_result_file(instance))
@@ -0,0 +1,266 @@
+import json
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from commerce.models import Product, ProductCatalog
+from companies.models import Company, CompanyUser
+from core.models import AuditLog, Language
+from . import alerts, report_cache, reports, rollup
+from .dashboards import resolve_widgets
+from .models import Alert, Dashboard, Metric, Report, ReportExecution
+
+
+def create_company(suffix=''):
+    owner = get_user_model().objects.create_user(email=f'owner{suffix}@example.com', password='secret')
+    language, _ = Language.objects.get_or_create(
+        code='fr', defaults={'name': 'French', 'native_name': 'Français', 'date_format': 'd/m/Y'}
+    )
+    return Company.objects.create(
+        owner=owner, business_name='Batmart', trading_name='Batmart', tax_id=f'FR{suffix}',
+        registration_number='1', legal_form='SAS', primary_language=language,
+    )
+
+
+def create_products(company, count=3):
+    catalog = ProductCatalog.objects.create(company=company, name='Outillage')
+    return [
+        Product.objects.create(
+            catalog=catalog, company=company, name=f'Perceuse {index}', description='', sku_prefix=f'P{index}',
+            base_price=10 * (index + 1), tax_class='ab'[index % 2],
+        )
+        for index in range(count)
+    ]
+
+
+def create_metric(company, **fields):
+    return Metric.objects.create(**{
+        'company': company, 'name': 'Produits', 'description': '', 'metric_type': 'count',
+        'calculation': {'source': 'commerce.Product'}, 'update_frequency': 'hourly', **fields,
+    })
+
+
+class DashboardBreakdownTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.company = create_company('1')
+        self.products = create_products(self.company)
+        self.metric = create_metric(self.company, dimensions=['tax_class', {'field': 'catalog'}])
+
+    def resolve(self, dimension):
+        dashboard = Dashboard.objects.create(
+            company=self.company, name='Ventes', description='', layout={},
+            widgets=[{'id': 'w', 'metric': str(self.metric.pk), 'type': 'breakdown', 'dimension': dimension}],
+        )
+        return resolve_widgets(dashboard)['w']
+
+    def test_listed_dimension_is_grouped(self):
+        self.assertEqual(self.resolve('tax_class')['value'], {'a': 2, 'b': 1})
+
+    def test_unlisted_dimension_is_rejected(self):
+        widget = self.resolve('company__owner__password')
+        self.assertIn('error', widget)
+        self.assertNotIn('value', widget)
+
+    def test_foreign_key_dimension_renders_as_json(self):
+        widget = self.resolve('catalog')
+        self.assertEqual(widget['value'], {str(self.products[0].catalog_id): 3})
+        JSONRenderer().render({'widgets': {'w': widget}})
+
+
+
+class DashboardPermissionTests(TestCase):
+    def setUp(self):
+        self.company = create_company('5')
+        self.members = {
+            level: CompanyUser.objects.create(
+                company=self.company, user=get_user_model().objects.create_user(email=f'{level}@example.com', password='x'),
+                job_title=level, department='Ventes' if level == 'staff' else 'Achats', status='active',
+                access_level=level,
+            )
+            for level in ('admin', 'manager', 'staff')
+        }
+        self.dashboard = Dashboard.objects.create(
+            company=self.company, name='Direction', description='', layout={}, widgets=[],
+            permissions={'access_levels': ['manager']},
+        )
+
+    def status(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.get(reverse('analytics-api:dashboard_data', args=[self.dashboard.pk])).status_code
+
+    def test_permissions_are_enforced(self):
+        self.assertEqual({level: self.status(member.user) for level, member in self.members.items()}, {
+            'admin': 200, 'manager': 200, 'staff': 403,
+        })
+        self.dashboard.permissions = {'departments': ['Ventes']}
+        self.dashboard.save()
+        self.assertEqual(self.status(self.members['staff'].user), 200)
+        self.dashboard.permissions = {'users': [str(self.members['admin'].pk)], 'public': True}
+        self.dashboard.save()
+        self.assertEqual(self.status(self.members['manager'].user), 403)
+
+    def test_non_members_do_not_see_the_dashboard(self):
+        outsider = get_user_model().objects.create_user(email='outsider@example.com', password='x')
+        self.assertEqual(self.status(outsider), 404)
+        self.dashboard.permissions = {}
+        self.dashboard.save()
+        self.assertEqual(self.status(self.members['staff'].user), 200)
+
+
+class AlertTests(TestCase):
+    def setUp(self):
+        self.company = create_company('2')
+        create_products(self.company)
+        self.metric = create_metric(self.company)
+
+    def create_alert(self, condition, name='Stock'):
+        return Alert.objects.create(
+            company=self.company, metric=self.metric, name=name, description='', condition=condition,
+            severity='warning', notification_channels=['in_app'],
+        )
+
+    def test_condition_settings(self):
+        self.assertEqual(alerts.condition_settings({'for': '3', 'cooldown': 60}), (3, 60.0))
+        self.assertEqual(alerts.condition_settings({}), (1, alerts.DEFAULT_COOLDOWN))
+        for condition in ({'for': 'x'}, {'cooldown': None}, {'for': float('inf')}, [], None):
+            with self.assertRaises((TypeError, ValueError, OverflowError)):
+                alerts.condition_settings(condition)
+
+    def test_streak_and_cooldown(self):
+        alert = self.create_alert({'operator': 'gte', 'threshold': 3, 'for': 2, 'cooldown': 3600})
+        self.assertEqual(alerts.evaluate({self.metric.pk: 3}), [])
+        self.assertEqual(alerts.evaluate({self.metric.pk: 3}), [alert])
+        self.assertEqual(alerts.evaluate({self.metric.pk: 3}), [])
+        alert.refresh_from_db()
+        self.assertEqual(alert.metadata[alerts.STREAK_KEY], 3)
+
+    def test_malformed_condition_is_skipped(self):
+        bad = [self.create_alert({'threshold': 1, 'for': 'x'}), self.create_alert({'threshold': 1, 'cooldown': None})]
+        good = self.create_alert({'operator': 'gt', 'threshold': 1})
+        with self.assertLogs('analytics.alerts', 'WARNING'):
+            self.assertEqual(alerts.evaluate({self.metric.pk: 3}), [good])
+        for alert in bad:
+            alert.refresh_from_db()
+            self.assertIsNone(alert.last_triggered)
+
+    def test_malformed_condition_keeps_metric_values(self):
+        self.create_alert({'threshold': 1, 'for': 'x'})
+        with self.assertLogs('analytics.alerts', 'WARNING'):
+            rollup.refresh()
+        self.metric.refresh_from_db()
+        self.assertEqual(self.metric.current_value, 3)
+
+
+PRODUCT_TEMPLATE = {
+    'source': 'commerce.Product',
+    'columns': [
+        {'name': 'catalogue', 'field': 'catalog__name'},
+        {'name': 'produits', 'aggregate': 'count'},
+        {'name': 'total', 'aggregate': 'sum', 'field': 'base_price'},
+    ],
+    'filters': [{'field': 'base_price', 'op': 'gte', 'param': 'min'}],
+    'params': {'min': {'type': 'decimal', 'required': True}},
+}
+
+
+class ReportTests(TestCase):
+    def setUp(self):
+        self.company = create_company('3')
+        create_products(self.company)
+
+    def test_compile(self):
+        plan = reports.compile_template(PRODUCT_TEMPLATE)
+        self.assertEqual(plan.source, 'commerce.product')
+        self.assertEqual([column.path for column in plan.columns], ['catalog__name', None, 'base_price'])
+        self.assertEqual(plan.filters[0].lookup, 'base_price__gte')
+
+    def test_paths_outside_allowlist_are_rejected(self):
+        for path in ('company__owner__password', 'created_by__email', 'catalog__company__tax_id', 'seo_data'):
+            for template in (
+                {**PRODUCT_TEMPLATE, 'columns': [{'name': 'x', 'field': path}]},
+                {**PRODUCT_TEMPLATE, 'filters': [{'field': path, 'op': 'isnull', 'value': False}]},
+            ):
+                with self.subTest(path=path), self.assertRaises(reports.ReportError):
+                    reports.compile_template(template)
+
+    def test_unlisted_source_is_rejected(self):
+        with self.assertRaises(reports.ReportError):
+            reports.compile_template({'source': 'commerce.Cart', 'columns': [{'name': 'n', 'aggregate': 'count'}]})
+        with self.assertRaises(reports.ReportError):
+            reports.compile_template({'source': 'companies.CompanyUser', 'columns': [{'name': 'n', 'aggregate': 'count'}]})
+
+    def test_bind(self):
+        plan = reports.compile_template(PRODUCT_TEMPLATE)
+        self.assertEqual(reports.bind_parameters(plan, {'min': '5'}, {'min': '20.5'}), {'min': Decimal('20.5')})
+        with self.assertRaises(reports.ReportError):
+            reports.bind_parameters(plan)
+        with self.assertRaises(reports.ReportError):
+            reports.bind_parameters(plan, values={'min': 'beaucoup'})
+
+    def test_run_and_render(self):
+        report = Report(company=self.company, template=PRODUCT_TEMPLATE, parameters={'min': '20'})
+        result = reports.run(report)
+        self.assertEqual(result.as_dict(), {
+            'columns': ['catalogue', 'produits', 'total'],
+            'data': {'catalogue': ['Outillage'], 'produits': [2], 'total': [Decimal('50')]},
+            'row_count': 1,
+        })
+        self.assertEqual(reports.render(result, 'csv'), ('text/csv', 'catalogue,produits,total\r\nOutillage,2,50\r\n'))
+        content_type, html = reports.render(result, 'html')
+        self.assertEqual(content_type, 'text/html')
+        self.assertIn('<td>Outillage</td>', html)
+        self.assertEqual(json.loads(reports.render(result, 'json')[1])['data']['produits'], [2])
+        with self.assertRaises(reports.ReportError):
+            reports.render(result, 'pdf')
+
+
+class ReportCacheTests(TestCase):
+    def setUp(self):
+        self.company = create_company('4')
+        self.products = create_products(self.company)
+        self.report = Report.objects.create(
+            company=self.company, name='Produits', description='', report_type='sales',
+            template=PRODUCT_TEMPLATE, parameters={'min': '0'},
+        )
+
+    def test_same_data_is_reused(self):
+        first = report_cache.get_or_run(self.report)
+        self.assertFalse(first[2])
+        self.assertEqual(report_cache.get_or_run(self.report)[1].pk, first[1].pk)
+
+    def test_related_model_change_refreshes(self):
+        self.assertEqual(reports.plans.get(PRODUCT_TEMPLATE).related, ('commerce.productcatalog',))
+        report_cache.get_or_run(self.report)
+        catalog = self.products[0].catalog
+        catalog.name = 'Jardinage'
+        catalog.save()
+        result, _execution, reused = report_cache.get_or_run(self.report)
+        self.assertFalse(reused)
+        self.assertEqual(result.data['catalogue'], ['Jardinage'])
+
+    @override_settings(REPORT_CACHE_MAX_AGE=60)
+    def test_reuse_is_limited_to_max_age(self):
+        report_cache.get_or_run(self.report)
+        # update() não toca updated_at: só o prazo separa o resultado antigo do novo
+        Product.objects.filter(company=self.company).update(base_price=1)
+        self.assertTrue(report_cache.get_or_run(self.report)[2])
+        ReportExecution.objects.update(end_time=timezone.now() - timedelta(minutes=2))
+        result, _execution, reused = report_cache.get_or_run(self.report)
+        self.assertFalse(reused)
+        self.assertEqual(result.data['total'], ['3'])
+
+    @override_settings(AUDIT_ASYNC=False)
+    def test_executions_are_not_audited(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            report_cache.get_or_run(self.report)
+        self.assertTrue(ReportExecution.objects.exists())
+        self.assertFalse(AuditLog.objects.filter(entity_type='analytics.reportexecution').exists())
@@ -0,0 +1,123 @@
+"""
+API pública e somente leitura da vitrine de produtos.
+
+Uma requisição repetida é respondida do cache sem consultar o banco (ou com
+304 se o ``If-None-Match`` bater). Sem entrada no cache, uma única consulta
+agregada gera o ETag forte e já responde 304 antes de montar a página.
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.functional import cached_property
+from django.utils.http import parse_etags
+from rest_framework import generics
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+
+from companies.models import Company
+from . import storefront
+from .serializers import StorefrontProductSerializer
+
+
+class StorefrontPagination(PageNumberPagination):
+    page_size = 24
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class StorefrontCacheMixin:
+    """GET com cache por versão da empresa, ETag forte e Cache-Control"""
+
+    permission_classes = [AllowAny]
+    # Parâmetros de consulta que mudam a resposta; só eles entram na chave do cache e no ETag
+    cache_query_params = ()
+
+    @property
+    def authenticated(self):
+        return bool(self.request.user and self.request.user.is_authenticated)
+
+    @cached_property
+    def company(self):
+        return get_object_or_404(Company.objects.only('pk', 'company_settings'), pk=self.kwargs['company_id'])
+
+    def visible_products(self):
+        return storefront.visible_products(self.kwargs['company_id'], self.authenticated)
+
+    def validator_queryset(self):
+        return self.visible_products()
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs['fields'] = storefront.product_fields(self.company)
+        return super().get_serializer(*args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        company_id = kwargs['company_id']
+        version = storefront.current_version(company_id)
+        identity = storefront.request_identity(request.path, request.query_params, self.cache_query_params)
+        key = storefront.response_key(company_id, version, identity, self.authenticated)
+        entry = cache.get(key)
+        if entry is None:
+            state = storefront.validator(self.validator_queryset())
+            etag = storefront.strong_etag(identity, self.authenticated, *state.values())
+            if state['count'] and self.not_modified(request, etag):
+                return self.finalize(Response(status=304), etag)
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            cache.set(key, (etag, response.data), storefront.RESPONSE_TIMEOUT)
+        else:
+            etag, data = entry
+            if self.not_modified(request, etag):
+                return self.finalize(Response(status=304), etag)
+            response = Response(data)
+        return self.finalize(response, etag)
+
+    def not_modified(self, request, etag):
+        etags = parse_etags(request.headers.get('If-None-Match', ''))
+        return '*' in etags or etag in etags
+
+    def finalize(self, response, etag):
+        response['ETag'] = etag
+        max_age = getattr(settings, 'STOREFRONT_CACHE_MAX_AGE', 60)
+        if self.authenticated:
+            patch_cache_control(response, private=True, max_age=max_age)
+        else:
+            patch_cache_control(response, public=True, max_age=max_age)
+        patch_vary_headers(response, ['Accept', 'Authorization', 'Cookie'])
+        return response
+
+
+class StorefrontProductListView(StorefrontCacheMixin, generics.ListAPIView):
+    serializer_class = StorefrontProductSerializer
+    pagination_class = StorefrontPagination
+    cache_query_params = ('catalog', StorefrontPagination.page_query_param, StorefrontPagination.page_size_query_param)
+
+    def filtered_products(self):
+        products = self.visible_products()
+        catalog = self.request.query_params.get('catalog')
+        if catalog:
+            try:
+                products = products.filter(catalog_id=uuid.UUID(catalog))
+            except ValueError:
+                products = products.none()
+        return products
+
+    def get_queryset(self):
+        return storefront.with_storefront_data(self.filtered_products()).order_by('name', 'pk')
+
+    def validator_queryset(self):
+        return self.filtered_products()
+
+
+class StorefrontProductDetailView(StorefrontCacheMixin, generics.RetrieveAPIView):
+    serializer_class = StorefrontProductSerializer
+
+    def get_queryset(self):
+        return storefront.with_storefront_data(self.visible_products())
+
+    def validator_queryset(self):
+        return self.visible_products().filter(pk=self.kwargs['pk'])
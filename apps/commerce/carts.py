@@ -0,0 +1,407 @@
+"""
+Serviço de carrinho com carrinhos ativos no cache e gravação adiada.
+
+O carrinho de cada cliente fica no cache numa forma compacta
+``(cart_id, touched_at, ((product_id, quantity), ...))``; adicionar ou
+remover itens só escreve no cache e marca o cliente como pendente. Um thread
+grava os pendentes em lote a cada ``FLUSH_INTERVAL`` segundos (um
+``bulk_create``/``bulk_update`` de Cart e um DELETE + ``bulk_create`` de
+CartItem para todo o lote). O checkout grava o carrinho na hora.
+
+Os pendentes ficam no processo que fez a alteração. O cache precisa ser
+compartilhado (Redis/Memcached em ``CACHES``) para o carrinho seguir o
+cliente entre processos: o projeto não define ``CACHES`` e o padrão do Django
+é LocMem, um cache por processo, em que cada worker vê o seu próprio
+carrinho. Com um cache assim, o primeiro uso registra um aviso no log.
+Totais usam ``Product.base_price`` lido numa única consulta.
+
+O checkout encerra o Cart com ``updated_at`` posterior ao último uso; uma
+gravação atrasada do mesmo carrinho encontra essa lápide e é ignorada, e um
+Cart inativo nunca volta a ficar ativo.
+
+Se o lote falhar por causa dos dados de um carrinho (cliente ou produto
+excluído no meio-tempo), os carrinhos são gravados um a um e os que falham
+vão para a quarentena, sem travar o restante do lote.
+"""
+import atexit
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from .models import Cart, CartItem, Customer, Product
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY = 'cart:{customer_id}'
+# Carrinho sem alteração por mais que isso é considerado abandonado
+CART_IDLE = timedelta(days=7)
+FLUSH_INTERVAL = 30
+FLUSH_BATCH_SIZE = 500
+MAX_QUANTITY = 999
+# Erros causados pelos dados de um carrinho; os demais (banco fora do ar) valem para o lote todo
+CART_DATA_ERRORS = (IntegrityError, ValidationError, ValueError)
+
+
+class InvalidCartItem(ValidationError):
+    """Produto inexistente, inativo ou de outra empresa"""
+
+
+class HotCart:
+    """Carrinho em memória; ``items`` mapeia product_id (str) para quantidade"""
+
+    __slots__ = ('customer_id', 'cart_id', 'touched_at', 'items')
+
+    def __init__(self, customer_id, cart_id=None, touched_at=None, items=None):
+        self.customer_id = customer_id
+        self.cart_id = cart_id
+        self.touched_at = touched_at or int(time.time())
+        self.items = dict(items or {})
+
+    def pack(self):
+        return (self.cart_id, self.touched_at, tuple(self.items.items()))
+
+    @classmethod
+    def unpack(cls, customer_id, value):
+        cart_id, touched_at, items = value
+        return cls(customer_id, cart_id, touched_at, items)
+
+
+def cache_key(customer_id):
+    return CACHE_KEY.format(customer_id=customer_id)
+
+
+def _customer_id(customer):
+    return str(getattr(customer, 'pk', customer))
+
+
+class CartStore:
+    """Leitura e escrita dos carrinhos no cache e registro dos pendentes de gravação"""
+
+    def __init__(self):
+        self._dirty = set()
+        self._quarantined = set()
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def load(self, customer):
+        customer_id = _customer_id(customer)
+        value = cache.get(cache_key(customer_id))
+        if value is not None:
+            return HotCart.unpack(customer_id, value)
+        return self._load_from_db(customer_id)
+
+    def _load_from_db(self, customer_id):
+        cart = Cart.objects.filter(customer_id=customer_id, is_active=True).order_by('-updated_at').first()
+        if cart is None:
+            return HotCart(customer_id)
+        items = {str(product_id): quantity for product_id, quantity in cart.items.values_list('product_id', 'quantity')}
+        return HotCart(customer_id, str(cart.pk), int(cart.updated_at.timestamp()), items)
+
+    def save(self, hot):
+        hot.touched_at = int(time.time())
+        cache.set(cache_key(hot.customer_id), hot.pack(), int(CART_IDLE.total_seconds()))
+        self.mark_dirty([hot.customer_id])
+        self._ensure_flusher()
+
+    def discard(self, customer_id):
+        cache.delete(cache_key(customer_id))
+        with self._lock:
+            self._dirty.discard(customer_id)
+
+    def mark_dirty(self, customer_ids):
+        with self._lock:
+            self._dirty.update(customer_ids)
+            self._quarantined.difference_update(self._dirty)
+
+    def quarantine(self, customer_id):
+        """Tira o carrinho das próximas gravações até ele ser alterado de novo"""
+        with self._lock:
+            self._dirty.discard(customer_id)
+            self._quarantined.add(customer_id)
+
+    def quarantined(self):
+        with self._lock:
+            return set(self._quarantined)
+
+    def take_dirty(self, limit=None):
+        with self._lock:
+            if limit is None or limit >= len(self._dirty):
+                taken, self._dirty = self._dirty, set()
+            else:
+                taken = {self._dirty.pop() for _ in range(limit)}
+        return taken
+
+    def _ensure_flusher(self):
+        if self._flusher is None:
+            with self._lock:
+                if self._flusher is None:
+                    if isinstance(caches[DEFAULT_CACHE_ALIAS], (LocMemCache, DummyCache)):
+                        logger.warning(
+                            "Cart cache %s is per process; carts will not follow customers across workers",
+                            type(caches[DEFAULT_CACHE_ALIAS]).__name__,
+                        )
+                    self._flusher = threading.Thread(target=self._run, name='cart-flusher', daemon=True)
+                    self._flusher.start()
+
+    def _run(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                close_old_connections()
+                flush()
+            except Exception:
+                logger.exception("Cart flush failed")
+
+
+store = CartStore()
+
+
+def get_cart(customer):
+    return store.load(customer)
+
+
+def _product_key(customer, product_id):
+    """Chave do produto no carrinho; só aceita produto ativo da empresa do cliente"""
+    try:
+        key = str(uuid.UUID(str(product_id)))
+    except ValueError:
+        raise InvalidCartItem(_("Invalid product."))  # FR: Produit invalide.
+    products = Product.objects.filter(pk=key, is_active=True)
+    company_id = getattr(customer, 'company_id', None)
+    if company_id is not None:
+        products = products.filter(company_id=company_id)
+    else:
+        products = products.filter(company__customers=_customer_id(customer))
+    if not products.exists():
+        raise InvalidCartItem(_("This product is not available."))  # FR: Ce produit n'est pas disponible.
+    return key
+
+
+def add_item(customer, product_id, quantity=1):
+    # Tirar unidades não depende do produto continuar à venda
+    key = _product_key(customer, product_id) if quantity > 0 else str(product_id)
+    hot = store.load(customer)
+    hot.items[key] = min(hot.items.get(key, 0) + quantity, MAX_QUANTITY)
+    if hot.items[key] <= 0:
+        del hot.items[key]
+    store.save(hot)
+    return hot
+
+
+def set_quantity(customer, product_id, quantity):
+    key = _product_key(customer, product_id) if quantity > 0 else str(product_id)
+    hot = store.load(customer)
+    if quantity > 0:
+        hot.items[key] = min(quantity, MAX_QUANTITY)
+    else:
+        hot.items.pop(key, None)
+    store.save(hot)
+    return hot
+
+
+def remove_item(customer, product_id):
+    return set_quantity(customer, product_id, 0)
+
+
+def clear(customer):
+    hot = store.load(customer)
+    hot.items = {}
+    store.save(hot)
+    return hot
+
+
+def totals(hot):
+    """
+    Linhas e subtotal do carrinho com uma única consulta de preços.
+
+    Produtos inativos ou excluídos são ignorados e listados em ``unavailable``.
+    """
+    products = {
+        str(pk): (name, price)
+        for pk, name, price in Product.objects.filter(pk__in=[key for key in hot.items if _is_uuid(key)], is_active=True)
+        .values_list('pk', 'name', 'base_price')
+    }
+    lines, subtotal = [], Decimal('0')
+    for product_id, quantity in hot.items.items():
+        if product_id not in products:
+            continue
+        name, price = products[product_id]
+        total = price * quantity
+        lines.append({'product_id': product_id, 'name': name, 'quantity': quantity, 'unit_price': price, 'total_price': total})
+        subtotal += total
+    unavailable = [product_id for product_id in hot.items if product_id not in products]
+    return {'lines': lines, 'subtotal': subtotal, 'item_count': sum(line['quantity'] for line in lines), 'unavailable': unavailable}
+
+
+def persist(carts):
+    """
+    Grava um lote de carrinhos: cria os Cart que faltam, atualiza ``updated_at``
+    e substitui os CartItem de todos de uma vez.
+
+    A trava do carrinho é a linha do cliente (``select_for_update`` até o
+    commit), a mesma que o checkout segura. Um Cart inativo nunca é
+    reativado: se o cliente tem um Cart encerrado depois do último uso do
+    carrinho em memória (checkout), o carrinho é ignorado; se ele voltou a ser
+    usado depois de expirar, ganha um Cart novo. Retorna quantos carrinhos
+    foram gravados.
+    """
+    if not carts:
+        return 0
+    previous = [hot.cart_id for hot in carts]
+    try:
+        with transaction.atomic():
+            active, closed = _lock_customers({hot.customer_id for hot in carts})
+            live = []
+            for hot in carts:
+                if closed.get(hot.customer_id) is not None and closed[hot.customer_id] > _touched(hot):
+                    # Cart encerrado depois do último uso: checkout concluído, não ressuscita
+                    continue
+                if hot.cart_id not in active:
+                    # Expirado (ou excluído) e usado de novo: um Cart novo
+                    hot.cart_id = None
+                live.append(hot)
+            new = [hot for hot in live if hot.cart_id is None]
+            for hot, cart in zip(new, Cart.objects.bulk_create([Cart(customer_id=hot.customer_id) for hot in new])):
+                hot.cart_id = str(cart.pk)
+            # updated_at é o último uso do carrinho, não o momento da gravação
+            Cart.objects.bulk_update([Cart(pk=hot.cart_id, updated_at=_touched(hot)) for hot in live], ['updated_at'])
+            cart_ids = [hot.cart_id for hot in live]
+            CartItem.objects.filter(cart_id__in=cart_ids).delete()
+            valid = set(
+                str(pk) for pk in Product.objects.filter(
+                    pk__in={product_id for hot in live for product_id in hot.items if _is_uuid(product_id)}
+                ).values_list('pk', flat=True)
+            )
+            CartItem.objects.bulk_create([
+                CartItem(cart_id=hot.cart_id, product_id=product_id, quantity=quantity)
+                for hot in live
+                for product_id, quantity in hot.items.items()
+                if product_id in valid
+            ])
+    except Exception:
+        # Os Cart criados foram desfeitos junto com a transação
+        for hot, cart_id in zip(carts, previous):
+            hot.cart_id = cart_id
+        raise
+    for hot, cart_id in zip(carts, previous):
+        if hot.cart_id != cart_id:
+            _remember_cart_id(hot, cart_id)
+    return len(live)
+
+
+def _lock_customers(customer_ids):
+    """Trava os clientes; devolve (ids dos Cart ativos, último encerramento por cliente)"""
+    list(Customer.objects.select_for_update().filter(pk__in=customer_ids).order_by('pk').values_list('pk', flat=True))
+    active, closed = set(), {}
+    for pk, customer_id, is_active, updated_at in (
+        Cart.objects.filter(customer_id__in=customer_ids).values_list('pk', 'customer_id', 'is_active', 'updated_at')
+    ):
+        customer_id = str(customer_id)
+        if is_active:
+            active.add(str(pk))
+        elif closed.get(customer_id) is None or updated_at > closed[customer_id]:
+            closed[customer_id] = updated_at
+    return active, closed
+
+
+def _is_uuid(value):
+    try:
+        uuid.UUID(value)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def _touched(hot):
+    return datetime.fromtimestamp(hot.touched_at, tz=dt_timezone.utc)
+
+
+def _remember_cart_id(hot, previous=None):
+    """Leva o cart_id novo ao cache sem sobrescrever itens alterados nesse meio-tempo"""
+    key = cache_key(hot.customer_id)
+    value = cache.get(key)
+    if value is not None and value[0] == previous:
+        cache.set(key, (hot.cart_id, *value[1:]), int(CART_IDLE.total_seconds()))
+
+
+def flush(batch_size=FLUSH_BATCH_SIZE):
+    """Grava todos os carrinhos pendentes deste processo em lotes; retorna quantos"""
+    flushed = 0
+    while True:
+        customer_ids = store.take_dirty(batch_size)
+        if not customer_ids:
+            return flushed
+        values = cache.get_many([cache_key(customer_id) for customer_id in customer_ids])
+        carts = [
+            HotCart.unpack(customer_id, values[cache_key(customer_id)])
+            for customer_id in customer_ids
+            if cache_key(customer_id) in values
+        ]
+        try:
+            flushed += persist(carts)
+        except CART_DATA_ERRORS:
+            flushed += _persist_each(carts)
+        except Exception:
+            store.mark_dirty(customer_ids)
+            raise
+
+
+def _persist_each(carts):
+    """Grava carrinho a carrinho; os que falham pelos próprios dados vão para a quarentena"""
+    persisted = 0
+    for position, hot in enumerate(carts):
+        try:
+            persisted += persist([hot])
+        except CART_DATA_ERRORS:
+            logger.exception("Cart of customer %s quarantined", hot.customer_id)
+            store.quarantine(hot.customer_id)
+        except Exception:
+            store.mark_dirty(pending.customer_id for pending in carts[position:])
+            raise
+    return persisted
+
+
+def checkout(customer):
+    """
+    Grava o carrinho na hora, desativa-o e tira-o do cache.
+
+    Retorna ``(cart, totals)`` para a criação do pedido, ou ``(None, totals)``
+    se o carrinho estiver vazio.
+    """
+    hot = store.load(customer)
+    summary = totals(hot)
+    if not summary['lines']:
+        return None, summary
+    with transaction.atomic():
+        # persist trava o cliente; encerrado com updated_at posterior ao último uso, o Cart
+        # vira uma lápide que gravações atrasadas (flusher de outro thread ou processo) ignoram
+        persist([hot])
+        Cart.objects.filter(pk=hot.cart_id).update(is_active=False, updated_at=timezone.now())
+    store.discard(hot.customer_id)
+    return Cart.objects.get(pk=hot.cart_id), summary
+
+
+def expire_carts(idle=CART_IDLE, now=None):
+    """Desativa num único UPDATE os carrinhos sem alteração há mais de ``idle``"""
+    now = now or timezone.now()
+    return Cart.objects.filter(is_active=True, updated_at__lt=now - idle).update(is_active=False)
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        flush()
+    except Exception:
+        logger.exception("Cart flush at exit failed")
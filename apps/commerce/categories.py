@@ -0,0 +1,232 @@
+"""
+Árvore de categorias do catálogo (CategoryNode).
+
+A árvore vem de ``ProductCatalog.hierarchy_settings['categories']`` mais os
+caminhos usados em ``Product.categories`` e é gravada em intervalos aninhados:
+cada nó tem ``lft``/``rgt`` e a subárvore é o intervalo entre eles. Assim,
+subárvore, breadcrumb e contagem de produtos são consultas por intervalo no
+índice (catalog, lft), sem percorrer o JSON.
+
+Formatos aceitos em ``hierarchy_settings['categories']``::
+
+    [{"name": "Outillage", "children": [{"name": "Électroportatif"}]}]
+    {"Outillage": {"Électroportatif": {}}}
+
+Em ``Product.categories`` cada item é um caminho (``"Outillage > Électroportatif"``)
+ou o nome de um nó único na árvore. Só ``>`` separa níveis: ``/`` faz parte do
+nome (``"Vis/Boulons"``).
+"""
+import copy
+
+from django.db import transaction
+
+from .models import CategoryNode, Product, ProductCatalog, ProductCategoryLink
+
+
+PATH_SEPARATOR = ' > '
+BULK_SIZE = 2000
+
+
+def split_path(value):
+    return tuple(part.strip() for part in str(value).split('>') if part.strip())
+
+
+def join_path(parts):
+    return PATH_SEPARATOR.join(parts)
+
+
+def hierarchy_paths(hierarchy, prefix=()):
+    """Caminhos (tuplas de nomes) da hierarquia em JSON, em pré-ordem"""
+    if isinstance(hierarchy, dict):
+        items = [{'name': name, 'children': children} for name, children in hierarchy.items()]
+    elif isinstance(hierarchy, list):
+        items = [item if isinstance(item, dict) else {'name': item} for item in hierarchy]
+    else:
+        return
+    for item in items:
+        name = str(item.get('name') or '').strip()
+        if not name:
+            continue
+        path = (*prefix, name)
+        yield path
+        yield from hierarchy_paths(item.get('children') or {}, path)
+
+
+class CategoryResolver:
+    """Converte os itens de ``Product.categories`` em caminhos da árvore"""
+
+    def __init__(self, paths):
+        self.paths = set(paths)
+        self.by_name = {}
+        for path in self.paths:
+            self.by_name.setdefault(path[-1], set()).add(path)
+
+    def resolve(self, value):
+        path = split_path(value)
+        if not path or path in self.paths:
+            return path or None
+        if len(path) == 1 and len(self.by_name.get(path[0], ())) == 1:
+            return next(iter(self.by_name[path[0]]))
+        return path
+
+    def add(self, path):
+        for depth in range(1, len(path) + 1):
+            prefix = path[:depth]
+            if prefix not in self.paths:
+                self.paths.add(prefix)
+                self.by_name.setdefault(prefix[-1], set()).add(prefix)
+
+
+def nested_intervals(paths):
+    """
+    (caminho, lft, rgt) de cada nó, numerando a árvore em profundidade.
+
+    Os irmãos mantêm a ordem da hierarquia; caminhos que só aparecem nos
+    produtos vêm depois, em ordem alfabética.
+    """
+    children = {}
+    for path in paths:
+        children.setdefault(path[:-1], []).append(path)
+    intervals, counter = [], 0
+
+    def visit(path):
+        nonlocal counter
+        counter += 1
+        lft = counter
+        for child in children.get(path, ()):
+            visit(child)
+        counter += 1
+        intervals.append((path, lft, counter))
+
+    for root in children.get((), ()):
+        visit(root)
+    return sorted(intervals, key=lambda item: item[1])
+
+
+def loaded_state(instance, fields):
+    """
+    Cópia dos campos já carregados, para comparar no ``post_save``.
+
+    Lê de ``__dict__``: campo adiado não dispara consulta (nem recursão no
+    ``post_init``) e, não sendo gravado, não entra na comparação. O JSON é
+    copiado para que alterações no lugar apareçam.
+    """
+    values = instance.__dict__
+    return {name: copy.deepcopy(values[name]) for name in fields if name in values}
+
+
+def state_changed(old, new):
+    return any(name not in old or old[name] != value for name, value in new.items())
+
+
+def _catalog_products(catalog_id, product_ids=None):
+    products = Product.objects.filter(catalog_id=catalog_id)
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+    return products.order_by().values_list('pk', 'categories').iterator(chunk_size=BULK_SIZE)
+
+
+def rebuild_catalog_tree(catalog):
+    """Regrava os nós e as ligações de produtos de um catálogo; retorna quantos nós"""
+    catalog = catalog if isinstance(catalog, ProductCatalog) else ProductCatalog.objects.get(pk=catalog)
+    ordered = list(dict.fromkeys(hierarchy_paths((catalog.hierarchy_settings or {}).get('categories'))))
+    resolver = CategoryResolver(ordered)
+
+    product_paths, extra = [], set()
+    for product_id, categories in _catalog_products(catalog.pk):
+        for value in categories if isinstance(categories, list) else []:
+            path = resolver.resolve(value)
+            if path:
+                product_paths.append((product_id, path))
+                if path not in resolver.paths:
+                    extra.add(path)
+    for path in sorted(extra):
+        for depth in range(1, len(path) + 1):
+            if path[:depth] not in resolver.paths:
+                ordered.append(path[:depth])
+        resolver.add(path)
+
+    intervals = nested_intervals(ordered)
+    with transaction.atomic():
+        CategoryNode.objects.filter(catalog=catalog).delete()
+        nodes = {}
+        # Por profundidade, para que o pai já tenha pk
+        for depth in sorted({len(path) for path, _lft, _rgt in intervals}):
+            level = {
+                path: CategoryNode(
+                    catalog=catalog, parent=nodes.get(path[:-1]), name=path[-1], path=join_path(path),
+                    depth=depth - 1, lft=lft, rgt=rgt,
+                )
+                for path, lft, rgt in intervals if len(path) == depth
+            }
+            CategoryNode.objects.bulk_create(level.values(), batch_size=BULK_SIZE)
+            nodes.update(level)
+        links = {
+            (product_id, nodes[path].pk): ProductCategoryLink(
+                catalog=catalog, node=nodes[path], product_id=product_id, lft=nodes[path].lft,
+            )
+            for product_id, path in product_paths
+        }
+        ProductCategoryLink.objects.bulk_create(links.values(), batch_size=BULK_SIZE)
+    return len(nodes)
+
+
+def rebuild_all(catalogs=None):
+    catalogs = ProductCatalog.objects.all() if catalogs is None else catalogs
+    return sum(rebuild_catalog_tree(catalog) for catalog in catalogs.iterator())
+
+
+def sync_product(product):
+    """
+    Atualiza as ligações de um produto salvo.
+
+    Se algum caminho ainda não existir na árvore, reconstrói a árvore do catálogo.
+    """
+    nodes = {
+        split_path(path): (pk, lft)
+        for pk, path, lft in CategoryNode.objects.filter(catalog_id=product.catalog_id).values_list('pk', 'path', 'lft')
+    }
+    resolver = CategoryResolver(nodes)
+    categories = product.categories if isinstance(product.categories, list) else []
+    paths = {resolver.resolve(value) for value in categories} - {None}
+    if not paths <= nodes.keys():
+        return rebuild_catalog_tree(product.catalog_id)
+    with transaction.atomic():
+        ProductCategoryLink.objects.filter(product=product).delete()
+        ProductCategoryLink.objects.bulk_create([
+            ProductCategoryLink(catalog_id=product.catalog_id, node_id=nodes[path][0], product=product, lft=nodes[path][1])
+            for path in paths
+        ])
+
+
+def get_node(catalog, path):
+    return CategoryNode.objects.get(catalog=catalog, path=join_path(split_path(path)))
+
+
+def subtree(node, include_self=True):
+    """Nós da subárvore em pré-ordem"""
+    nodes = CategoryNode.objects.filter(catalog_id=node.catalog_id, lft__gte=node.lft, lft__lte=node.rgt)
+    if not include_self:
+        nodes = nodes.exclude(pk=node.pk)
+    return nodes.order_by('lft')
+
+
+def breadcrumb(node):
+    """Ancestrais da raiz até o nó (inclusive)"""
+    return CategoryNode.objects.filter(
+        catalog_id=node.catalog_id, lft__lte=node.lft, rgt__gte=node.rgt,
+    ).order_by('lft')
+
+
+def products_under(node):
+    """Produtos classificados no nó ou em qualquer descendente"""
+    links = ProductCategoryLink.objects.filter(catalog_id=node.catalog_id, lft__gte=node.lft, lft__lte=node.rgt)
+    return Product.objects.filter(pk__in=links.values('product_id'))
+
+
+def product_count(node):
+    return (
+        ProductCategoryLink.objects
+        .filter(catalog_id=node.catalog_id, lft__gte=node.lft, lft__lte=node.rgt)
+        .values('product_id').distinct().count()
+    )
@@ -0,0 +1,16 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from commerce.carts import CART_IDLE, expire_carts
+
+
+class Command(BaseCommand):
+    help = "Desativa em lote os carrinhos parados há mais tempo que o limite"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=CART_IDLE.total_seconds() / 86400)
+
+    def handle(self, *args, **options):
+        expired = expire_carts(idle=timedelta(days=options['days']))
+        self.stdout.write(self.style.SUCCESS(f"{expired} carts expired."))
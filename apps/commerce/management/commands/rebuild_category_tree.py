@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from commerce.categories import rebuild_all
+from commerce.models import ProductCatalog
+
+
+class Command(BaseCommand):
+    help = "Reconstrói a árvore de categorias (CategoryNode) a partir do JSON dos catálogos e produtos"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--catalog', default=None, help="Reconstrói apenas este catálogo (UUID)")
+
+    def handle(self, *args, **options):
+        catalogs = ProductCatalog.objects.all()
+        if options['catalog']:
+            catalogs = catalogs.filter(pk=options['catalog'])
+        nodes = rebuild_all(catalogs)
+        self.stdout.write(self.style.SUCCESS(f"{nodes} category nodes rebuilt."))
@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from commerce.recovery import ABANDONED_AFTER, run
+
+
+class Command(BaseCommand):
+    help = "Detecta carrinhos abandonados desde a última execução, envia os e-mails de recuperação e registra as conversões"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=ABANDONED_AFTER.total_seconds() / 3600)
+
+    def handle(self, *args, **options):
+        result = run(idle=timedelta(hours=options['hours']))
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['detected']} abandoned carts detected, {result['sent']} emails sent, "
+            f"{result['converted']} conversions recorded."
+        ))
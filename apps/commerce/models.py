@@ -1,7 +1,8 @@
 from decimal import Decimal
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.utils.translation import gettext_lazy as _
-from core.models import BaseModel
+from core.models import BaseModel, RatingSummaryBase
 from companies.models import Company
 
 class ProductCatalog(BaseModel):
@@ -20,6 +21,14 @@ class ProductCatalog(BaseModel):
     def __str__(self):
         return f"{self.name} - {self.company}"
 
+class ProductQuerySet(models.QuerySet):
+    def by_rating(self):
+        """Ordena pela média do resumo desnormalizado, sem agregar avaliações"""
+        return self.select_related('rating_summary').order_by(
+            models.F('rating_summary__average_rating').desc(nulls_last=True),
+            models.F('rating_summary__rating_count').desc(nulls_last=True),
+        )
+
 class Product(BaseModel):
     """Produto no catálogo"""
     catalog = models.ForeignKey(ProductCatalog, on_delete=models.CASCADE, related_name='products')
@@ -38,10 +47,16 @@ class Product(BaseModel):
     is_active = models.BooleanField(default=True)
     seo_data = models.JSONField(default=dict)
 
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
         verbose_name = _('Product')
         verbose_name_plural = _('Products')
         unique_together = ['company', 'sku_prefix']
+        indexes = [
+            # Sincronização incremental do índice de busca do catálogo
+            models.Index(fields=['company', 'updated_at']),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.sku_prefix})"
@@ -62,8 +77,64 @@ class ProductVariant(BaseModel):
     class Meta:
         verbose_name = _('Product Variant')
         verbose_name_plural = _('Product')
+        indexes = [
+            models.Index(fields=['updated_at']),
+        ]
                                 
                                 
+class CategoryNodeQuerySet(models.QuerySet):
+    def with_product_counts(self):
+        """Anota ``total_products``: produtos distintos na subárvore, por intervalo de ``lft``"""
+        links = (
+            ProductCategoryLink.objects
+            .filter(catalog=models.OuterRef('catalog'), lft__gte=models.OuterRef('lft'), lft__lte=models.OuterRef('rgt'))
+            .order_by()
+            .values('catalog')
+            .annotate(total=models.Count('product', distinct=True))
+            .values('total')
+        )
+        return self.annotate(total_products=Coalesce(models.Subquery(links), 0))
+
+class CategoryNode(models.Model):
+    """Nó da árvore de categorias de um catálogo, em intervalos aninhados (lft/rgt)"""
+    catalog = models.ForeignKey(ProductCatalog, on_delete=models.CASCADE, related_name='category_nodes')
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, related_name='children')
+    name = models.CharField(max_length=200)
+    path = models.CharField(max_length=1000)
+    depth = models.PositiveSmallIntegerField()
+    lft = models.PositiveIntegerField()
+    rgt = models.PositiveIntegerField()
+
+    objects = CategoryNodeQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = _('Category Node')
+        verbose_name_plural = _('Category Nodes')
+        constraints = [
+            models.UniqueConstraint(fields=['catalog', 'path'], name='unique_category_node_path'),
+        ]
+        indexes = [
+            models.Index(fields=['catalog', 'lft', 'rgt']),
+        ]
+
+    def __str__(self):
+        return self.path
+
+class ProductCategoryLink(models.Model):
+    """Produto classificado num nó; ``lft`` copiado do nó para contar subárvores por intervalo"""
+    catalog = models.ForeignKey(ProductCatalog, on_delete=models.CASCADE, related_name='category_links')
+    node = models.ForeignKey(CategoryNode, on_delete=models.CASCADE, related_name='product_links')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='category_links')
+    lft = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['node', 'product'], name='unique_product_category_link'),
+        ]
+        indexes = [
+            models.Index(fields=['catalog', 'lft', 'product']),
+        ]
+
 class Customer(BaseModel):
     """Cliente final da empresa"""
     company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='customers')
@@ -171,6 +242,9 @@ class Order(BaseModel):
         verbose_name = _('Order')
         verbose_name_plural = _('Orders')
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['customer', 'created_at']),
+        ]
 
 class OrderItem(BaseModel):
     """Item individual em um pedido"""
@@ -204,13 +278,68 @@ class Cart(BaseModel):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='carts')
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            # Expiração e detecção de carrinhos parados
+            models.Index(fields=['is_active', 'updated_at']),
+        ]
+
 class CartItem(BaseModel):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
 
+class CartRecovery(models.Model):
+    """Carrinho abandonado detectado, com o e-mail de recuperação e a conversão"""
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='recoveries')
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='cart_recoveries')
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='cart_recoveries')
+    # updated_at do carrinho quando foi detectado
+    abandoned_at = models.DateTimeField()
+    status = models.CharField(
+        max_length=20,
+        choices=[
+            ('pending', _('Pending')),
+            ('sent', _('Sent')),
+            ('failed', _('Failed')),
+            ('converted', _('Converted')),
+        ],
+        default='pending'
+    )
+    sent_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='cart_recoveries')
+    converted_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('Cart Recovery')
+        verbose_name_plural = _('Cart Recoveries')
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'abandoned_at'], name='unique_cart_recovery'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['customer', 'status']),
+        ]
+
+class AbandonedCartScan(models.Model):
+    """Execução do detector; ``scanned_until`` é a marca d'água da próxima"""
+    scanned_until = models.DateTimeField(db_index=True)
+    detected = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
 class ProductReview(BaseModel):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reviews')
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='reviews')
     rating = models.PositiveSmallIntegerField()
-    comment = models.TextField(blank=True)
\ No newline at end of file
+    comment = models.TextField(blank=True)
+
+
+class ProductRatingSummary(RatingSummaryBase):
+    """Resumo das avaliações de um produto, mantido pelos sinais de ProductReview"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='rating_summary')
+
+    class Meta:
+        verbose_name = _('Product Rating Summary')
+        verbose_name_plural = _('Product Rating Summaries')
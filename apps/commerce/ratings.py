@@ -0,0 +1,18 @@
+from core.ratings import apply_review_change, rebuild_summaries, review_state
+from .models import ProductRatingSummary, ProductReview
+
+
+REVIEW_FIELDS = ('product_id', 'rating')
+
+
+def snapshot(values):
+    return review_state(values.get('product_id'), values.get('rating'))
+
+
+def update_summary(old, new):
+    apply_review_change(ProductRatingSummary, 'product', old=old, new=new)
+
+
+def rebuild():
+    reviews = ProductReview.objects.filter(rating__range=(1, 5))
+    return rebuild_summaries(ProductRatingSummary, 'product', reviews, 'product_id')
@@ -0,0 +1,164 @@
+"""
+Recuperação de carrinhos abandonados.
+
+O detector lê só a janela (marca d'água, agora - ``ABANDONED_AFTER``] de
+``Cart.updated_at`` pelo índice (is_active, updated_at), com um anti-join
+(NOT EXISTS) contra pedidos do cliente feitos depois da última alteração do
+carrinho. Cada carrinho encontrado vira um CartRecovery pendente; os e-mails
+saem em lotes por uma única conexão SMTP (configurações EMAIL_* do projeto).
+A conversão é registrada quando o cliente faz um pedido depois do e-mail.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q, Subquery
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from .models import AbandonedCartScan, Cart, CartItem, CartRecovery, Order
+
+
+ABANDONED_AFTER = timedelta(hours=4)
+# Na primeira execução, até onde olhar para trás
+INITIAL_LOOKBACK = timedelta(days=7)
+# Pedido feito até este prazo depois do e-mail conta como recuperação
+CONVERSION_WINDOW = timedelta(days=7)
+SEND_BATCH_SIZE = 100
+
+
+def abandoned_carts(since, until):
+    """Carrinhos ativos parados na janela, com e-mail, sem pedido posterior e sem opt-out"""
+    later_orders = Order.objects.filter(customer=OuterRef('customer'), created_at__gte=OuterRef('updated_at'))
+    return (
+        Cart.objects
+        .filter(is_active=True, updated_at__gt=since, updated_at__lte=until)
+        .exclude(customer__email='')
+        .filter(
+            ~Q(customer__marketing_preferences__has_key='email')
+            | Q(customer__marketing_preferences__email=True)
+        )
+        .filter(~Exists(later_orders), Exists(CartItem.objects.filter(cart=OuterRef('pk'))))
+    )
+
+
+def detect(now=None, idle=ABANDONED_AFTER):
+    """Registra os carrinhos abandonados desde a última execução; retorna quantos"""
+    now = now or timezone.now()
+    until = now - idle
+    last = AbandonedCartScan.objects.order_by('-scanned_until').values_list('scanned_until', flat=True).first()
+    since = last or until - INITIAL_LOOKBACK
+    if until <= since:
+        return 0
+    # Carrinhos já registrados com o mesmo updated_at (marca d'água recuada) ficam de fora
+    known = CartRecovery.objects.filter(cart=OuterRef('pk'), abandoned_at=OuterRef('updated_at'))
+    rows = (
+        abandoned_carts(since, until)
+        .filter(~Exists(known))
+        .values_list('pk', 'customer_id', 'customer__company_id', 'updated_at')
+    )
+    started = timezone.now()
+    with transaction.atomic():
+        CartRecovery.objects.bulk_create(
+            [
+                CartRecovery(cart_id=pk, customer_id=customer_id, company_id=company_id, abandoned_at=updated_at)
+                for pk, customer_id, company_id, updated_at in rows.iterator()
+            ],
+            ignore_conflicts=True,
+        )
+        # Com ignore_conflicts o bulk_create devolve todos os objetos, inseridos ou não:
+        # conta as linhas que esta execução gravou
+        detected = CartRecovery.objects.filter(status='pending', created_at__gte=started).count()
+        AbandonedCartScan.objects.create(scanned_until=until, detected=detected)
+    return detected
+
+
+def _cart_lines(cart_ids):
+    """Itens de vários carrinhos numa consulta"""
+    lines = defaultdict(list)
+    rows = CartItem.objects.filter(cart_id__in=cart_ids).values_list(
+        'cart_id', 'product__name', 'product__base_price', 'quantity',
+    )
+    for cart_id, name, price, quantity in rows:
+        lines[cart_id].append((name, price, quantity))
+    return lines
+
+
+def build_message(recovery, lines, connection):
+    customer = recovery.customer
+    body = [
+        _("Hello %(name)s,") % {'name': customer.first_name},  # FR: Bonjour %(name)s,
+        '',
+        _("You left these items in your cart:"),  # FR: Vous avez laissé ces articles dans votre panier :
+        '',
+    ]
+    total = Decimal('0')
+    for name, price, quantity in lines:
+        body.append(f"- {name} x{quantity}: {price * quantity}")
+        total += price * quantity
+    body += ['', _("Total: %(total)s") % {'total': total}]  # FR: Total : %(total)s
+    return EmailMessage(
+        subject=_("You left items in your cart"),  # FR: Vous avez oublié des articles dans votre panier
+        body='\n'.join(body),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[customer.email],
+        connection=connection,
+    )
+
+
+def send_pending(batch_size=SEND_BATCH_SIZE, now=None):
+    """Envia os e-mails pendentes em lotes, com uma conexão por lote; retorna quantos saíram"""
+    sent_total = 0
+    while True:
+        batch = list(
+            CartRecovery.objects.filter(status='pending').select_related('customer').order_by('created_at')[:batch_size]
+        )
+        if not batch:
+            return sent_total
+        lines = _cart_lines([recovery.cart_id for recovery in batch])
+        sent, failed = [], []
+        connection = get_connection()
+        try:
+            connection.open()
+            for recovery in batch:
+                try:
+                    build_message(recovery, lines[recovery.cart_id], connection).send()
+                    sent.append(recovery.pk)
+                except Exception as error:
+                    recovery.status, recovery.error = 'failed', str(error)
+                    failed.append(recovery)
+        finally:
+            connection.close()
+        CartRecovery.objects.filter(pk__in=sent).update(status='sent', sent_at=now or timezone.now())
+        CartRecovery.objects.bulk_update(failed, ['status', 'error'])
+        sent_total += len(sent)
+
+
+def track_conversions(window=CONVERSION_WINDOW):
+    """Marca como convertidas, num único UPDATE, as recuperações seguidas de pedido do cliente"""
+    orders = Order.objects.filter(
+        customer=OuterRef('customer'),
+        created_at__gte=OuterRef('sent_at'),
+        created_at__lte=OuterRef('sent_at') + window,
+    ).exclude(status='cancelled').order_by('created_at')
+    return (
+        CartRecovery.objects
+        .filter(status='sent')
+        .filter(Exists(orders))
+        .update(
+            status='converted',
+            order=Subquery(orders.values('pk')[:1]),
+            converted_at=Subquery(orders.values('created_at')[:1]),
+        )
+    )
+
+
+def run(now=None, idle=ABANDONED_AFTER):
+    """Rotina completa: detecta, envia e registra conversões"""
+    detected = detect(now=now, idle=idle)
+    sent = send_pending(now=now)
+    converted = track_conversions()
+    return {'detected': detected, 'sent': sent, 'converted': converted}
@@ -0,0 +1,521 @@
+"""
+Busca e facetas do catálogo (Product / ProductVariant).
+
+Cada empresa tem um índice invertido em memória: cada variante ativa ocupa uma
+posição e cada valor de faceta (categoria, atributo do produto ou da variante,
+termo do nome/SKU) guarda as posições que o têm. Valores frequentes também
+têm um bitmap (int); filtrar é intersectar bitmaps e a contagem de um valor é
+o ``bit_count`` da interseção com o resultado. Valores raros ficam só como
+lista de posições, que custa bem menos memória que um bitmap do tamanho do
+catálogo. Produtos sem variantes entram como uma posição própria, com
+``base_price`` e sem controle de estoque (sempre disponíveis).
+
+Dentro de uma faceta os valores são combinados com OU e entre facetas com E;
+a contagem de cada faceta ignora o filtro dela mesma (facetas disjuntivas).
+
+Sincronização: os sinais de Product/ProductVariant atualizam o índice do
+processo na hora e incrementam uma versão por empresa no cache. Os outros
+processos, ao ver a versão mudar, recarregam só os produtos com
+``updated_at`` recente; exclusões de produto incrementam a geração e forçam
+uma reconstrução completa.
+"""
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from datetime import timedelta
+from typing import NamedTuple
+
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import Product, ProductVariant
+
+
+CATEGORY_FACET = 'category'
+TEXT_FACET = '_text'
+VERSION_KEY = 'catalog-search:{company_id}:version'
+GENERATION_KEY = 'catalog-search:{company_id}:generation'
+# Intervalo mínimo entre consultas às versões no cache
+SYNC_CHECK_INTERVAL = 5
+# Margem para escritas concorrentes com a leitura incremental
+SYNC_SKEW = timedelta(seconds=30)
+LOAD_CHUNK_SIZE = 5000
+# Facetas com mais valores que isso (ex.: EAN) só são contadas se pedidas
+MAX_FACET_VALUES = 500
+# Resultados com até size >> 4 posições são contados documento a documento
+SMALL_SCOPE_SHIFT = 4
+PRICE_BUCKETS = 64
+
+
+class Document(NamedTuple):
+    variant_id: object
+    product_id: object
+    name: str
+    sku: str
+    categories: list
+    attributes: dict
+    variant_attributes: dict
+    price: float
+    in_stock: bool
+
+
+class SearchResult(NamedTuple):
+    total: int
+    product_ids: list
+    facets: dict
+
+
+def _terms(text):
+    return [term.lower() for term in re.findall(r'\w+', text or '', flags=re.UNICODE)]
+
+
+def _values(value):
+    for item in value if isinstance(value, list) else [value]:
+        if isinstance(item, (str, int, float, bool)) and item != '':
+            yield str(item)
+
+
+def document_keys(document):
+    """Chaves (faceta, valor) de um documento"""
+    keys = {(CATEGORY_FACET, value) for category in document.categories or [] for value in _values(category)}
+    for attributes in (document.attributes, document.variant_attributes):
+        if isinstance(attributes, dict):
+            for name, value in attributes.items():
+                keys.update((str(name), item) for item in _values(value))
+    keys.update((TEXT_FACET, term) for term in _terms(document.name) + _terms(document.sku))
+    return keys
+
+
+def bitmap_from(positions, size):
+    data = bytearray((size >> 3) + 1)
+    for position in positions:
+        data[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(data, 'little')
+
+
+NONZERO_BYTES = re.compile(rb'[^\x00]+')
+
+
+def iter_positions(bitmap):
+    """Posições dos bits ligados, em ordem crescente (os bytes zerados são pulados pela regex)"""
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    for run in NONZERO_BYTES.finditer(data):
+        for index in range(run.start(), run.end()):
+            byte, base = data[index], index << 3
+            for bit in range(8):
+                if byte >> bit & 1:
+                    yield base + bit
+
+
+def load_documents(company_id, product_ids=None):
+    """Documentos ativos da empresa (ou só de ``product_ids``) em leitura por fluxo"""
+    products = Product.objects.filter(company_id=company_id, is_active=True)
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+    variants = (
+        ProductVariant.objects.filter(product__in=products, is_active=True)
+        .order_by('product__name', 'product_id', 'sku')
+        .values_list(
+            'pk', 'product_id', 'product__name', 'sku', 'product__categories',
+            'product__attributes', 'variant_attributes', 'price', 'stock_quantity',
+        )
+    )
+    for pk, product_id, name, sku, categories, attributes, variant_attributes, price, stock in variants.iterator(
+        chunk_size=LOAD_CHUNK_SIZE
+    ):
+        yield Document(pk, product_id, name, sku, categories, attributes, variant_attributes, float(price), stock > 0)
+    bare = (
+        products.filter(~Exists(ProductVariant.objects.filter(product=OuterRef('pk'))))
+        .order_by('name', 'pk')
+        .values_list('pk', 'name', 'sku_prefix', 'categories', 'attributes', 'base_price')
+    )
+    for pk, name, sku, categories, attributes, price in bare.iterator(chunk_size=LOAD_CHUNK_SIZE):
+        yield Document(None, pk, name, sku, categories, attributes, {}, float(price), True)
+
+
+class CatalogIndex:
+    """Índice invertido em memória do catálogo de uma empresa"""
+
+    def __init__(self, company_id):
+        self.company_id = company_id
+        self.lock = threading.RLock()
+        self.version = None
+        self.generation = None
+        self.synced_at = None
+        self._checked_at = 0
+        self._reset()
+
+    def _reset(self):
+        self.product_ids = []
+        self.prices = array('d')
+        self.positions = defaultdict(list)
+        # Posições de cada chave (esparso); chaves densas também têm bitmap
+        self.postings = {}
+        self.bitmaps = {}
+        self.facets = defaultdict(set)
+        # Chaves de faceta de cada posição, para contar resultados pequenos
+        self.doc_facets = []
+        self._interned = {}
+        self.alive = 0
+        self.in_stock = 0
+        self.dead = 0
+        self._sorted_prices = None
+        self._sorted_terms = None
+
+    @property
+    def size(self):
+        return len(self.product_ids)
+
+    def _is_dense(self, count):
+        # Um bitmap custa size/8 bytes. A partir de 1/1024 de densidade o ganho
+        # nas interseções e contagens compensa a memória; abaixo disso (termos,
+        # SKUs, valores raros) fica só a lista de posições
+        return count >= max(self.size >> 10, 64)
+
+    def _append(self, document):
+        """Registra o documento; retorna a posição, suas chaves e as chaves novas"""
+        position = len(self.product_ids)
+        self.product_ids.append(document.product_id)
+        self.prices.append(document.price)
+        self.positions[document.product_id].append(position)
+        keys, new_keys, facet_keys = document_keys(document), [], []
+        for key in keys:
+            positions = self.postings.get(key)
+            if positions is None:
+                positions = self.postings[key] = array('i')
+                new_keys.append(key)
+            positions.append(position)
+            if key[0] != TEXT_FACET:
+                facet_keys.append(self._interned.setdefault(key, key))
+        self.doc_facets.append(tuple(facet_keys))
+        return position, keys, new_keys
+
+    def _register(self, keys):
+        for facet, value in keys:
+            if facet != TEXT_FACET:
+                self.facets[facet].add(value)
+
+    def build(self, documents):
+        """Carga completa; os bitmaps densos são montados de uma vez no final"""
+        with self.lock:
+            self._reset()
+            in_stock = []
+            for document in documents:
+                position, _keys, new_keys = self._append(document)
+                self._register(new_keys)
+                if document.in_stock:
+                    in_stock.append(position)
+            size = self.size
+            self.bitmaps = {
+                key: bitmap_from(positions, size)
+                for key, positions in self.postings.items()
+                if self._is_dense(len(positions))
+            }
+            self.alive = (1 << size) - 1
+            self.in_stock = bitmap_from(in_stock, size)
+
+    def add(self, documents):
+        with self.lock:
+            for document in documents:
+                position, keys, new_keys = self._append(document)
+                self._register(new_keys)
+                bit = 1 << position
+                self.alive |= bit
+                if document.in_stock:
+                    self.in_stock |= bit
+                if self._sorted_prices is not None:
+                    values, order, bounds, buckets = self._sorted_prices
+                    index = bisect_right(values, document.price)
+                    values.insert(index, document.price)
+                    order.insert(index, position)
+                    buckets[bisect_right(bounds, document.price)] |= bit
+                for key in keys:
+                    if key in self.bitmaps:
+                        self.bitmaps[key] |= bit
+                    elif self._is_dense(len(self.postings[key])):
+                        self.bitmaps[key] = bitmap_from(self.postings[key], self.size)
+                if self._sorted_terms is not None:
+                    for facet, term in new_keys:
+                        if facet == TEXT_FACET:
+                            insort(self._sorted_terms, term)
+
+    def remove_products(self, product_ids):
+        """
+        Desliga as posições dos produtos em ``alive``.
+
+        As listas de posições não são alteradas: toda consulta parte de
+        ``alive``, e as posições mortas somem na próxima reconstrução.
+        """
+        with self.lock:
+            for product_id in product_ids:
+                for position in self.positions.pop(product_id, ()):
+                    mask = ~(1 << position)
+                    self.alive &= mask
+                    self.in_stock &= mask
+                    self.dead += 1
+
+    def replace_products(self, product_ids):
+        product_ids = list(product_ids)
+        documents = list(load_documents(self.company_id, product_ids))
+        with self.lock:
+            self.remove_products(product_ids)
+            self.add(documents)
+
+    # Sincronização entre processos
+
+    def sync(self, force=False):
+        now = time.monotonic()
+        if not force and self.synced_at is not None and now - self._checked_at < SYNC_CHECK_INTERVAL:
+            return
+        with self.lock:
+            keys = version_keys(self.company_id)
+            values = cache.get_many(keys)
+            version, generation = (values.get(key, 0) for key in keys)
+            started_at = timezone.now()
+            if self.synced_at is None or generation != self.generation or self.dead > self.size // 2:
+                self.build(load_documents(self.company_id))
+            elif version != self.version:
+                self.replace_products(changed_products(self.company_id, self.synced_at - SYNC_SKEW))
+            self.version, self.generation, self.synced_at = version, generation, started_at
+            self._checked_at = now
+
+    # Consulta
+
+    def bitmap(self, key):
+        bitmap = self.bitmaps.get(key)
+        if bitmap is None:
+            positions = self.postings.get(key)
+            bitmap = bitmap_from(positions, self.size) if positions else 0
+        return bitmap
+
+    def _price_index(self):
+        """
+        Preços ordenados (valores e posições) e faixas por quantil com bitmap.
+
+        As faixas são fixas até a próxima reconstrução; documentos novos entram
+        na faixa do seu preço.
+        """
+        if self._sorted_prices is None:
+            order = sorted(iter_positions(self.alive), key=self.prices.__getitem__)
+            values = array('d', (self.prices[position] for position in order))
+            step = max(len(order) // PRICE_BUCKETS, 1)
+            bounds = [values[index] for index in range(step, len(values), step)]
+            members = defaultdict(list)
+            for position, price in zip(order, values):
+                members[bisect_right(bounds, price)].append(position)
+            buckets = [bitmap_from(members[index], self.size) for index in range(len(bounds) + 1)]
+            self._sorted_prices = (values, array('i', order), bounds, buckets)
+        return self._sorted_prices
+
+    def price_bitmap(self, low, high, candidates):
+        """
+        Bitmap das posições com preço em [low, high].
+
+        Com poucos candidatos eles são conferidos um a um; senão une as faixas
+        inteiramente dentro do intervalo e completa com as posições exatas das
+        pontas, lidas dos preços ordenados.
+        """
+        if candidates.bit_count() <= self.size >> SMALL_SCOPE_SHIFT:
+            low = float('-inf') if low is None else low
+            high = float('inf') if high is None else high
+            return bitmap_from(
+                (position for position in iter_positions(candidates) if low <= self.prices[position] <= high),
+                self.size,
+            )
+        values, order, bounds, buckets = self._price_index()
+        low = float('-inf') if low is None else low
+        high = float('inf') if high is None else high
+        # A faixa i cobre [lowers[i], uppers[i])
+        lowers = [float('-inf'), *bounds]
+        uppers = [*bounds, float('inf')]
+        full = [index for index in range(len(buckets)) if lowers[index] >= low and uppers[index] <= high]
+        if not full:
+            return bitmap_from(order[bisect_left(values, low):bisect_right(values, high)], self.size)
+        bitmap = 0
+        for index in full:
+            bitmap |= buckets[index]
+        edges = order[bisect_left(values, low):bisect_left(values, lowers[full[0]])]
+        edges.extend(order[bisect_left(values, uppers[full[-1]]):bisect_right(values, high)])
+        return bitmap | bitmap_from(edges, self.size)
+
+    def text_bitmap(self, query):
+        """Todos os termos (E); o último também casa por prefixo"""
+        terms = _terms(query)
+        if not terms:
+            return None
+        bitmap = self.alive
+        for term in terms[:-1]:
+            bitmap &= self.bitmap((TEXT_FACET, term))
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(value for facet, value in self.postings if facet == TEXT_FACET)
+        prefix, positions = terms[-1], []
+        index = bisect_left(self._sorted_terms, prefix)
+        while index < len(self._sorted_terms) and self._sorted_terms[index].startswith(prefix):
+            positions.extend(self.postings[TEXT_FACET, self._sorted_terms[index]])
+            index += 1
+        return bitmap & bitmap_from(positions, self.size)
+
+    def facet_bitmap(self, facet, values):
+        bitmap = 0
+        for value in values if isinstance(values, (list, tuple, set)) else [values]:
+            bitmap |= self.bitmap((facet, str(value)))
+        return bitmap
+
+    def facet_counts(self, scope, facets):
+        """Contagem por valor das ``facets`` dentro de ``scope``"""
+        counts = {facet: {} for facet in facets}
+        if not scope:
+            return counts
+        if scope.bit_count() <= self.size >> SMALL_SCOPE_SHIFT:
+            # Poucos resultados: percorre os documentos em vez dos bitmaps
+            wanted = set(facets)
+            tally = defaultdict(int)
+            for position in iter_positions(scope):
+                for key in self.doc_facets[position]:
+                    if key[0] in wanted:
+                        tally[key] += 1
+            for (facet, value), count in tally.items():
+                counts[facet][value] = count
+            return counts
+        scope_bytes = scope.to_bytes((self.size >> 3) + 1, 'little')
+        for facet in facets:
+            for value in self.facets.get(facet, ()):
+                key = (facet, value)
+                bitmap = self.bitmaps.get(key)
+                if bitmap is not None:
+                    count = (scope & bitmap).bit_count()
+                else:
+                    count = sum(scope_bytes[position >> 3] >> (position & 7) & 1 for position in self.postings[key])
+                if count:
+                    counts[facet][value] = count
+        return counts
+
+    def search(self, query='', filters=None, price_min=None, price_max=None, in_stock=None,
+               facets=None, limit=20, offset=0):
+        with self.lock:
+            base = self.alive
+            text = self.text_bitmap(query)
+            if text is not None:
+                base &= text
+            if in_stock:
+                base &= self.in_stock
+            if price_min is not None or price_max is not None:
+                base &= self.price_bitmap(price_min, price_max, base)
+
+            selected = {facet: self.facet_bitmap(facet, values) for facet, values in (filters or {}).items()}
+            hits = base
+            for bitmap in selected.values():
+                hits &= bitmap
+
+            if facets is None:
+                facets = [facet for facet, values in self.facets.items() if len(values) <= MAX_FACET_VALUES]
+            # Contagem disjuntiva: cada faceta filtrada é contada sem o próprio
+            # filtro; as demais compartilham o conjunto de resultados
+            counts = self.facet_counts(hits, [facet for facet in facets if facet not in selected])
+            for facet in facets:
+                if facet in selected:
+                    scope = base
+                    for other, bitmap in selected.items():
+                        if other != facet:
+                            scope &= bitmap
+                    counts.update(self.facet_counts(scope, [facet]))
+            counts = {
+                facet: dict(sorted(values.items(), key=lambda item: (-item[1], item[0])))
+                for facet, values in counts.items()
+            }
+
+            product_ids, seen = [], set()
+            for position in iter_positions(hits):
+                product_id = self.product_ids[position]
+                if product_id in seen:
+                    continue
+                seen.add(product_id)
+                if len(seen) > offset:
+                    product_ids.append(product_id)
+                    if len(product_ids) >= limit:
+                        break
+            return SearchResult(hits.bit_count(), product_ids, counts)
+
+
+def version_keys(company_id):
+    return [VERSION_KEY.format(company_id=company_id), GENERATION_KEY.format(company_id=company_id)]
+
+
+def changed_products(company_id, since):
+    """Produtos da empresa alterados (produto ou variante) desde ``since``"""
+    changed = set(
+        Product.objects.filter(company_id=company_id, updated_at__gte=since).values_list('pk', flat=True)
+    )
+    changed.update(
+        ProductVariant.objects.filter(updated_at__gte=since, product__company_id=company_id)
+        .values_list('product_id', flat=True)
+    )
+    return changed
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(company_id):
+    with _indexes_lock:
+        index = _indexes.get(company_id)
+        if index is None:
+            index = _indexes[company_id] = CatalogIndex(company_id)
+    index.sync()
+    return index
+
+
+def search(company, query='', filters=None, price_min=None, price_max=None, in_stock=None,
+           facets=None, limit=20, offset=0):
+    """
+    Busca facetada no catálogo da empresa.
+
+    ``filters`` mapeia faceta para um valor ou lista de valores, por exemplo
+    ``{'category': 'Outillage', 'color': ['red', 'blue']}``. Retorna o total de
+    variantes que casam, os produtos da página e as contagens por faceta.
+    """
+    company_id = getattr(company, 'pk', company)
+    return get_index(company_id).search(
+        query, filters, price_min, price_max, in_stock, facets, limit, offset,
+    )
+
+
+def _bump(key, local_value):
+    """Incrementa a versão no cache; retorna o novo valor se só a nossa mudança ocorreu"""
+    try:
+        value = cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+        value = 1
+    return value if local_value is not None and value == local_value + 1 else None
+
+
+def product_changed(company_id, product_id):
+    """Chamado após o commit de Product/ProductVariant salvos"""
+    index = _indexes.get(company_id)
+    if index is not None and index.synced_at is not None:
+        index.replace_products([product_id])
+    version = _bump(VERSION_KEY.format(company_id=company_id), index and index.version)
+    if index is not None and version is not None:
+        index.version = version
+
+
+def product_deleted(company_id, product_id):
+    """Chamado após o commit de um Product excluído"""
+    index = _indexes.get(company_id)
+    if index is not None:
+        index.remove_products([product_id])
+    generation = _bump(GENERATION_KEY.format(company_id=company_id), index and index.generation)
+    if index is not None and generation is not None:
+        index.generation = generation
+
+
+def variant_deleted(company_id, product_id):
+    """Variante excluída: marca o produto como alterado para a sincronização incremental"""
+    Product.objects.filter(pk=product_id).update(updated_at=timezone.now())
+    product_changed(company_id, product_id)
@@ -0,0 +1,58 @@
+from rest_framework import serializers
+
+from .models import Product, ProductCatalog, ProductRatingSummary, ProductVariant
+
+
+class DynamicFieldsMixin:
+    """Aceita ``fields=[...]`` para limitar os campos serializados"""
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class StorefrontCatalogSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProductCatalog
+        fields = ['id', 'name']
+
+
+class StorefrontVariantSerializer(serializers.ModelSerializer):
+    in_stock = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ProductVariant
+        fields = ['id', 'sku', 'variant_attributes', 'price', 'in_stock', 'barcode', 'dimensions', 'weight']
+
+    def get_in_stock(self, variant):
+        return variant.stock_quantity > 0
+
+
+class StorefrontRatingSerializer(serializers.ModelSerializer):
+    histogram = serializers.ReadOnlyField()
+
+    class Meta:
+        model = ProductRatingSummary
+        fields = ['average_rating', 'rating_count', 'histogram']
+
+
+class StorefrontProductSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    catalog = StorefrontCatalogSerializer(read_only=True)
+    variants = StorefrontVariantSerializer(many=True, read_only=True, source='active_variants')
+    rating = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Product
+        fields = [
+            'id', 'name', 'description', 'sku_prefix', 'catalog', 'categories', 'attributes',
+            'media_gallery', 'base_price', 'requires_shipping', 'seo_data', 'variants', 'rating', 'updated_at',
+        ]
+
+    def get_rating(self, product):
+        try:
+            summary = product.rating_summary
+        except ProductRatingSummary.DoesNotExist:
+            return None
+        return StorefrontRatingSerializer(summary).data
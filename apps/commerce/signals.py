@@ -0,0 +1,123 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from companies.models import Company
+from core.ratings import complete_review_values, review_values
+from . import categories, ratings, search, storefront
+from .models import Product, ProductCatalog, ProductReview, ProductVariant
+
+
+HIERARCHY_FIELDS = ('hierarchy_settings',)
+CATEGORY_FIELDS = ('catalog_id', 'categories')
+
+
+@receiver(post_init, sender=ProductReview)
+def remember_review_state(sender, instance, **kwargs):
+    instance._rating_values = review_values(instance, ratings.REVIEW_FIELDS)
+
+
+@receiver(pre_save, sender=ProductReview)
+@receiver(pre_delete, sender=ProductReview)
+def load_deferred_review_state(sender, instance, **kwargs):
+    instance._rating_values = complete_review_values(instance, instance._rating_values, ratings.REVIEW_FIELDS)
+
+
+@receiver(post_save, sender=ProductReview)
+def update_product_rating_on_save(sender, instance, created, **kwargs):
+    old = None if created else ratings.snapshot(instance._rating_values)
+    # Campos ainda adiados não foram gravados: valem os do banco
+    current = {**instance._rating_values, **review_values(instance, ratings.REVIEW_FIELDS)}
+    ratings.update_summary(old, ratings.snapshot(current))
+    instance._rating_values = current
+
+
+@receiver(post_delete, sender=ProductReview)
+def update_product_rating_on_delete(sender, instance, **kwargs):
+    ratings.update_summary(ratings.snapshot(instance._rating_values), None)
+
+
+@receiver(post_save, sender=Product)
+def reindex_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(lambda: search.product_changed(instance.company_id, instance.pk))
+
+
+def _product_company(product_id):
+    """Empresa do produto sem carregar o Product inteiro"""
+    return Product.objects.filter(pk=product_id).values_list('company_id', flat=True).first()
+
+
+@receiver(post_save, sender=ProductVariant)
+def reindex_variant_product(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    company_id = _product_company(instance.product_id)
+    if company_id is not None:
+        transaction.on_commit(lambda: search.product_changed(company_id, instance.product_id))
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_index(sender, instance, **kwargs):
+    transaction.on_commit(lambda: search.product_deleted(instance.company_id, instance.pk))
+
+
+@receiver(post_delete, sender=ProductVariant)
+def reindex_after_variant_delete(sender, instance, **kwargs):
+    company_id = _product_company(instance.product_id)
+    if company_id is not None:
+        transaction.on_commit(lambda: search.variant_deleted(company_id, instance.product_id))
+
+
+@receiver(post_init, sender=ProductCatalog)
+def remember_hierarchy(sender, instance, **kwargs):
+    instance._hierarchy_snapshot = categories.loaded_state(instance, HIERARCHY_FIELDS)
+
+
+@receiver(post_save, sender=ProductCatalog)
+def rebuild_category_tree(sender, instance, created, raw=False, **kwargs):
+    state = categories.loaded_state(instance, HIERARCHY_FIELDS)
+    if raw or (not created and not categories.state_changed(instance._hierarchy_snapshot, state)):
+        return
+    instance._hierarchy_snapshot = state
+    transaction.on_commit(lambda: categories.rebuild_catalog_tree(instance.pk))
+
+
+@receiver(post_init, sender=Product)
+def remember_categories(sender, instance, **kwargs):
+    instance._categories_snapshot = categories.loaded_state(instance, CATEGORY_FIELDS)
+
+
+@receiver(post_save, sender=Product)
+def sync_product_categories(sender, instance, created, raw=False, **kwargs):
+    state = categories.loaded_state(instance, CATEGORY_FIELDS)
+    if raw or (not created and not categories.state_changed(instance._categories_snapshot, state)):
+        return
+    instance._categories_snapshot = state
+    transaction.on_commit(lambda: categories.sync_product(instance))
+
+
+def _storefront_changed(company_id):
+    if company_id is not None:
+        transaction.on_commit(lambda: storefront.bump_version(company_id))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductCatalog)
+@receiver(post_delete, sender=ProductCatalog)
+def invalidate_storefront(sender, instance, **kwargs):
+    _storefront_changed(instance.company_id)
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+@receiver(post_save, sender=ProductReview)
+@receiver(post_delete, sender=ProductReview)
+def invalidate_storefront_for_product(sender, instance, **kwargs):
+    _storefront_changed(_product_company(instance.product_id))
+
+
+@receiver(post_save, sender=Company)
+def invalidate_company_storefront(sender, instance, **kwargs):
+    _storefront_changed(instance.pk)
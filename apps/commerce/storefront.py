@@ -0,0 +1,102 @@
+"""
+Consultas e cache da vitrine pública de produtos.
+
+Cada empresa tem uma versão no cache, incrementada pelos sinais de Product,
+ProductVariant, ProductCatalog, ProductReview e Company. As respostas da API
+são guardadas por (empresa, versão, caminho e parâmetros conhecidos): qualquer
+alteração muda a versão e as entradas antigas simplesmente deixam de ser lidas
+até expirarem. Parâmetros fora da lista de cada view (``utm_*``, ``?x=<aleatório>``)
+não entram na chave, então não criam entradas novas nem furam o cache.
+"""
+import hashlib
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.db.models import Count, Max, Prefetch, Q
+
+from .models import Product, ProductVariant
+
+
+VERSION_KEY = 'storefront:{company_id}:version'
+RESPONSE_KEY = 'storefront:{company_id}:{version}:{digest}'
+RESPONSE_TIMEOUT = 10 * 60
+
+DEFAULT_PRODUCT_FIELDS = [
+    'id', 'name', 'description', 'catalog', 'categories', 'attributes', 'media_gallery',
+    'base_price', 'variants', 'rating', 'updated_at',
+]
+
+
+def bump_version(company_id):
+    key = VERSION_KEY.format(company_id=company_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def current_version(company_id):
+    return cache.get(VERSION_KEY.format(company_id=company_id), 0)
+
+
+def response_key(company_id, version, *parts):
+    digest = hashlib.md5('|'.join(str(part) for part in parts).encode()).hexdigest()
+    return RESPONSE_KEY.format(company_id=company_id, version=version, digest=digest)
+
+
+def request_identity(path, query_params, allowed):
+    """Caminho mais os parâmetros de ``allowed``, em ordem estável; os demais são ignorados"""
+    params = sorted((name, value) for name in set(allowed) for value in query_params.getlist(name))
+    return f'{path}?{urlencode(params)}' if params else path
+
+
+def product_fields(company):
+    """Campos do produto expostos pela empresa (``company_settings['storefront']['product_fields']``)"""
+    fields = ((company.company_settings or {}).get('storefront') or {}).get('product_fields')
+    return fields if isinstance(fields, list) and fields else DEFAULT_PRODUCT_FIELDS
+
+
+def visible_products(company_id, authenticated=False):
+    """
+    Produtos ativos de catálogos públicos da empresa.
+
+    Catálogos com ``visibility_rules['requires_login']`` só aparecem para
+    usuários autenticados.
+    """
+    products = Product.objects.filter(company_id=company_id, is_active=True, catalog__is_public=True)
+    if not authenticated:
+        # exclude() com chave JSON ausente vira NULL e descartaria tudo
+        products = products.filter(
+            ~Q(catalog__visibility_rules__has_key='requires_login')
+            | Q(catalog__visibility_rules__requires_login=False)
+        )
+    return products
+
+
+def with_storefront_data(products):
+    """Catálogo e resumo de avaliações por join; variantes ativas numa consulta só"""
+    variants = ProductVariant.objects.filter(is_active=True).order_by('sku')
+    return products.select_related('catalog', 'rating_summary').prefetch_related(
+        Prefetch('variants', queryset=variants, to_attr='active_variants')
+    )
+
+
+def validator(products):
+    """
+    Base do ETag numa única consulta agregada.
+
+    O maior ``updated_at`` de produtos, variantes, catálogos, resumos de
+    avaliação e da empresa, mais a contagem (que muda com exclusões).
+    """
+    return products.aggregate(
+        count=Count('pk', distinct=True),
+        product=Max('updated_at'),
+        variant=Max('variants__updated_at'),
+        catalog=Max('catalog__updated_at'),
+        rating=Max('rating_summary__updated_at'),
+        company=Max('company__updated_at'),
+    )
+
+
+def strong_etag(*parts):
+    return '"%s"' % hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
@@ -1,3 +1,348 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.http import QueryDict
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from companies.models import Company
+from core.models import AuditLog, Language
+from . import carts, categories, ratings, recovery, search, storefront
+from .models import (
+    AbandonedCartScan, Cart, CartItem, CartRecovery, CategoryNode, Customer, Product, ProductCatalog,
+    ProductCategoryLink, ProductRatingSummary, ProductReview, ProductVariant,
+)
+
+
+def create_company(suffix=''):
+    owner = get_user_model().objects.create_user(email=f'owner{suffix}@example.com', password='secret')
+    language, _ = Language.objects.get_or_create(
+        code='fr', defaults={'name': 'French', 'native_name': 'Français', 'date_format': 'd/m/Y'}
+    )
+    return Company.objects.create(
+        owner=owner, business_name='Batmart', trading_name='Batmart', tax_id=f'FR{suffix}',
+        registration_number='1', legal_form='SAS', primary_language=language,
+    )
+
+
+def create_customer(company, index=0):
+    return Customer.objects.create(
+        company=company, customer_type='individual', first_name='Jean', last_name='Dupont',
+        email=f'client{index}@example.com', phone='0600000000',
+    )
+
+
+def create_product(catalog, index=0, categories=()):
+    return Product.objects.create(
+        catalog=catalog, company=catalog.company, name=f'Perceuse {index}', description='',
+        sku_prefix=f'P{index}', base_price=100, tax_class='standard', categories=list(categories),
+    )
+
+
+@override_settings(AUDIT_ASYNC=False)
+class CategorySignalTests(TestCase):
+    def setUp(self):
+        self.company = create_company('1')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.catalog = ProductCatalog.objects.create(
+                company=self.company, name='Outillage',
+                hierarchy_settings={'categories': [{'name': 'Outillage', 'children': [{'name': 'Perceuses'}]}]},
+            )
+            self.products = [create_product(self.catalog, index, ['Perceuses']) for index in range(5)]
+
+    def test_deferred_loads_do_not_query_again(self):
+        with self.assertNumQueries(1):
+            products = list(Product.objects.only('pk', 'name'))
+        self.assertEqual(len(products), 5)
+        with self.assertNumQueries(1):
+            list(ProductCatalog.objects.only('pk'))
+
+    def test_saving_deferred_instance_keeps_tree(self):
+        product = Product.objects.only('pk', 'name').get(pk=self.products[0].pk)
+        product.name = 'Visseuse'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertEqual(ProductCategoryLink.objects.filter(product=product).count(), 1)
+
+    def test_in_place_hierarchy_change_rebuilds_tree(self):
+        catalog = ProductCatalog.objects.get(pk=self.catalog.pk)
+        catalog.hierarchy_settings['categories'].append({'name': 'Jardin'})
+        with self.captureOnCommitCallbacks(execute=True):
+            catalog.save()
+        self.assertTrue(CategoryNode.objects.filter(catalog=catalog, path='Jardin').exists())
+
+    def test_in_place_category_change_links_product(self):
+        product = Product.objects.get(pk=self.products[0].pk)
+        product.categories.append('Outillage')
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        paths = set(ProductCategoryLink.objects.filter(product=product).values_list('node__path', flat=True))
+        self.assertEqual(paths, {'Outillage', 'Outillage > Perceuses'})
+
+    def test_slash_is_part_of_category_names(self):
+        self.assertEqual(categories.split_path('Quincaillerie > Vis/Boulons'), ('Quincaillerie', 'Vis/Boulons'))
+        product = Product.objects.get(pk=self.products[0].pk)
+        product.categories = ['Outillage > Scies/Lames']
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        paths = set(ProductCategoryLink.objects.filter(product=product).values_list('node__path', flat=True))
+        self.assertEqual(paths, {'Outillage > Scies/Lames'})
+
+
+
+class CatalogIndexTests(SimpleTestCase):
+    def test_price_filter_matches_a_linear_scan(self):
+        documents = [
+            search.Document(
+                position, position // 2, f'Produit {position % 7}', f'SKU{position}', [], {}, {},
+                float(position % 50), position % 4 != 0,
+            )
+            for position in range(400)
+        ]
+        index = search.CatalogIndex(None)
+        index.build(documents)
+        cases = [
+            # Muitos candidatos: faixas de preço; poucos (sku19*): conferência um a um
+            ('', lambda document: True),
+            ('sku19', lambda document: document.sku.lower().startswith('sku19')),
+        ]
+        for query, matches in cases:
+            for low, high in ((10, 20), (None, 5), (45, None), (12.5, 12.5), (12, 12), (-1, 100)):
+                expected = sum(
+                    1 for document in documents
+                    if matches(document) and document.in_stock
+                    and (low is None or document.price >= low) and (high is None or document.price <= high)
+                )
+                result = index.search(query, price_min=low, price_max=high, in_stock=True, facets=[])
+                self.assertEqual(result.total, expected, (query, low, high))
+
+
+@override_settings(AUDIT_ASYNC=False)
+class CatalogSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        search._indexes.clear()
+        self.company = create_company('6')
+        catalog = ProductCatalog.objects.create(company=self.company, name='Outillage')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.drill = create_product(catalog, 0, ['Perceuses'])
+            self.saw = create_product(catalog, 1, ['Scies'])
+            # Sem variantes: entra com base_price e sempre disponível
+            self.bare = create_product(catalog, 2, ['Perceuses'])
+            self.variant(self.drill, 'P0-R', 'red', 50, 3)
+            self.variant(self.drill, 'P0-B', 'blue', 60, 0)
+            self.variant(self.saw, 'P1-R', 'red', 200, 1)
+
+    def tearDown(self):
+        search._indexes.clear()
+
+    def variant(self, product, sku, color, price, stock):
+        return ProductVariant.objects.create(
+            product=product, sku=sku, variant_attributes={'color': color}, price=price, stock_quantity=stock, weight=1,
+        )
+
+    def search(self, **kwargs):
+        return search.search(self.company, **kwargs)
+
+    def test_facet_counts_ignore_their_own_filter(self):
+        result = self.search(filters={'category': 'Perceuses', 'color': 'red'}, facets=['category', 'color'])
+        self.assertEqual((result.total, result.product_ids), (1, [self.drill.pk]))
+        self.assertEqual(result.facets, {'category': {'Perceuses': 1, 'Scies': 1}, 'color': {'blue': 1, 'red': 1}})
+        result = self.search(filters={'color': ['red', 'blue']})
+        self.assertEqual((result.total, set(result.product_ids)), (3, {self.drill.pk, self.saw.pk}))
+
+    def test_text_price_and_stock_filters(self):
+        self.assertEqual(self.search(query='perceuse 1').product_ids, [self.saw.pk])
+        self.assertEqual(set(self.search(query='p0').product_ids), {self.drill.pk})
+        result = self.search(price_min=55, price_max=150)
+        self.assertEqual(set(result.product_ids), {self.drill.pk, self.bare.pk})
+        self.assertEqual(set(self.search(price_max=60, in_stock=True).product_ids), {self.drill.pk})
+
+    def test_signals_keep_the_index_in_sync(self):
+        self.search()
+        variant = ProductVariant.objects.get(sku='P0-R')
+        with self.captureOnCommitCallbacks(execute=True):
+            variant.stock_quantity = 0
+            variant.save()
+            self.variant(self.saw, 'P1-G', 'green', 210, 1)
+        self.assertFalse(ProductVariant.product.is_cached(variant))
+        self.assertEqual(set(self.search(in_stock=True).product_ids), {self.saw.pk, self.bare.pk})
+        self.assertEqual(self.search(filters={'color': 'green'}).product_ids, [self.saw.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.saw.delete()
+        self.assertEqual(self.search(filters={'color': 'red'}).product_ids, [self.drill.pk])
+
+
+def rating_summaries():
+    return {
+        summary.product_id: (summary.rating_count, summary.rating_sum, summary.histogram, summary.average_rating)
+        for summary in ProductRatingSummary.objects.filter(rating_count__gt=0)
+    }
+
+
+class ProductRatingTests(TestCase):
+    def setUp(self):
+        company = create_company('5')
+        self.customer = create_customer(company)
+        catalog = ProductCatalog.objects.create(company=company, name='Outillage')
+        self.products = [create_product(catalog, index) for index in range(2)]
+
+    def review(self, product, rating):
+        return ProductReview.objects.create(product=product, customer=self.customer, rating=rating)
+
+    def assertMatchesRebuild(self):
+        incremental = rating_summaries()
+        ratings.rebuild()
+        self.assertEqual(incremental, rating_summaries())
+
+    def test_signals_keep_summary_equal_to_rebuild(self):
+        first = self.review(self.products[0], 4)
+        second = self.review(self.products[0], 2)
+        self.review(self.products[1], 0)
+        self.assertEqual(rating_summaries(), {self.products[0].pk: (2, 6, {1: 0, 2: 1, 3: 0, 4: 1, 5: 0}, 3.0)})
+        self.assertMatchesRebuild()
+
+        first.rating = 5
+        first.save()
+        second.product = self.products[1]
+        second.save()
+        self.assertMatchesRebuild()
+
+        partial = ProductReview.objects.only('pk', 'rating').get(pk=second.pk)
+        partial.rating = 1
+        partial.save(update_fields=['rating'])
+        self.assertEqual(rating_summaries()[self.products[1].pk][:2], (1, 1))
+        self.assertMatchesRebuild()
+
+        ProductReview.objects.defer('product').get(pk=first.pk).delete()
+        self.assertNotIn(self.products[0].pk, rating_summaries())
+        self.assertMatchesRebuild()
+
+
+class StorefrontCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.company = create_company('3')
+        self.catalogs = [ProductCatalog.objects.create(company=self.company, name=name) for name in ('Outillage', 'Jardin')]
+        for index, catalog in enumerate(self.catalogs):
+            create_product(catalog, index)
+        self.client = APIClient()
+        self.url = reverse('commerce:storefront_product_list', args=[self.company.pk])
+
+    def test_unknown_params_share_the_cached_response(self):
+        first = self.client.get(self.url, {'utm_source': 'newsletter'})
+        self.assertEqual(first.status_code, 200)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url, {'utm_source': 'ads', 'x': '42'})
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_known_params_keep_separate_entries(self):
+        everything = self.client.get(self.url)
+        outillage = self.client.get(self.url, {'catalog': str(self.catalogs[0].pk)})
+        self.assertEqual(everything.data['count'], 2)
+        self.assertEqual(outillage.data['count'], 1)
+        self.assertNotEqual(everything['ETag'], outillage['ETag'])
+
+    def test_request_identity_is_order_independent(self):
+        params = QueryDict('page=2&utm=a&catalog=c')
+        self.assertEqual(storefront.request_identity('/p/', params, ('catalog', 'page')), '/p/?catalog=c&page=2')
+        self.assertEqual(storefront.request_identity('/p/', QueryDict('utm=a'), ('catalog', 'page')), '/p/')
+
+
+@override_settings(AUDIT_ASYNC=False)
+class CartTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        carts.store.take_dirty()
+        self.company = create_company('2')
+        self.catalog = ProductCatalog.objects.create(company=self.company, name='Outillage')
+        self.product = create_product(self.catalog)
+        self.customers = [create_customer(self.company, index) for index in range(3)]
+
+    def test_add_item_rejects_unknown_products(self):
+        other = ProductCatalog.objects.create(company=create_company('3'), name='Autre')
+        inactive = create_product(self.catalog, 1)
+        Product.objects.filter(pk=inactive.pk).update(is_active=False)
+        for product_id in ('nope', create_product(other, 2).pk, inactive.pk):
+            with self.assertRaises(carts.InvalidCartItem):
+                carts.add_item(self.customers[0], product_id)
+        hot = carts.add_item(self.customers[0].pk, str(self.product.pk).upper(), 2)
+        self.assertEqual(hot.items, {str(self.product.pk): 2})
+
+    def test_bad_cart_does_not_block_the_batch(self):
+        for customer in self.customers:
+            carts.add_item(customer, self.product.pk)
+        Customer.objects.filter(pk=self.customers[1].pk).delete()
+        self.assertEqual(carts.flush(), 2)
+        self.assertEqual(carts.store.quarantined(), {str(self.customers[1].pk)})
+        self.assertEqual(carts.store.take_dirty(), set())
+        self.assertEqual(
+            set(CartItem.objects.values_list('cart__customer_id', flat=True)),
+            {self.customers[0].pk, self.customers[2].pk},
+        )
+
+    def stale_copy(self, customer):
+        """O carrinho como o flusher o leu antes do checkout"""
+        customer_id = str(customer.pk)
+        return carts.HotCart.unpack(customer_id, cache.get(carts.cache_key(customer_id)))
+
+    def test_late_flush_does_not_revive_checked_out_cart(self):
+        customer = self.customers[0]
+        carts.add_item(customer, self.product.pk, 2)
+        unsaved = self.stale_copy(customer)
+        carts.flush()
+        carts.add_item(customer, self.product.pk)
+        saved = self.stale_copy(customer)
+        cart, summary = carts.checkout(customer)
+        self.assertEqual(summary['item_count'], 3)
+        self.assertEqual(carts.persist([unsaved, saved]), 0)
+        self.assertEqual(list(Cart.objects.values_list('pk', 'is_active')), [(cart.pk, False)])
+        self.assertEqual(list(CartItem.objects.values_list('quantity', flat=True)), [3])
+
+    def test_expired_cart_is_replaced_not_reactivated(self):
+        customer = self.customers[0]
+        carts.add_item(customer, self.product.pk)
+        carts.flush()
+        old = Cart.objects.get()
+        Cart.objects.filter(pk=old.pk).update(updated_at=old.updated_at - carts.CART_IDLE * 2)
+        self.assertEqual(carts.expire_carts(), 1)
+        carts.add_item(customer, self.product.pk)
+        self.assertEqual(carts.flush(), 1)
+        self.assertFalse(Cart.objects.get(pk=old.pk).is_active)
+        new = Cart.objects.get(is_active=True)
+        self.assertEqual(new.items.get().quantity, 2)
+        self.assertEqual(cache.get(carts.cache_key(str(customer.pk)))[0], str(new.pk))
+
+    def test_cart_writes_are_not_audited(self):
+        carts.add_item(self.customers[0], self.product.pk)
+        carts.flush()
+        carts.add_item(self.customers[0], self.product.pk)
+        carts.flush()
+        self.assertFalse(AuditLog.objects.filter(entity_type__in=['commerce.cart', 'commerce.cartitem']).exists())
+
+
+class RecoveryDetectTests(TestCase):
+    def setUp(self):
+        self.company = create_company('4')
+        self.catalog = ProductCatalog.objects.create(company=self.company, name='Outillage')
+        self.product = create_product(self.catalog)
+        self.now = timezone.now()
+
+    def abandon(self, index):
+        cart = Cart.objects.create(customer=create_customer(self.company, index))
+        CartItem.objects.create(cart=cart, product=self.product)
+        Cart.objects.filter(pk=cart.pk).update(updated_at=self.now - recovery.ABANDONED_AFTER * 2)
+        return cart
+
+    def test_detect_counts_only_inserted_recoveries(self):
+        self.abandon(0)
+        self.abandon(1)
+        self.assertEqual(recovery.detect(now=self.now), 2)
+        # Marca d'água recuada: a janela é relida e só o carrinho novo entra
+        AbandonedCartScan.objects.all().delete()
+        self.abandon(2)
+        self.assertEqual(recovery.detect(now=self.now), 1)
+        self.assertEqual(AbandonedCartScan.objects.get().detected, 1)
+        self.assertEqual(CartRecovery.objects.count(), 3)
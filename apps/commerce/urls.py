@@ -0,0 +1,9 @@
+from django.urls import path
+from .api import StorefrontProductDetailView, StorefrontProductListView
+
+app_name = 'commerce'
+
+urlpatterns = [
+    path('storefront/<uuid:company_id>/products/', StorefrontProductListView.as_view(), name='storefront_product_list'),
+    path('storefront/<uuid:company_id>/products/<uuid:pk>/', StorefrontProductDetailView.as_view(), name='storefront_product_detail'),
+]
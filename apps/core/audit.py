@@ -0,0 +1,315 @@
+"""
+Auditoria das alterações em modelos derivados de BaseModel.
+
+Cada instância guarda, ao ser carregada (``post_init``), um retrato dos
+valores escalares carregados (referências, sem cópia). Os campos JSON, caros
+de copiar e que mudam no lugar, são lidos do banco só no ``pre_save`` de uma
+instância existente. No ``post_save`` só os campos que mudaram em relação ao
+retrato entram em ``AuditLog.changes`` como ``{"campo": [antes, depois]}``;
+valores que não são JSON (arquivos, por exemplo) entram como texto.
+As entradas entram numa fila limitada depois do commit e um thread as grava
+com ``bulk_create``. Com a fila cheia, quem salva espera até
+``PUT_TIMEOUT`` segundos e, se ainda não houver espaço, grava a própria
+entrada na hora: nada é descartado. Na saída do processo a fila é esvaziada.
+
+Com ``AUDIT_ASYNC = False`` (usado nos testes) não há thread nem flush na
+saída: cada entrada é gravada no commit, no mesmo banco e conexão.
+
+Operações em massa (``QuerySet.update``, ``bulk_create``) não disparam
+sinais e por isso não são auditadas.
+"""
+import atexit
+import contextvars
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files import File
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, models, transaction
+
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_ATTR = '_audit_snapshot'
+# Campos que mudam em todo save e não dizem nada
+IGNORED_FIELDS = {'created_at', 'updated_at'}
+# Sem auditoria: o próprio log, tabelas reescritas em lote (o DELETE do carrinho
+# viraria uma entrada e um sinal por linha) e execuções de relatório (result_data
+# copiaria até 256 KB de resultado em cada entrada)
+EXCLUDED_MODELS = {'core.auditlog', 'commerce.cart', 'commerce.cartitem', 'analytics.reportexecution'}
+MAX_PENDING = 10000
+FLUSH_BATCH_SIZE = 500
+FLUSH_INTERVAL = 2
+PUT_TIMEOUT = 0.5
+
+_context = contextvars.ContextVar('audit_context', default=None)
+_encoder = DjangoJSONEncoder()
+
+
+@contextmanager
+def audit_context(user=None, ip_address=None, user_agent='', request=None):
+    """Define quem está fazendo as alterações (usado pelo middleware e por comandos)"""
+    token = _context.set({'user': user, 'ip_address': ip_address, 'user_agent': user_agent, 'request': request})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def _current_actor():
+    context = _context.get()
+    if context is None:
+        return None, None, ''
+    user = context['user']
+    request = context['request']
+    if user is None and request is not None:
+        request_user = getattr(request, 'user', None)
+        if request_user is not None and request_user.is_authenticated:
+            user = request_user
+    return getattr(user, 'pk', user), context['ip_address'], context['user_agent']
+
+
+def is_synchronous():
+    return not getattr(settings, 'AUDIT_ASYNC', True)
+
+
+def is_audited(model):
+    return model._meta.label_lower not in EXCLUDED_MODELS | set(getattr(settings, 'AUDIT_EXCLUDED_MODELS', ()))
+
+
+def _field_names(model):
+    try:
+        return model._audit_fields
+    except AttributeError:
+        model._audit_fields = tuple(
+            field.attname for field in model._meta.concrete_fields
+            if field.name not in IGNORED_FIELDS and not field.primary_key
+        )
+        return model._audit_fields
+
+
+def _json_fields(model):
+    """Campos JSON: ficam fora do retrato da carga e são lidos do banco só antes do save"""
+    try:
+        return model._audit_json_fields
+    except AttributeError:
+        model._audit_json_fields = frozenset(
+            field.attname for field in model._meta.concrete_fields
+            if isinstance(field, models.JSONField) and field.attname in _field_names(model)
+        )
+        return model._audit_json_fields
+
+
+def _jsonable(value):
+    if value is None or isinstance(value, (str, int, float, bool, list, dict)):
+        return value
+    if isinstance(value, File):
+        return value.name
+    try:
+        return _encoder.default(value)
+    except TypeError:
+        return str(value)
+
+
+def _snapshot_value(value):
+    # O FieldFile muda no lugar (instance.file.save()); guarda o nome
+    return value.name if isinstance(value, File) else value
+
+
+def take_snapshot(instance):
+    """
+    Guarda, sem copiar, os valores escalares carregados; campos adiados e
+    campos JSON ficam de fora (ver ``snapshot_json``).
+    """
+    values = instance.__dict__
+    skipped = _json_fields(type(instance))
+    setattr(instance, SNAPSHOT_ATTR, {
+        name: _snapshot_value(values[name])
+        for name in _field_names(type(instance))
+        if name in values and name not in skipped
+    })
+
+
+def snapshot_json(instance, update_fields=None):
+    """
+    Completa o retrato com os campos JSON como estão no banco, logo antes do
+    save; uma consulta só quando a instância já existe e tem JSON carregado.
+    """
+    if instance._state.adding or instance.pk is None:
+        return
+    names = [name for name in _json_fields(type(instance)) if name in instance.__dict__]
+    if update_fields is not None:
+        names = [name for name in names if name in update_fields]
+    if not names:
+        return
+    stored = (
+        type(instance)._base_manager.using(instance._state.db)
+        .filter(pk=instance.pk).values(*names).first()
+    )
+    if stored is not None:
+        snapshot = getattr(instance, SNAPSHOT_ATTR, None)
+        if snapshot is None:
+            snapshot = {}
+            setattr(instance, SNAPSHOT_ATTR, snapshot)
+        snapshot.update(stored)
+
+
+def diff(instance):
+    """``{campo: [antes, depois]}`` dos campos alterados desde o retrato"""
+    snapshot = getattr(instance, SNAPSHOT_ATTR, None) or {}
+    values = instance.__dict__
+    return {
+        name: [_jsonable(snapshot[name]), _jsonable(values[name])]
+        for name in snapshot
+        if name in values and _snapshot_value(values[name]) != snapshot[name]
+    }
+
+
+def _entry(action, instance, changes):
+    from .models import AuditLog
+
+    user_id, ip_address, user_agent = _current_actor()
+    if user_id is None:
+        user_id = getattr(instance, 'updated_by_id', None) or getattr(instance, 'created_by_id', None)
+    return AuditLog(
+        user_id=user_id,
+        action=action,
+        entity_type=instance._meta.label_lower,
+        entity_id=instance.pk,
+        changes=changes,
+        ip_address=ip_address,
+        user_agent=user_agent or '',
+    )
+
+
+def record(action, instance, changes):
+    entry = _entry(action, instance, changes)
+    transaction.on_commit(lambda: buffer.put(entry))
+
+
+def record_save(instance, created):
+    if created:
+        values = instance.__dict__
+        record('create', instance, {
+            name: [None, _jsonable(values[name])]
+            for name in _field_names(type(instance))
+            if values.get(name) not in (None, '')
+        })
+    else:
+        changes = diff(instance)
+        if changes:
+            record('update', instance, changes)
+    take_snapshot(instance)
+
+
+def record_delete(instance):
+    values = instance.__dict__
+    record('delete', instance, {
+        name: [_jsonable(values[name]), None] for name in _field_names(type(instance)) if name in values
+    })
+
+
+class AuditBuffer:
+    """Fila limitada de entradas de auditoria gravadas em lote por um thread"""
+
+    def __init__(self, maxsize=MAX_PENDING):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+        # Lote cuja gravação falhou; é o primeiro da próxima tentativa
+        self._retry = []
+
+    def put(self, entry):
+        if is_synchronous():
+            self.write([entry])
+            return
+        self._ensure_flusher()
+        try:
+            self._queue.put(entry, timeout=PUT_TIMEOUT)
+        except queue.Full:
+            logger.warning("Audit queue full, writing entry synchronously")
+            self.write([entry])
+            return
+        if self._queue.qsize() >= FLUSH_BATCH_SIZE:
+            self._wake.set()
+
+    def drain(self, limit):
+        entries = []
+        while len(entries) < limit:
+            try:
+                entries.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return entries
+
+    def write(self, entries):
+        from .models import AuditLog
+
+        AuditLog.objects.bulk_create(entries, batch_size=FLUSH_BATCH_SIZE)
+
+    def flush(self):
+        """Grava tudo o que está na fila; retorna quantas entradas"""
+        written = 0
+        with self._flush_lock:
+            while True:
+                entries, self._retry = self._retry or self.drain(FLUSH_BATCH_SIZE), []
+                if not entries:
+                    return written
+                try:
+                    self.write(entries)
+                except Exception:
+                    self._retry = entries
+                    raise
+                written += len(entries)
+
+    def pending(self):
+        return self._queue.qsize() + len(self._retry)
+
+    def _ensure_flusher(self):
+        if self._flusher is None:
+            with self._lock:
+                if self._flusher is None:
+                    self._flusher = threading.Thread(target=self._run, name='audit-flusher', daemon=True)
+                    self._flusher.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                close_old_connections()
+                self.flush()
+            except Exception:
+                logger.exception("Audit flush failed")
+
+    def stop(self):
+        """Para o thread e grava o que restou"""
+        self._stopping.set()
+        self._wake.set()
+        if self._flusher is not None and self._flusher is not threading.current_thread():
+            self._flusher.join(timeout=FLUSH_INTERVAL * 2)
+        self.flush()
+
+
+buffer = AuditBuffer()
+
+
+def flush():
+    return buffer.flush()
+
+
+@atexit.register
+def _flush_on_exit():
+    # Sem thread nada ficou na fila (modo síncrono); o banco pode nem existir mais
+    if buffer._flusher is None and not buffer.pending():
+        return
+    try:
+        buffer.stop()
+    except Exception:
+        logger.exception("Audit flush at exit failed; %s entries lost", buffer.pending())
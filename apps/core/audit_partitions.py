@@ -0,0 +1,317 @@
+"""
+Armazenamento mensal do AuditLog, retenção e arquivamento.
+
+No Postgres ``core_auditlog`` vira uma tabela particionada por intervalo de
+``created_at``, com uma partição por mês (``core_auditlog_p202610``) e uma
+partição padrão para o que cair fora delas; a chave primária passa a ser
+(id, created_at), exigência do particionamento. No SQLite, que não tem
+partições, a tabela corrente é renomeada na virada do mês para
+``core_auditlog_pAAAAMM`` e uma tabela nova e vazia assume o nome original;
+lá ``AuditLog.objects`` (e o admin) só veem o mês corrente e o histórico
+completo é lido por ``lookup``.
+
+A retenção grava cada partição mais antiga que ``AUDIT_RETENTION_MONTHS``
+num arquivo JSONL comprimido em ``AUDIT_ARCHIVE_DIR`` e descarta a tabela
+inteira (DETACH + DROP), sem DELETE linha a linha. Tudo roda pelo comando
+``maintain_audit_log``.
+"""
+import gzip
+import json
+import logging
+import os
+import re
+from datetime import datetime
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from .models import AuditLog
+
+
+logger = logging.getLogger(__name__)
+
+TABLE = AuditLog._meta.db_table
+PARTITION_RE = re.compile(rf'^{TABLE}_p(\d{{4}})(\d{{2}})$')
+# Partições criadas com antecedência no Postgres
+MONTHS_AHEAD = 3
+ARCHIVE_CHUNK_SIZE = 5000
+
+
+def retention_months():
+    return getattr(settings, 'AUDIT_RETENTION_MONTHS', 12)
+
+
+def archive_dir():
+    return str(getattr(settings, 'AUDIT_ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'audit_archive')))
+
+
+def month_start(value):
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    return value.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(month):
+    return f'{TABLE}_p{month.year}{month.month:02d}'
+
+
+def partition_month(name):
+    """Primeiro dia do mês de uma partição, ou None se o nome não for de partição"""
+    match = PARTITION_RE.match(name)
+    if not match:
+        return None
+    return datetime(int(match[1]), int(match[2]), 1, tzinfo=timezone.get_current_timezone())
+
+
+def partitions():
+    """(mês, tabela) das partições existentes, da mais nova para a mais antiga"""
+    found = [(partition_month(name), name) for name in connection.introspection.table_names()]
+    return sorted(((month, name) for month, name in found if month), reverse=True)
+
+
+def _json_columns():
+    return {field.column for field in AuditLog._meta.concrete_fields if isinstance(field, models.JSONField)}
+
+
+def archive_partition(table, directory=None):
+    """Grava todas as linhas da tabela em ``<tabela>.jsonl.gz``; retorna (arquivo, linhas)"""
+    directory = directory or archive_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{table}.jsonl.gz')
+    json_columns = _json_columns()
+    rows = 0
+    with connection.cursor() as cursor, gzip.open(f'{path}.tmp', 'wt', encoding='utf-8') as output:
+        cursor.execute(f'SELECT * FROM {connection.ops.quote_name(table)}')
+        columns = [column[0] for column in cursor.description]
+        while True:
+            chunk = cursor.fetchmany(ARCHIVE_CHUNK_SIZE)
+            if not chunk:
+                break
+            for row in chunk:
+                record = dict(zip(columns, row))
+                for column in json_columns & record.keys():
+                    if isinstance(record[column], str):
+                        record[column] = json.loads(record[column])
+                output.write(json.dumps(record, cls=DjangoJSONEncoder))
+                output.write('\n')
+            rows += len(chunk)
+    os.replace(f'{path}.tmp', path)
+    return path, rows
+
+
+class BasePartitionBackend:
+    def prepare(self, now):
+        """Deixa a tabela corrente pronta para o mês de ``now``"""
+        raise NotImplementedError
+
+    def drop_partition(self, table):
+        raise NotImplementedError
+
+    def apply_retention(self, now, months=None, directory=None):
+        """Arquiva e descarta as partições mais antigas que a retenção; retorna [(tabela, linhas)]"""
+        cutoff = add_months(month_start(now), -(retention_months() if months is None else months))
+        dropped = []
+        for month, table in partitions():
+            if month >= cutoff:
+                continue
+            path, rows = archive_partition(table, directory)
+            self.drop_partition(table)
+            logger.info("Archived %s rows of %s to %s", rows, table, path)
+            dropped.append((table, rows))
+        return dropped
+
+
+class PostgresPartitions(BasePartitionBackend):
+    """Particionamento nativo por intervalo de ``created_at``"""
+
+    def is_partitioned(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid '
+                'WHERE c.relname = %s', [TABLE],
+            )
+            return cursor.fetchone() is not None
+
+    def _create_partition(self, cursor, parent, month):
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS {connection.ops.quote_name(partition_name(month))} '
+            f'PARTITION OF {connection.ops.quote_name(parent)} FOR VALUES FROM (%s) TO (%s)',
+            [month, add_months(month, 1)],
+        )
+
+    def convert(self, now):
+        """Recria a tabela como particionada e copia as linhas existentes (uma vez só)"""
+        quote = connection.ops.quote_name
+        staging = f'{TABLE}_partitioned'
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'SELECT MIN(created_at) FROM {quote(TABLE)}')
+            first = cursor.fetchone()[0] or now
+            cursor.execute(
+                f'CREATE TABLE {quote(staging)} (LIKE {quote(TABLE)} INCLUDING DEFAULTS) '
+                f'PARTITION BY RANGE (created_at)'
+            )
+            cursor.execute(f'ALTER TABLE {quote(staging)} ADD PRIMARY KEY (id, created_at)')
+            cursor.execute(f'CREATE TABLE {quote(TABLE + "_default")} PARTITION OF {quote(staging)} DEFAULT')
+            month, last = month_start(timezone.localtime(first)), add_months(month_start(now), MONTHS_AHEAD)
+            while month <= last:
+                self._create_partition(cursor, staging, month)
+                month = add_months(month, 1)
+            cursor.execute(f'INSERT INTO {quote(staging)} SELECT * FROM {quote(TABLE)}')
+            cursor.execute(f'DROP TABLE {quote(TABLE)}')
+            cursor.execute(f'ALTER TABLE {quote(staging)} RENAME TO {quote(TABLE)}')
+            for field in AuditLog._meta.concrete_fields:
+                if field.remote_field:
+                    target = field.remote_field.model._meta
+                    cursor.execute(
+                        f'ALTER TABLE {quote(TABLE)} ADD CONSTRAINT {quote(f"{TABLE}_{field.column}_fk")} '
+                        f'FOREIGN KEY ({quote(field.column)}) '
+                        f'REFERENCES {quote(target.db_table)} ({quote(target.pk.column)}) '
+                        f'DEFERRABLE INITIALLY DEFERRED'
+                    )
+            with connection.schema_editor(atomic=False) as editor:
+                for index in AuditLog._meta.indexes:
+                    editor.add_index(AuditLog, index)
+
+    def prepare(self, now):
+        if not self.is_partitioned():
+            self.convert(now)
+            return
+        with connection.cursor() as cursor:
+            month = month_start(now)
+            for offset in range(MONTHS_AHEAD + 1):
+                self._create_partition(cursor, TABLE, add_months(month, offset))
+
+    def drop_partition(self, table):
+        quote = connection.ops.quote_name
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE {quote(TABLE)} DETACH PARTITION {quote(table)}')
+            cursor.execute(f'DROP TABLE {quote(table)}')
+
+
+class SQLitePartitions(BasePartitionBackend):
+    """Tabelas mensais por rotação: a tabela corrente só guarda o mês atual"""
+
+    def prepare(self, now):
+        """
+        Move as linhas de meses anteriores para as tabelas mensais; retorna as tabelas gravadas.
+
+        Um mês por vez, do mais antigo: se a tabela corrente acumulou vários
+        meses (rotação atrasada), cada um vai para a sua própria tabela.
+        """
+        start = month_start(now)
+        rotated = []
+        while True:
+            first = (
+                AuditLog.objects.filter(created_at__lt=start)
+                .order_by('created_at').values_list('created_at', flat=True).first()
+            )
+            if first is None:
+                return rotated
+            month = month_start(timezone.localtime(first))
+            rotated.append(self._rotate(month))
+
+    def _rotate(self, month):
+        """Tira da tabela corrente as linhas anteriores ao fim de ``month`` (o mês mais antigo nela)"""
+        quote = connection.ops.quote_name
+        rotated = partition_name(month)
+        boundary = connection.ops.adapt_datetimefield_value(add_months(month, 1))
+        columns = ', '.join(quote(field.column) for field in AuditLog._meta.concrete_fields)
+        # O schema editor abre a transação com as checagens de FK desligadas,
+        # como o SQLite exige para DDL
+        with connection.schema_editor() as editor:
+            if rotated in connection.introspection.table_names():
+                # Linhas atrasadas de um mês já rotacionado
+                editor.execute(
+                    f'INSERT INTO {quote(rotated)} ({columns}) SELECT {columns} FROM {quote(TABLE)} WHERE created_at < %s',
+                    [boundary],
+                )
+                editor.execute(f'DELETE FROM {quote(TABLE)} WHERE created_at < %s', [boundary])
+                return rotated
+            editor.execute(f'ALTER TABLE {quote(TABLE)} RENAME TO {quote(rotated)}')
+            # Os nomes de índice são globais no SQLite: os índices da tabela
+            # renomeada são recriados com nomes próprios antes da tabela nova
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL",
+                    [rotated],
+                )
+                indexes = cursor.fetchall()
+            for number, (name, sql) in enumerate(indexes):
+                editor.execute(f'DROP INDEX {quote(name)}')
+                editor.execute(sql.replace(quote(name), quote(f'{rotated}_{number}'), 1))
+            editor.create_model(AuditLog)
+            # Linhas dos meses seguintes voltam para a tabela corrente
+            editor.execute(
+                f'INSERT INTO {quote(TABLE)} ({columns}) SELECT {columns} FROM {quote(rotated)} WHERE created_at >= %s',
+                [boundary],
+            )
+            editor.execute(f'DELETE FROM {quote(rotated)} WHERE created_at >= %s', [boundary])
+        return rotated
+
+    def drop_partition(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE {connection.ops.quote_name(table)}')
+
+
+def get_backend():
+    if connection.vendor == 'postgresql':
+        return PostgresPartitions()
+    if connection.vendor == 'sqlite':
+        return SQLitePartitions()
+    return None
+
+
+def _partition_queryset(queryset, table):
+    """Mesmo filtro do queryset executado numa tabela mensal do SQLite"""
+    sql, params = queryset.query.sql_with_params()
+    quote = connection.ops.quote_name
+    return AuditLog.objects.raw(sql.replace(quote(TABLE), quote(table)), params)
+
+
+def lookup(entity_type=None, entity_id=None, user=None, since=None, until=None, limit=100):
+    """
+    Entradas mais recentes primeiro, filtrando pelos índices compostos.
+
+    No Postgres é uma consulta só (o planejador descarta as partições fora do
+    período); no SQLite as tabelas mensais são lidas da mais nova para a mais
+    antiga até completar ``limit``.
+    """
+    queryset = AuditLog.objects.order_by('-created_at')
+    if entity_type is not None:
+        queryset = queryset.filter(entity_type=entity_type)
+    if entity_id is not None:
+        queryset = queryset.filter(entity_id=entity_id)
+    if user is not None:
+        queryset = queryset.filter(user=user)
+    if since is not None:
+        queryset = queryset.filter(created_at__gte=since)
+    if until is not None:
+        queryset = queryset.filter(created_at__lt=until)
+    results = list(queryset[:limit])
+    if connection.vendor != 'sqlite':
+        return results
+    for month, table in partitions():
+        if len(results) >= limit:
+            break
+        if since is not None and add_months(month, 1) <= since:
+            break
+        if until is not None and month >= until:
+            continue
+        results.extend(_partition_queryset(queryset[:limit - len(results)], table))
+    return results
+
+
+def maintain(now=None, months=None, directory=None):
+    """Prepara a partição do mês e aplica a retenção; retorna as tabelas descartadas"""
+    backend = get_backend()
+    if backend is None:
+        logger.warning("Audit log partitioning is not supported on %s", connection.vendor)
+        return []
+    now = timezone.localtime(now or timezone.now())
+    backend.prepare(now)
+    return backend.apply_retention(now, months=months, directory=directory)
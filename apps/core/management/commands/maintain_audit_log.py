@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from core.audit_partitions import maintain, retention_months
+
+
+class Command(BaseCommand):
+    help = "Prepara a partição mensal do log de auditoria e arquiva as partições fora da retenção"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-months', type=int, default=None)
+        parser.add_argument('--archive-dir', default=None)
+
+    def handle(self, *args, **options):
+        months = options['retention_months']
+        dropped = maintain(months=months, directory=options['archive_dir'])
+        for table, rows in dropped:
+            self.stdout.write(f"{table}: {rows} rows archived")
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(dropped)} partitions archived (retention: {months or retention_months()} months)."
+        ))
@@ -0,0 +1,16 @@
+from .audit import audit_context
+
+
+class AuditContextMiddleware:
+    """Associa as alterações feitas durante a requisição ao usuário, IP e user agent"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with audit_context(
+            ip_address=request.META.get('REMOTE_ADDR') or None,
+            user_agent=request.META.get('HTTP_USER_AGENT', ''),
+            request=request,
+        ):
+            return self.get_response(request)
@@ -225,6 +225,10 @@ class Module(BaseModel):
 class AuditLog(BaseModel):
     """
     Log de auditoria para todas as ações importantes
+
+    No SQLite a tabela só guarda o mês corrente (core.audit_partitions):
+    ``AuditLog.objects`` e o admin não veem os meses rotacionados, que são
+    lidos por ``audit_partitions.lookup``.
     """
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -236,13 +240,20 @@ class AuditLog(BaseModel):
     entity_type = models.CharField(_('entity type'), max_length=100)
     entity_id = models.UUIDField(_('entity id'))
     changes = models.JSONField(_('changes'), default=dict)
-    ip_address = models.GenericIPAddressField(_('IP address'))
+    # Vazio para alterações feitas fora de uma requisição (comandos, workers)
+    ip_address = models.GenericIPAddressField(_('IP address'), null=True, blank=True)
     user_agent = models.TextField(_('user agent'), blank=True)
     
     class Meta:
         verbose_name = _('audit log')
         verbose_name_plural = _('audit logs')
         ordering = ['-created_at']
+        # Armazenamento particionado por mês em core.audit_partitions
+        indexes = [
+            models.Index(fields=['entity_type', 'entity_id', 'created_at']),
+            models.Index(fields=['user', 'created_at']),
+            models.Index(fields=['created_at']),
+        ]
 
 class Notification(BaseModel):
     """
@@ -266,4 +277,53 @@ class Notification(BaseModel):
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['recipient', 'read']),
-        ]
\ No newline at end of file
+        ]
+
+class RatingSummaryBase(models.Model):
+    """
+    Resumo desnormalizado de avaliações (contagem, soma, histograma 1-5 e médias por atributo)
+    """
+    rating_count = models.PositiveIntegerField(_('rating count'), default=0)
+    rating_sum = models.PositiveIntegerField(_('rating sum'), default=0)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+    average_rating = models.FloatField(_('average rating'), default=0, db_index=True)
+    # {"pontualidade": {"sum": 42, "count": 10}, ...}
+    attribute_totals = models.JSONField(_('attribute totals'), default=dict)
+    updated_at = models.DateTimeField(_('updated at'), auto_now=True)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def histogram(self):
+        return {star: getattr(self, f'rating_{star}') for star in range(1, 6)}
+
+    @property
+    def attribute_averages(self):
+        return {
+            name: totals['sum'] / totals['count']
+            for name, totals in self.attribute_totals.items()
+            if totals.get('count')
+        }
+
+    def apply(self, rating, attributes=None, sign=1):
+        """Soma (sign=1) ou remove (sign=-1) a contribuição de uma avaliação"""
+        if rating not in range(1, 6):
+            return
+        self.rating_count = max(self.rating_count + sign, 0)
+        self.rating_sum = max(self.rating_sum + sign * rating, 0)
+        field = f'rating_{rating}'
+        setattr(self, field, max(getattr(self, field) + sign, 0))
+        for name, value in (attributes or {}).items():
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                continue
+            totals = self.attribute_totals.setdefault(name, {'sum': 0, 'count': 0})
+            totals['sum'] += sign * value
+            totals['count'] += sign
+            if totals['count'] <= 0:
+                del self.attribute_totals[name]
+        self.average_rating = self.rating_sum / self.rating_count if self.rating_count else 0
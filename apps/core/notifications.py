@@ -0,0 +1,274 @@
+"""
+Envio de notificações (Notification) em lote.
+
+Destinatários e preferências saem de uma única consulta (User +
+CompanyUser), as notificações internas (canal ``in_app``) são gravadas com
+``bulk_create`` e os demais canais (e-mail, SMS, push...) são entregues por
+executores registrados com ``register_channel``, em threads, depois do commit.
+
+Preferências, em ``User.notification_settings`` e, com prioridade, em
+``CompanyUser.notification_preferences``::
+
+    {"channels": {"email": false},              # canal desligado para tudo
+     "types": {"invoice.overdue": {"sms": true}, # por tipo e canal
+               "marketing.digest": false}}      # tipo silenciado
+
+A contagem de não lidas fica em cache até a próxima notificação ou leitura,
+mas só com um cache compartilhado (Redis/Memcached em ``CACHES``): a
+invalidação feita por um processo não chega ao LocMem dos outros, então com
+o padrão do projeto (um cache por processo) a contagem vai direto ao banco.
+
+Na saída do processo a fila dos canais é esvaziada (até ``DRAIN_TIMEOUT``);
+o que sobrar é registrado no log como perdido.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.mail import EmailMessage, get_connection
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from companies.models import CompanyUser
+
+from . import push
+from .models import Notification
+
+
+logger = logging.getLogger(__name__)
+
+IN_APP = 'in_app'
+DEFAULT_CHANNELS = (IN_APP,)
+BULK_SIZE = 1000
+CHANNEL_BATCH_SIZE = 200
+UNREAD_KEY = 'notifications-unread:{user_id}'
+UNREAD_TIMEOUT = 300
+DRAIN_TIMEOUT = 30
+
+_channel_handlers = {}
+
+
+def register_channel(name):
+    """Decorador que registra o executor de um canal; recebe a lista de entregas do lote"""
+    def decorator(handler):
+        _channel_handlers[name] = handler
+        return handler
+    return decorator
+
+
+def _enabled(preferences, notification_type, channel):
+    """None quando a preferência não fala do caso, senão True/False"""
+    if not isinstance(preferences, dict):
+        return None
+    by_type = (preferences.get('types') or {}).get(notification_type)
+    if by_type is False:
+        return False
+    if isinstance(by_type, dict) and channel in by_type:
+        return bool(by_type[channel])
+    channels = preferences.get('channels') or {}
+    if channel in channels:
+        return bool(channels[channel])
+    return None
+
+
+def resolve_channels(notification_type, channels, user_settings, membership_preferences=None):
+    """Canais pedidos que o destinatário não desligou"""
+    resolved = []
+    for channel in channels:
+        enabled = _enabled(membership_preferences, notification_type, channel)
+        if enabled is None:
+            enabled = _enabled(user_settings, notification_type, channel)
+        if enabled is not False:
+            resolved.append(channel)
+    return resolved
+
+
+def company_recipients(company, access_levels=None):
+    """(user_id, email, notification_settings, notification_preferences) dos membros ativos"""
+    members = CompanyUser.objects.filter(company=company, status='active', user__is_active=True)
+    if access_levels:
+        members = members.filter(access_level__in=access_levels)
+    return members.values_list('user_id', 'user__email', 'user__notification_settings', 'notification_preferences')
+
+
+def user_recipients(users):
+    ids = [getattr(user, 'pk', user) for user in users]
+    rows = get_user_model().objects.filter(pk__in=ids, is_active=True).values_list('pk', 'email', 'notification_settings')
+    return [(pk, email, user_settings, None) for pk, email, user_settings in rows]
+
+
+def unread_key(user_id):
+    return UNREAD_KEY.format(user_id=user_id)
+
+
+def invalidate_unread(user_ids):
+    cache.delete_many([unread_key(user_id) for user_id in user_ids])
+
+
+def deliver(recipients, notification_type, title, message, data=None, channels=DEFAULT_CHANNELS):
+    """
+    Grava as notificações internas e agenda os demais canais.
+
+    ``recipients`` é o resultado de ``company_recipients``/``user_recipients``.
+    Retorna as Notification criadas.
+    """
+    return deliver_many([(recipients, notification_type, title, message, data, channels)])
+
+
+def deliver_many(messages):
+    """
+    Como ``deliver``, para várias mensagens de uma vez: um único ``bulk_create``.
+
+    ``messages`` é uma lista de (recipients, type, title, message, data, channels).
+    """
+    notifications, jobs = [], defaultdict(list)
+    for recipients, notification_type, title, message, data, channels in messages:
+        data = data or {}
+        for user_id, email, user_settings, membership_preferences in recipients:
+            enabled = resolve_channels(notification_type, channels, user_settings, membership_preferences)
+            if IN_APP in enabled:
+                notifications.append(Notification(
+                    recipient_id=user_id, type=notification_type, title=title, message=message, data=data,
+                ))
+            for channel in enabled:
+                if channel != IN_APP:
+                    jobs[channel].append({
+                        'user_id': user_id, 'email': email, 'type': notification_type,
+                        'title': title, 'message': message, 'data': data,
+                    })
+    Notification.objects.bulk_create(notifications, batch_size=BULK_SIZE)
+    user_ids = {notification.recipient_id for notification in notifications}
+    transaction.on_commit(lambda: invalidate_unread(user_ids))
+    transaction.on_commit(lambda: push.publish_notifications(notifications))
+    if jobs:
+        transaction.on_commit(lambda: workers.put_many(jobs))
+    return notifications
+
+
+def notify_company(company, notification_type, title, message, data=None, channels=DEFAULT_CHANNELS, access_levels=None):
+    """Notifica todos os membros ativos da empresa (opcionalmente só alguns níveis de acesso)"""
+    return deliver(company_recipients(company, access_levels), notification_type, title, message, data, channels)
+
+
+def notify_users(users, notification_type, title, message, data=None, channels=DEFAULT_CHANNELS):
+    return deliver(user_recipients(users), notification_type, title, message, data, channels)
+
+
+def mark_read(user, notification_ids=None):
+    """Marca como lidas num único UPDATE (todas, ou só as indicadas); retorna quantas"""
+    user_id = getattr(user, 'pk', user)
+    notifications = Notification.objects.filter(recipient_id=user_id, read=False)
+    if notification_ids is not None:
+        notifications = notifications.filter(pk__in=notification_ids)
+    updated = notifications.update(read=True, read_at=timezone.now(), updated_at=timezone.now())
+    if updated:
+        invalidate_unread([user_id])
+    return updated
+
+
+def shared_cache():
+    """Se o cache padrão é visto por todos os processos (não é LocMem nem Dummy)"""
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS], (LocMemCache, DummyCache))
+
+
+def unread_count(user):
+    """Contagem de não lidas, em cache até a próxima notificação ou leitura (só com cache compartilhado)"""
+    user_id = getattr(user, 'pk', user)
+    unread = Notification.objects.filter(recipient_id=user_id, read=False)
+    if not shared_cache():
+        return unread.count()
+    return cache.get_or_set(unread_key(user_id), unread.count, UNREAD_TIMEOUT)
+
+
+class ChannelWorkers:
+    """Fila em processo com threads que entregam os canais externos em lotes"""
+
+    def __init__(self, workers=2, maxsize=10000):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._size = workers
+        self._workers = []
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def put_many(self, jobs):
+        """``jobs`` mapeia canal para a lista de entregas"""
+        self._ensure_workers()
+        for channel, items in jobs.items():
+            for offset in range(0, len(items), CHANNEL_BATCH_SIZE):
+                self._queue.put((channel, items[offset:offset + CHANNEL_BATCH_SIZE]))
+
+    def join(self):
+        self._queue.join()
+
+    def _ensure_workers(self):
+        if not self._workers:
+            with self._lock:
+                if not self._workers:
+                    self._workers = [
+                        threading.Thread(target=self._run, name=f'notification-channel-{index}', daemon=True)
+                        for index in range(self._size)
+                    ]
+                    for worker in self._workers:
+                        worker.start()
+
+    def _run(self):
+        while True:
+            try:
+                channel, items = self._queue.get(timeout=1)
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return
+                continue
+            try:
+                close_old_connections()
+                handler = _channel_handlers.get(channel)
+                if handler is None:
+                    logger.warning("No handler registered for notification channel %r", channel)
+                else:
+                    handler(items)
+            except Exception:
+                logger.exception("Notification delivery failed on channel %r", channel)
+            finally:
+                self._queue.task_done()
+
+    def stop(self, timeout=DRAIN_TIMEOUT):
+        """Deixa os workers esvaziarem a fila e terminarem; retorna quantas entregas ficaram sem sair"""
+        self._stopping.set()
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            worker.join(max(deadline - time.monotonic(), 0))
+        lost = 0
+        while True:
+            try:
+                lost += len(self._queue.get_nowait()[1])
+            except queue.Empty:
+                break
+        if lost:
+            logger.error("Notification channels stopped with %d deliveries not sent", lost)
+        return lost
+
+
+workers = ChannelWorkers()
+
+
+@atexit.register
+def _drain_on_exit():
+    workers.stop()
+
+
+@register_channel('email')
+def send_email(items):
+    """Uma conexão SMTP para o lote inteiro"""
+    messages = [
+        EmailMessage(subject=item['title'], body=item['message'], from_email=settings.DEFAULT_FROM_EMAIL, to=[item['email']])
+        for item in items if item['email']
+    ]
+    get_connection().send_messages(messages)
@@ -0,0 +1,138 @@
+"""
+Pub/sub em processo para os eventos enviados aos navegadores (core.push).
+
+Cada processo ASGI mantém os assinantes em memória: publicar é entregar a
+mensagem nas filas asyncio dos assinantes do canal, sem tocar no banco.
+
+O backend padrão (``InProcessBackend``) só serve a um único processo ASGI que
+também seja o único a publicar: mensagens publicadas em outro processo (outro
+worker, WSGI, comandos, threads de workers) se perdem sem erro. Fora desse
+caso ``PUSH_BACKEND = 'core.pubsub.RedisBackend'`` (e ``PUSH_REDIS_URL``) é
+obrigatório: cada processo assina o Redis uma única vez e repassa as
+mensagens aos seus assinantes locais.
+"""
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+# Mensagens retidas por assinante lento; acima disso as mais antigas saem
+SUBSCRIBER_QUEUE_SIZE = 100
+REDIS_PREFIX = 'push:'
+
+
+class InProcessBackend:
+    """Assinantes em memória; só entrega o que for publicado no mesmo processo"""
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, channel, message):
+        """Pode ser chamado de qualquer thread"""
+        self.dispatch(channel, message)
+
+    def dispatch(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, subscriber in subscribers:
+            loop.call_soon_threadsafe(self._offer, subscriber, message)
+
+    @staticmethod
+    def _offer(subscriber, message):
+        if subscriber.full():
+            subscriber.get_nowait()
+        subscriber.put_nowait(message)
+
+    async def start(self):
+        """Chamado na primeira assinatura de cada loop"""
+
+    @asynccontextmanager
+    async def subscribe(self, channels):
+        """Fila asyncio que recebe as mensagens dos canais enquanto o contexto durar"""
+        await self.start()
+        entry = (asyncio.get_running_loop(), asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE))
+        with self._lock:
+            for channel in channels:
+                self._subscribers[channel].add(entry)
+        try:
+            yield entry[1]
+        finally:
+            with self._lock:
+                for channel in channels:
+                    self._subscribers[channel].discard(entry)
+                    if not self._subscribers[channel]:
+                        del self._subscribers[channel]
+
+
+class RedisBackend(InProcessBackend):
+    """Publica no Redis; um único listener por processo repassa aos assinantes locais"""
+
+    def __init__(self):
+        super().__init__()
+        try:
+            import redis
+            import redis.asyncio
+        except ImportError as error:
+            raise ImproperlyConfigured("RedisBackend requires the 'redis' package") from error
+        self._url = getattr(settings, 'PUSH_REDIS_URL', 'redis://localhost:6379/0')
+        self._client = redis.Redis.from_url(self._url)
+        self._async_redis = redis.asyncio
+        self._listener = None
+
+    def publish(self, channel, message):
+        self._client.publish(REDIS_PREFIX + channel, json.dumps(message, cls=DjangoJSONEncoder))
+
+    async def start(self):
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+
+    async def _listen(self):
+        while True:
+            try:
+                client = self._async_redis.from_url(self._url)
+                async with client.pubsub() as pubsub:
+                    await pubsub.psubscribe(REDIS_PREFIX + '*')
+                    async for item in pubsub.listen():
+                        if item['type'] == 'pmessage':
+                            self.dispatch(item['channel'].decode()[len(REDIS_PREFIX):], json.loads(item['data']))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Push listener lost the Redis connection, reconnecting")
+                await asyncio.sleep(1)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = import_string(getattr(settings, 'PUSH_BACKEND', 'core.pubsub.InProcessBackend'))()
+    return _backend
+
+
+def publish(channel, event, data):
+    """Publica ``{"event": ..., "data": ...}`` no canal; falhas só vão para o log"""
+    try:
+        get_backend().publish(channel, {'event': event, 'data': data})
+    except Exception:
+        logger.exception("Could not publish %r to %s", event, channel)
+
+
+def subscribe(channels):
+    return get_backend().subscribe(channels)
@@ -0,0 +1,90 @@
+"""
+Eventos em tempo real por Server-Sent Events.
+
+``GET /events/`` mantém a conexão aberta e envia as notificações novas do
+usuário; com ``?company=<uuid>`` também envia as atualizações de Metric da
+empresa (o usuário precisa ser membro ativo). A view é assíncrona e só faz
+sentido servida por ASGI (``batmart_pro.asgi``): cada conexão aberta custa
+uma fila em memória, e não consultas periódicas ao banco.
+"""
+import asyncio
+import json
+import uuid
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponseForbidden, StreamingHttpResponse
+
+from companies.models import CompanyUser
+
+from . import pubsub
+
+
+KEEPALIVE_SECONDS = 15
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+def company_channel(company_id):
+    return f'company:{company_id}'
+
+
+def publish_notifications(notifications):
+    for notification in notifications:
+        pubsub.publish(user_channel(notification.recipient_id), 'notification', {
+            'id': notification.pk,
+            'type': notification.type,
+            'title': notification.title,
+            'message': notification.message,
+            'data': notification.data,
+            'created_at': notification.created_at,
+        })
+
+
+def publish_metric(metric):
+    pubsub.publish(company_channel(metric.company_id), 'metric', {
+        'id': metric.pk,
+        'name': metric.name,
+        'value': metric.current_value,
+        'last_updated': metric.last_updated,
+    })
+
+
+def format_event(message):
+    data = json.dumps(message['data'], cls=DjangoJSONEncoder)
+    return f"event: {message['event']}\ndata: {data}\n\n"
+
+
+async def stream(channels):
+    async with pubsub.subscribe(channels) as messages:
+        yield ': connected\n\n'
+        while True:
+            try:
+                message = await asyncio.wait_for(messages.get(), KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            yield format_event(message)
+
+
+async def event_stream(request):
+    user = await request.auser()
+    if not user.is_authenticated:
+        return HttpResponseForbidden()
+    channels = [user_channel(user.pk)]
+    company_id = request.GET.get('company')
+    if company_id:
+        try:
+            company_id = uuid.UUID(company_id)
+        except ValueError:
+            return HttpResponseForbidden()
+        is_member = await CompanyUser.objects.filter(company_id=company_id, user=user, status='active').aexists()
+        if not is_member:
+            return HttpResponseForbidden()
+        channels.append(company_channel(company_id))
+    response = StreamingHttpResponse(stream(channels), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Evita que o nginx segure os eventos no buffer
+    response['X-Accel-Buffering'] = 'no'
+    return response
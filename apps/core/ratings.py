@@ -0,0 +1,111 @@
+"""
+Manutenção dos resumos de avaliação (``RatingSummaryBase``).
+
+Os resumos são atualizados de forma incremental a cada avaliação criada,
+alterada ou removida, e podem ser reconstruídos por completo a partir de uma
+consulta agrupada.
+
+Os sinais guardam os valores da avaliação no post_init; campos adiados
+(``only``/``defer``) são completados do banco no pre_save/pre_delete, para
+que a contribuição antiga seja sempre a que está no resumo.
+"""
+import copy
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+
+
+def review_state(owner_id, rating, attributes=None):
+    """Contribuição de uma avaliação para o resumo do dono (serviço, produto...)"""
+    if owner_id is None or rating is None:
+        return None
+    return owner_id, rating, attributes or {}
+
+
+def review_values(instance, fields):
+    """Valores de ``fields`` carregados na instância; lido de __dict__, campos adiados ficam de fora"""
+    return {name: copy.deepcopy(instance.__dict__[name]) for name in fields if name in instance.__dict__}
+
+
+def complete_review_values(instance, values, fields):
+    """
+    Completa ``values`` com os campos que faltavam no post_init, numa consulta.
+
+    Os que continuam adiados também são postos na instância (o post_delete
+    ainda os lê depois que a linha sumiu); os já atribuídos não são tocados.
+    """
+    missing = [name for name in fields if name not in values]
+    if not missing or instance._state.adding:
+        return values
+    row = type(instance)._base_manager.filter(pk=instance.pk).values(*missing).first() or {}
+    for name, value in row.items():
+        instance.__dict__.setdefault(name, copy.deepcopy(value))
+    return {**values, **row}
+
+
+def apply_review_change(summary_model, owner_field, old=None, new=None):
+    """
+    Troca a contribuição ``old`` por ``new`` nos resumos, travando as linhas afetadas.
+
+    ``old`` e ``new`` vêm de ``review_state`` (ou ``None`` na criação/remoção).
+    """
+    if old == new:
+        return
+    owner_key = f'{owner_field}_id'
+    owners = sorted({state[0] for state in (old, new) if state}, key=str)
+    if not owners:
+        return
+    with transaction.atomic():
+        summary_model.objects.bulk_create(
+            [summary_model(**{owner_key: owner_id}) for owner_id in owners],
+            ignore_conflicts=True,
+        )
+        summaries = {
+            getattr(summary, owner_key): summary
+            for summary in summary_model.objects.select_for_update().filter(**{f'{owner_key}__in': owners})
+        }
+        if old:
+            summaries[old[0]].apply(old[1], old[2], sign=-1)
+        if new:
+            summaries[new[0]].apply(new[1], new[2], sign=1)
+        for summary in summaries.values():
+            summary.save()
+
+
+def rebuild_summaries(summary_model, owner_field, reviews, owner_path, attributes_path=None, chunk_size=2000):
+    """
+    Reconstrói todos os resumos a partir de ``reviews``.
+
+    Contagem, soma e histograma saem de uma única consulta agrupada por dono;
+    as médias por atributo (JSON) são acumuladas num percurso em lotes.
+    """
+    histogram = {f'rating_{star}': Count('pk', filter=Q(rating=star)) for star in range(1, 6)}
+    rows = (
+        reviews.order_by()
+        .values(owner_path)
+        .annotate(rating_count=Count('pk'), rating_sum=Sum('rating'), **histogram)
+    )
+    summaries = {}
+    for row in rows:
+        owner_id = row.pop(owner_path)
+        if owner_id is None:
+            continue
+        summary = summary_model(**{f'{owner_field}_id': owner_id}, **row)
+        summary.average_rating = summary.rating_sum / summary.rating_count if summary.rating_count else 0
+        summaries[owner_id] = summary
+
+    if attributes_path:
+        for owner_id, attributes in reviews.values_list(owner_path, attributes_path).iterator(chunk_size=chunk_size):
+            summary = summaries.get(owner_id)
+            if summary is None or not isinstance(attributes, dict):
+                continue
+            for name, value in attributes.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    totals = summary.attribute_totals.setdefault(name, {'sum': 0, 'count': 0})
+                    totals['sum'] += value
+                    totals['count'] += 1
+
+    with transaction.atomic():
+        summary_model.objects.all().delete()
+        summary_model.objects.bulk_create(summaries.values(), batch_size=1000)
+    return len(summaries)
@@ -0,0 +1,67 @@
+import logging
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+
+from . import audit, notifications, push
+from .models import BaseModel, Notification
+
+
+logger = logging.getLogger(__name__)
+
+
+# A auditoria nunca pode impedir o save/delete: falhas só vão para o log
+def take_audit_snapshot(sender, instance, **kwargs):
+    try:
+        audit.take_snapshot(instance)
+    except Exception:
+        logger.exception("Audit snapshot of %s failed", sender._meta.label_lower)
+
+
+def audit_pre_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    try:
+        audit.snapshot_json(instance, update_fields)
+    except Exception:
+        logger.exception("Audit snapshot of %s failed", sender._meta.label_lower)
+
+
+def audit_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    try:
+        audit.record_save(instance, created)
+    except Exception:
+        logger.exception("Audit of %s %s failed", sender._meta.label_lower, instance.pk)
+
+
+def audit_delete(sender, instance, **kwargs):
+    try:
+        audit.record_delete(instance)
+    except Exception:
+        logger.exception("Audit of %s %s failed", sender._meta.label_lower, instance.pk)
+
+
+# Ligados modelo a modelo para que os modelos fora de BaseModel não paguem nada
+for model in apps.get_models():
+    if issubclass(model, BaseModel) and audit.is_audited(model):
+        post_init.connect(take_audit_snapshot, sender=model, dispatch_uid=f'audit-snapshot-{model._meta.label_lower}')
+        pre_save.connect(audit_pre_save, sender=model, dispatch_uid=f'audit-pre-save-{model._meta.label_lower}')
+        post_save.connect(audit_save, sender=model, dispatch_uid=f'audit-save-{model._meta.label_lower}')
+        post_delete.connect(audit_delete, sender=model, dispatch_uid=f'audit-delete-{model._meta.label_lower}')
+
+
+@receiver(post_save, sender=Notification)
+@receiver(post_delete, sender=Notification)
+def invalidate_unread_count(sender, instance, **kwargs):
+    user_id = instance.recipient_id
+    transaction.on_commit(lambda: notifications.invalidate_unread([user_id]))
+
+
+@receiver(post_save, sender=Notification)
+def push_notification(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        transaction.on_commit(lambda: push.publish_notifications([instance]))
@@ -1,3 +1,322 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import tempfile
+import threading
+import uuid
+from datetime import datetime
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core import mail
+from django.core.cache import cache
+from django.db import connection
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from analytics.models import DataExport
+from commerce.models import ProductRatingSummary
+from companies.models import Company, CompanyUser
+from . import audit, audit_partitions, notifications, pubsub, push, ratings
+from .models import AuditLog, Language, Notification
+
+
+def create_company(suffix=''):
+    owner = get_user_model().objects.create_user(email=f'owner{suffix}@example.com', password='secret')
+    language, _ = Language.objects.get_or_create(
+        code='fr', defaults={'name': 'French', 'native_name': 'Français', 'date_format': 'd/m/Y'}
+    )
+    return Company.objects.create(
+        owner=owner, business_name='Batmart', trading_name='Batmart', tax_id=f'FR{suffix}',
+        registration_number='1', legal_form='SAS', primary_language=language,
+        company_settings={'currency': 'EUR', 'tags': ['b2b']},
+    )
+
+
+class RatingSummaryTests(SimpleTestCase):
+    def test_apply_and_remove_are_symmetric(self):
+        summary = ProductRatingSummary()
+        summary.apply(4, {'pontualidade': 3, 'nota': 'boa', 'verificada': True})
+        summary.apply(2, {'pontualidade': 5})
+        summary.apply(7)
+        self.assertEqual((summary.rating_count, summary.rating_sum, summary.average_rating), (2, 6, 3.0))
+        self.assertEqual(summary.attribute_averages, {'pontualidade': 4.0})
+        summary.apply(4, {'pontualidade': 3, 'nota': 'boa', 'verificada': True}, sign=-1)
+        summary.apply(2, {'pontualidade': 5}, sign=-1)
+        self.assertEqual((summary.rating_count, summary.rating_sum, summary.average_rating), (0, 0, 0))
+        self.assertEqual((summary.histogram, summary.attribute_totals), ({star: 0 for star in range(1, 6)}, {}))
+
+    def test_review_state_ignores_orphan_or_unrated_reviews(self):
+        self.assertIsNone(ratings.review_state(None, 5))
+        self.assertIsNone(ratings.review_state(1, None))
+        self.assertEqual(ratings.review_state(1, 5), (1, 5, {}))
+
+
+@override_settings(AUDIT_ASYNC=False)
+class AuditTests(TestCase):
+    def setUp(self):
+        self.company = create_company('1')
+
+    def test_in_place_json_change_is_recorded(self):
+        company = Company.objects.get(pk=self.company.pk)
+        company.company_settings['tags'].append('export')
+        with self.captureOnCommitCallbacks(execute=True):
+            company.save()
+        entry = AuditLog.objects.get(entity_id=company.pk, action='update')
+        self.assertEqual(entry.changes, {'company_settings': [
+            {'currency': 'EUR', 'tags': ['b2b']}, {'currency': 'EUR', 'tags': ['b2b', 'export']},
+        ]})
+
+    def test_unchanged_json_is_not_recorded(self):
+        company = Company.objects.get(pk=self.company.pk)
+        company.company_settings = {'tags': ['b2b'], 'currency': 'EUR'}
+        audit.snapshot_json(company)
+        self.assertEqual(audit.diff(company), {})
+
+    def test_load_does_not_copy_json(self):
+        company = Company.objects.get(pk=self.company.pk)
+        snapshot = getattr(company, audit.SNAPSHOT_ATTR)
+        self.assertNotIn('company_settings', snapshot)
+        self.assertEqual(snapshot['trading_name'], 'Batmart')
+        # Com update_fields sem JSON nada é lido antes do save: só o UPDATE e a entrada
+        company.trading_name = 'Batmart Pro'
+        with self.assertNumQueries(2), self.captureOnCommitCallbacks(execute=True):
+            company.save(update_fields=['trading_name'])
+
+    def test_file_fields_do_not_break_save(self):
+        export = DataExport(
+            company=self.company, name='Ventes', description='', data_type='orders', format='csv',
+            file='exports/ventes.csv',
+        )
+        self.assertEqual(export.file.name, 'exports/ventes.csv')
+        with self.captureOnCommitCallbacks(execute=True):
+            export.save()
+        export = DataExport.objects.get(pk=export.pk)
+        export.file.name = 'exports/ventes-2.csv'
+        with self.captureOnCommitCallbacks(execute=True):
+            export.save()
+        entry = AuditLog.objects.get(entity_id=export.pk, action='update')
+        self.assertEqual(entry.changes, {'file': ['exports/ventes.csv', 'exports/ventes-2.csv']})
+        self.assertEqual(
+            AuditLog.objects.get(entity_id=export.pk, action='create').changes['file'], [None, 'exports/ventes.csv'],
+        )
+
+    def test_unserializable_values_are_stored_as_text(self):
+        self.assertEqual(audit._jsonable(object), str(object))
+
+    def test_entries_are_written_on_commit_when_synchronous(self):
+        self.assertTrue(audit.is_synchronous())
+        with self.captureOnCommitCallbacks(execute=True):
+            Company.objects.filter(pk=self.company.pk).get().delete()
+        self.assertTrue(AuditLog.objects.filter(entity_id=self.company.pk, action='delete').exists())
+        self.assertEqual(audit.buffer.pending(), 0)
+
+
+@skipUnless(connection.vendor == 'sqlite', "Tabelas mensais por rotação só existem no SQLite")
+@override_settings(AUDIT_ASYNC=False)
+class AuditPartitionTests(TransactionTestCase):
+    def setUp(self):
+        self.now = timezone.make_aware(datetime(2026, 10, 15, 12))
+        self.entity_id = uuid.uuid4()
+
+    def tearDown(self):
+        backend = audit_partitions.get_backend()
+        for _month, table in audit_partitions.partitions():
+            backend.drop_partition(table)
+
+    def create_entry(self, month, day=10):
+        entry = AuditLog.objects.create(
+            action='update', entity_type='core.company', entity_id=self.entity_id, changes={'month': month},
+        )
+        AuditLog.objects.filter(pk=entry.pk).update(created_at=timezone.make_aware(datetime(2026, month, day, 12)))
+        return entry
+
+    def table_rows(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+            return cursor.fetchone()[0]
+
+    def test_skipped_months_get_their_own_tables(self):
+        for month in (8, 8, 9, 10):
+            self.create_entry(month)
+        rotated = audit_partitions.SQLitePartitions().prepare(self.now)
+        self.assertEqual(rotated, ['core_auditlog_p202608', 'core_auditlog_p202609'])
+        self.assertEqual({table: self.table_rows(table) for table in rotated}, dict(zip(rotated, (2, 1))))
+        self.assertEqual(list(AuditLog.objects.values_list('changes', flat=True)), [{'month': 10}])
+
+        # Linhas atrasadas entram na tabela do mês já rotacionado
+        self.create_entry(8, day=20)
+        self.assertEqual(audit_partitions.SQLitePartitions().prepare(self.now), ['core_auditlog_p202608'])
+        self.assertEqual(self.table_rows('core_auditlog_p202608'), 3)
+        self.assertEqual(AuditLog.objects.count(), 1)
+
+    def test_lookup_reads_monthly_tables_newest_first(self):
+        for month, day in ((8, 5), (9, 5), (9, 20), (10, 5)):
+            self.create_entry(month, day)
+        audit_partitions.SQLitePartitions().prepare(self.now)
+        entries = audit_partitions.lookup(entity_id=self.entity_id, limit=3)
+        self.assertEqual([entry.created_at.date().isoformat() for entry in entries], [
+            '2026-10-05', '2026-09-20', '2026-09-05',
+        ])
+        since = timezone.make_aware(datetime(2026, 9, 10))
+        self.assertEqual(len(audit_partitions.lookup(entity_id=self.entity_id, since=since)), 2)
+        self.assertEqual(audit_partitions.lookup(entity_id=uuid.uuid4()), [])
+
+    def test_retention_archives_and_drops_old_months(self):
+        for month in (7, 8, 8, 9, 10):
+            self.create_entry(month)
+        with tempfile.TemporaryDirectory() as directory:
+            dropped = audit_partitions.maintain(self.now, months=1, directory=directory)
+            self.assertEqual(dropped, [('core_auditlog_p202608', 2), ('core_auditlog_p202607', 1)])
+            with gzip.open(f'{directory}/core_auditlog_p202608.jsonl.gz', 'rt') as archive:
+                records = [json.loads(line) for line in archive]
+        self.assertEqual([record['changes'] for record in records], [{'month': 8}, {'month': 8}])
+        self.assertEqual([table for _month, table in audit_partitions.partitions()], ['core_auditlog_p202609'])
+
+
+class PushStreamTests(SimpleTestCase):
+    async def test_stream_sends_published_events_and_keepalives(self):
+        events = push.stream([push.user_channel('u1')])
+        try:
+            self.assertEqual(await anext(events), ': connected\n\n')
+            pubsub.publish(push.user_channel('u2'), 'notification', {'id': 'other'})
+            pubsub.publish(push.user_channel('u1'), 'notification', {'id': 'n1'})
+            self.assertEqual(await anext(events), 'event: notification\ndata: {"id": "n1"}\n\n')
+            with mock.patch.object(push, 'KEEPALIVE_SECONDS', 0.01):
+                self.assertEqual(await anext(events), ': keepalive\n\n')
+        finally:
+            await events.aclose()
+        self.assertFalse(pubsub.get_backend()._subscribers)
+
+    def test_slow_subscriber_keeps_latest_messages(self):
+        messages = asyncio.Queue(maxsize=2)
+        for number in range(3):
+            pubsub.InProcessBackend._offer(messages, number)
+        self.assertEqual([messages.get_nowait(), messages.get_nowait()], [1, 2])
+
+
+class EventStreamTests(TestCase):
+    def setUp(self):
+        self.company = create_company('2')
+        self.member = get_user_model().objects.create_user(email='member@example.com', password='secret')
+        CompanyUser.objects.create(
+            company=self.company, user=self.member, job_title='Vendeur', department='Ventes', status='active',
+            access_level='staff',
+        )
+        self.outsider = get_user_model().objects.create_user(email='outsider@example.com', password='secret')
+
+    async def get(self, user, **params):
+        request = AsyncRequestFactory().get('/events/', params)
+
+        async def auser():
+            return user
+        request.auser = auser
+        return await push.event_stream(request)
+
+    async def test_company_channel_requires_active_membership(self):
+        self.assertEqual((await self.get(AnonymousUser())).status_code, 403)
+        self.assertEqual((await self.get(self.member, company='not-a-uuid')).status_code, 403)
+        self.assertEqual((await self.get(self.outsider, company=str(self.company.pk))).status_code, 403)
+
+    async def test_member_receives_company_events(self):
+        response = await self.get(self.member, company=str(self.company.pk))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        content = response.streaming_content
+        try:
+            self.assertEqual(await anext(content), b': connected\n\n')
+            pubsub.publish(push.company_channel(self.company.pk), 'metric', {'value': 3})
+            self.assertEqual(await anext(content), b'event: metric\ndata: {"value": 3}\n\n')
+        finally:
+            await content.aclose()
+
+
+class NotificationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.company = create_company('3')
+        self.users = {}
+        preferences = {
+            'plain': ({}, {}),
+            # A preferência da empresa vale mais que a do usuário
+            'override': ({'channels': {'email': False}}, {'types': {'stock.low': {'email': True}}}),
+            'muted': ({}, {'types': {'stock.low': False}}),
+            'email_only': ({'types': {'stock.low': {'in_app': False}}}, {}),
+        }
+        for name, (user_settings, membership) in preferences.items():
+            user = self.users[name] = get_user_model().objects.create_user(
+                email=f'{name}@example.com', password='secret', notification_settings=user_settings,
+            )
+            CompanyUser.objects.create(
+                company=self.company, user=user, job_title='Vendeur', department='Ventes', status='active',
+                access_level='staff', notification_preferences=membership,
+            )
+
+    def test_preferences_choose_the_channels(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            notifications.notify_company(self.company, 'stock.low', 'Stock', 'Rupture', channels=('in_app', 'email'))
+        notifications.workers.join()
+        self.assertEqual(
+            set(Notification.objects.values_list('recipient__email', flat=True)),
+            {'plain@example.com', 'override@example.com'},
+        )
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox),
+            ['email_only@example.com', 'override@example.com', 'plain@example.com'],
+        )
+
+    def test_deliver_many_inserts_in_one_query(self):
+        recipients = list(notifications.company_recipients(self.company))
+        with self.assertNumQueries(1):
+            created = notifications.deliver_many([
+                (recipients, 'stock.low', 'Stock', 'Rupture', None, ('in_app',)),
+                (recipients, 'order.new', 'Commande', 'Nouvelle commande', {'order': 'A1'}, ('in_app',)),
+            ])
+        self.assertEqual(len(created), 6)
+        self.assertEqual(Notification.objects.filter(type='order.new').count(), 4)
+
+    def test_mark_read_and_unread_count(self):
+        user = self.users['plain']
+        created = notifications.notify_users([user], 'stock.low', 'Stock', 'Rupture')
+        notifications.notify_users([user], 'order.new', 'Commande', 'Nouvelle commande')
+        self.assertEqual(notifications.unread_count(user), 2)
+        self.assertEqual(notifications.mark_read(user, [created[0].pk]), 1)
+        self.assertEqual(notifications.unread_count(user.pk), 1)
+        self.assertEqual(notifications.mark_read(user), 1)
+        self.assertEqual(notifications.mark_read(user), 0)
+        # Cache por processo (LocMem): a contagem vem do banco, mesmo após escrita de outro processo
+        Notification.objects.update(read=False)
+        self.assertEqual(notifications.unread_count(user), 2)
+
+    def test_unread_count_is_cached_with_a_shared_cache(self):
+        user = self.users['plain']
+        notifications.notify_users([user], 'stock.low', 'Stock', 'Rupture')
+        with mock.patch.object(notifications, 'shared_cache', return_value=True):
+            self.assertEqual(notifications.unread_count(user), 1)
+            Notification.objects.update(read=True)
+            with self.assertNumQueries(0):
+                self.assertEqual(notifications.unread_count(user), 1)
+            Notification.objects.update(read=False)
+            with self.captureOnCommitCallbacks(execute=True):
+                notifications.mark_read(user)
+            self.assertEqual(notifications.unread_count(user), 0)
+
+
+class ChannelWorkersTests(SimpleTestCase):
+    def test_stop_drains_pending_deliveries(self):
+        delivered = []
+        with mock.patch.dict(notifications._channel_handlers, {'test': delivered.extend}):
+            workers = notifications.ChannelWorkers(workers=1)
+            workers.put_many({'test': [{}] * 450})
+            self.assertEqual(workers.stop(timeout=10), 0)
+        self.assertEqual(len(delivered), 450)
+
+    def test_stop_reports_deliveries_left_behind(self):
+        release = threading.Event()
+        with mock.patch.dict(notifications._channel_handlers, {'test': lambda items: release.wait(5)}):
+            workers = notifications.ChannelWorkers(workers=1)
+            workers.put_many({'test': [{}] * 450})
+            try:
+                self.assertEqual(workers.stop(timeout=0.5), 450 - notifications.CHANNEL_BATCH_SIZE)
+            finally:
+                release.set()
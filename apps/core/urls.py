@@ -0,0 +1,9 @@
+from django.urls import path
+
+from . import push
+
+app_name = 'core'
+
+urlpatterns = [
+    path('', push.event_stream, name='event-stream'),
+]
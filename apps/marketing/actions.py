@@ -0,0 +1,119 @@
+"""
+Ações embutidas das automações de marketing (``MarketingAutomation.actions``).
+
+Cada executor recebe o lote inteiro de uma vez (ver ``automation.execute_jobs``)::
+
+    {"type": "send_email", "subject": "Bienvenue $first_name", "body": "..."}
+    {"type": "notify", "title": "Nouveau lead", "message": "$email",
+     "access_levels": ["admin", "manager"], "channels": ["in_app", "email"]}
+
+``send_email`` escreve ao cliente do evento (uma consulta de clientes e uma
+conexão SMTP por lote; quem recusou e-mail em ``marketing_preferences`` fica
+de fora). ``notify`` avisa a equipe da empresa com um único ``deliver_many``.
+Os textos aceitam ``$first_name``, ``$last_name``, ``$email`` e os campos
+simples de ``event['data']``.
+"""
+import logging
+import uuid
+from string import Template
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+
+from commerce.models import Customer
+from core import notifications
+from .automation import register_action
+
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATION_TYPE = 'marketing.automation'
+DEFAULT_ACCESS_LEVELS = ('admin', 'manager')
+
+
+def _context(item, customer=None):
+    data = item['event'].get('data') or {}
+    context = {key: str(value) for key, value in data.items() if isinstance(value, (str, int, float))}
+    if customer is not None:
+        context.update(first_name=customer.first_name, last_name=customer.last_name, email=customer.email)
+    return context
+
+
+def render(text, context):
+    return Template(str(text or '')).safe_substitute(context)
+
+
+def _customer_ids(items):
+    ids = set()
+    for item in items:
+        try:
+            ids.add(uuid.UUID(str(item.get('customer_id'))))
+        except ValueError:
+            continue
+    return ids
+
+
+def _accepts_email(customer):
+    preferences = customer.marketing_preferences if isinstance(customer.marketing_preferences, dict) else {}
+    return preferences.get('email', True) is not False
+
+
+@register_action('send_email')
+def send_email(items):
+    """E-mail ao cliente de cada evento; clientes de outra empresa ou sem e-mail são ignorados"""
+    customer_ids = _customer_ids(items)
+    customers = {
+        str(customer.pk): customer
+        for customer in Customer.objects.filter(pk__in=customer_ids).exclude(email='')
+    } if customer_ids else {}
+    messages = []
+    for item in items:
+        customer = customers.get(str(item.get('customer_id')))
+        if customer is None or not _accepts_email(customer):
+            continue
+        if str(customer.company_id) != str(item['event'].get('company_id')):
+            continue
+        context = _context(item, customer)
+        messages.append(EmailMessage(
+            subject=render(item['action'].get('subject'), context),
+            body=render(item['action'].get('body'), context),
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[customer.email],
+        ))
+    if not messages:
+        return
+    connection = get_connection()
+    try:
+        connection.open()
+        for message in messages:
+            message.connection = connection
+            try:
+                message.send()
+            except Exception:
+                logger.exception("Automation email to %s failed", message.to[0])
+    finally:
+        connection.close()
+
+
+@register_action('notify')
+def notify(items):
+    """Notificação à equipe da empresa do evento; destinatários lidos uma vez por (empresa, níveis)"""
+    recipients, messages = {}, []
+    for item in items:
+        action = item['action']
+        company_id = item['event'].get('company_id')
+        access_levels = action.get('access_levels')
+        access_levels = tuple(access_levels) if isinstance(access_levels, list) and access_levels else DEFAULT_ACCESS_LEVELS
+        if (company_id, access_levels) not in recipients:
+            recipients[company_id, access_levels] = list(notifications.company_recipients(company_id, access_levels))
+        context = _context(item)
+        channels = [channel for channel in action.get('channels') or [] if isinstance(channel, str)]
+        messages.append((
+            recipients[company_id, access_levels],
+            NOTIFICATION_TYPE,
+            render(action.get('title'), context),
+            render(action.get('message'), context),
+            {'automation': str(item['automation_id']), 'customer': str(item.get('customer_id') or '')},
+            channels or notifications.DEFAULT_CHANNELS,
+        ))
+    notifications.deliver_many(messages)
@@ -0,0 +1,163 @@
+"""
+Atribuição de campanhas: leads, conversões, receita e ROI por campanha e dia.
+
+Leads, conversões e receita vêm de uma única consulta agrupada sobre
+LeadManagement; a receita de cada lead é uma subconsulta correlata sobre
+``Order``. Cada pedido conta uma vez só, para o lead mais recente do cliente
+criado até o pedido e dentro da janela de atribuição (último toque). O
+resultado é gravado em CampaignDailyStats, que é o que as listagens de
+campanha leem; os dias do intervalo são recalculados inteiros e substituem
+as linhas anteriores.
+
+O gasto real (``actual_spend``) é dividido pelos dias já decorridos: numa
+campanha em curso, só até hoje. Como ele muda a cada dia, o gasto dos dias
+anteriores ao intervalo também é reajustado.
+"""
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import (
+    Count, DateTimeField, DecimalField, Exists, ExpressionWrapper, F, FloatField, OuterRef, Q, Subquery, Sum, Value,
+)
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from commerce.models import Order
+from .models import CampaignDailyStats, LeadManagement, MarketingCampaign
+
+
+ATTRIBUTION_WINDOW = timedelta(days=30)
+# Pedidos nestes status não geram receita atribuída
+EXCLUDED_ORDER_STATUSES = ('draft', 'cancelled')
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+
+
+def _lead_revenue(window):
+    """
+    Receita dos pedidos atribuídos ao lead, como subconsulta correlata.
+
+    Um pedido é do lead se foi feito pelo mesmo cliente até ``window`` depois
+    dele e não há lead de campanha mais recente do cliente até o pedido
+    (último toque; empate pelo pk), então cada pedido conta uma vez só.
+    """
+    newer_lead = LeadManagement.objects.filter(
+        customer=OuterRef('customer'),
+        campaign__isnull=False,
+        created_at__lte=OuterRef('created_at'),
+    ).filter(
+        Q(created_at__gt=OuterRef(OuterRef('created_at')))
+        | Q(created_at=OuterRef(OuterRef('created_at')), pk__gt=OuterRef(OuterRef('pk')))
+    )
+    orders = (
+        Order.objects
+        .filter(
+            customer=OuterRef('customer'),
+            created_at__gte=OuterRef('created_at'),
+            created_at__lt=ExpressionWrapper(OuterRef('created_at') + Value(window), output_field=DateTimeField()),
+        )
+        .exclude(status__in=EXCLUDED_ORDER_STATUSES)
+        .filter(~Exists(newer_lead))
+        .order_by()
+        .values('customer')
+        .annotate(revenue=Sum('total'))
+        .values('revenue')
+    )
+    return Coalesce(Subquery(orders, output_field=MONEY), Value(Decimal('0')), output_field=MONEY)
+
+
+def attribution_rows(since, until, company=None, window=ATTRIBUTION_WINDOW):
+    """Linhas (campanha, dia) com leads, conversões e receita atribuída numa única consulta agrupada"""
+    leads = LeadManagement.objects.filter(
+        campaign__isnull=False,
+        created_at__gte=since,
+        created_at__lt=until,
+    )
+    if company is not None:
+        leads = leads.filter(company=company)
+    converted = Q(customer__isnull=False) | Q(status='converted')
+    return list(
+        leads.order_by()
+        .annotate(day=TruncDate('created_at'), order_revenue=_lead_revenue(window))
+        .values('campaign_id', 'company_id', 'day')
+        .annotate(leads=Count('pk'), conversions=Count('pk', filter=converted), revenue=Sum('order_revenue'))
+    )
+
+
+def daily_spend(campaign, today=None):
+    """Gasto real distribuído igualmente pelos dias já decorridos da campanha (até hoje, se ainda em curso)"""
+    today = today or timezone.localdate()
+    start_day = timezone.localdate(campaign.start_date)
+    end_day = min(timezone.localdate(campaign.end_date), today)
+    return (campaign.actual_spend or Decimal('0')) / max((end_day - start_day).days + 1, 1)
+
+
+def refresh_campaign_stats(days=None, since=None, until=None, company=None, window=ATTRIBUTION_WINDOW):
+    """
+    Recalcula e materializa CampaignDailyStats para o intervalo.
+
+    Por padrão recalcula os dias ainda abertos à atribuição (a janela), o que
+    mantém a execução incremental. O intervalo começa no início do primeiro
+    dia e as linhas já gravadas para os dias dele são trocadas pelas novas,
+    de modo que dias que ficaram sem dados deixam de aparecer. Retorna o
+    número de linhas gravadas.
+    """
+    until = until or timezone.now()
+    since = since or until - (timedelta(days=days) if days else window)
+    since = timezone.make_aware(datetime.combine(timezone.localdate(since), time.min))
+    rows = {
+        (row['campaign_id'], row['day']): row
+        for row in attribution_rows(since, until, company=company, window=window)
+    }
+    # Campanhas em veiculação no intervalo também recebem os dias sem leads, para o gasto ficar completo
+    campaigns = MarketingCampaign.objects.filter(
+        Q(pk__in={campaign_id for campaign_id, _day in rows}) | Q(start_date__lt=until, end_date__gte=since)
+    )
+    if company is not None:
+        campaigns = campaigns.filter(company=company)
+    first_day, last_day = timezone.localdate(since), timezone.localdate(until)
+    today = timezone.localdate()
+    stats, earlier = [], []
+    for campaign in campaigns.only('pk', 'company_id', 'start_date', 'end_date', 'actual_spend'):
+        start_day = timezone.localdate(campaign.start_date)
+        end_day = timezone.localdate(campaign.end_date)
+        spend = daily_spend(campaign, today)
+        if start_day < first_day:
+            earlier.append((campaign.pk, start_day, min(end_day, today), spend.quantize(Decimal('0.01'))))
+        days = {day for campaign_id, day in rows if campaign_id == campaign.pk}
+        day = max(start_day, first_day)
+        while day <= min(end_day, last_day):
+            days.add(day)
+            day += timedelta(days=1)
+        for day in sorted(days):
+            row = rows.get((campaign.pk, day), {})
+            day_spend = spend if start_day <= day <= min(end_day, today) else Decimal('0')
+            revenue = row.get('revenue') or Decimal('0')
+            stats.append(CampaignDailyStats(
+                campaign_id=campaign.pk,
+                company_id=campaign.company_id,
+                day=day,
+                leads=row.get('leads', 0),
+                conversions=row.get('conversions', 0),
+                revenue=revenue,
+                spend=day_spend.quantize(Decimal('0.01')),
+                roi=float((revenue - day_spend) / day_spend) if day_spend else None,
+            ))
+    stale = CampaignDailyStats.objects.filter(day__gte=first_day, day__lte=last_day)
+    if company is not None:
+        stale = stale.filter(company=company)
+    with transaction.atomic():
+        stale.delete()
+        CampaignDailyStats.objects.bulk_create(
+            stats,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['campaign', 'day'],
+            update_fields=['leads', 'conversions', 'revenue', 'spend', 'roi', 'computed_at'],
+        )
+        for campaign_id, start_day, spend_day, spend in earlier:
+            roi = ExpressionWrapper((F('revenue') - spend) / spend, output_field=FloatField()) if spend else None
+            CampaignDailyStats.objects.filter(
+                campaign_id=campaign_id, day__gte=start_day, day__lte=spend_day, day__lt=first_day,
+            ).update(spend=spend, roi=roi)
+    return len(stats)
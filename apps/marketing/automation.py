@@ -0,0 +1,305 @@
+"""
+Runtime das automações de marketing (MarketingAutomation).
+
+As automações ativas baseadas em evento ou comportamento ficam num índice em
+memória por (empresa, ``trigger_conditions['event_name']``), então cada evento
+só é comparado com as regras que podem dispará-lo. As ações vão para uma fila
+de workers em lotes e os contadores (``total_executions``, ``last_execution``,
+``affected_customers``) são gravados com escritas em lote por lote de eventos.
+
+Os eventos vêm dos sinais de modelo (``marketing.signals``), entregues por
+``emit`` depois do commit: ``customer_created``, ``order_placed``,
+``lead_created``, ``lead_status_changed`` e ``lead_interaction``.
+
+Automações por agenda (``trigger_type='schedule'``) não passam por aqui. As
+ações embutidas (``send_email``, ``notify``) ficam em ``marketing.actions``.
+Na saída do processo a fila de workers é esvaziada (até ``DRAIN_TIMEOUT``).
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .models import MarketingAutomation
+
+
+logger = logging.getLogger(__name__)
+
+EVENT_TRIGGER_TYPES = ('event', 'behavior')
+INDEX_VERSION_KEY = 'marketing-automation-index-version'
+# Intervalo mínimo entre consultas à versão do índice no cache
+INDEX_CHECK_INTERVAL = 5
+ACTION_BATCH_SIZE = 500
+# Espera máxima, na saída do processo, para os workers esvaziarem a fila
+DRAIN_TIMEOUT = 30
+
+OPERATORS = {
+    'eq': lambda actual, expected: actual == expected,
+    'ne': lambda actual, expected: actual != expected,
+    'gt': lambda actual, expected: actual is not None and actual > expected,
+    'gte': lambda actual, expected: actual is not None and actual >= expected,
+    'lt': lambda actual, expected: actual is not None and actual < expected,
+    'lte': lambda actual, expected: actual is not None and actual <= expected,
+    'in': lambda actual, expected: actual in expected,
+    'contains': lambda actual, expected: actual is not None and expected in actual,
+}
+
+_action_handlers = {}
+
+
+def register_action(action_type):
+    """Decorador que registra o executor de um tipo de ação (``actions[i]['type']``)"""
+    def decorator(handler):
+        _action_handlers[action_type] = handler
+        return handler
+    return decorator
+
+
+def invalidate_index():
+    """Sinaliza a todos os processos que o índice de automações mudou"""
+    try:
+        cache.incr(INDEX_VERSION_KEY)
+    except ValueError:
+        cache.set(INDEX_VERSION_KEY, 1, None)
+
+
+def _lookup(data, path):
+    for part in str(path).split('.'):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(part)
+    return data
+
+
+class CompiledAutomation:
+    """Automação com as condições já preparadas para avaliação em memória"""
+
+    def __init__(self, automation_id, actions, conditions):
+        self.id = automation_id
+        self.actions = actions if isinstance(actions, list) else []
+        filters = conditions.get('filters') or {}
+        self.filters = [
+            (path, spec.get('op', 'eq'), spec.get('value')) if isinstance(spec, dict) else (path, 'eq', spec)
+            for path, spec in filters.items()
+        ]
+
+    def matches(self, event):
+        data = event.get('data') or {}
+        for path, op, expected in self.filters:
+            try:
+                if not OPERATORS.get(op, OPERATORS['eq'])(_lookup(data, path), expected):
+                    return False
+            except TypeError:
+                return False
+        return True
+
+
+class AutomationIndex:
+    """Índice em memória das automações ativas por (empresa, evento)"""
+
+    def __init__(self):
+        self._rules = {}
+        self._version = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def load(self):
+        rules = defaultdict(list)
+        rows = (
+            MarketingAutomation.objects
+            .filter(is_active=True, trigger_type__in=EVENT_TRIGGER_TYPES)
+            .values_list('pk', 'company_id', 'trigger_conditions', 'actions')
+        )
+        for pk, company_id, conditions, actions in rows:
+            conditions = conditions if isinstance(conditions, dict) else {}
+            event_name = conditions.get('event_name')
+            if event_name:
+                rules[company_id, event_name].append(CompiledAutomation(pk, actions, conditions))
+        self._rules = dict(rules)
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and self._version is not None and now - self._checked_at < INDEX_CHECK_INTERVAL:
+            return
+        with self._lock:
+            version = cache.get(INDEX_VERSION_KEY, 0)
+            if force or version != self._version:
+                self.load()
+                self._version = version
+            self._checked_at = now
+
+    def candidates(self, company_id, event_name):
+        return self._rules.get((company_id, event_name), ())
+
+
+class WorkerQueue:
+    """Fila em processo com threads que executam as ações em lotes"""
+
+    def __init__(self, workers=2, maxsize=10000):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._stopping = threading.Event()
+        self._workers = [
+            threading.Thread(target=self._run, name=f'marketing-automation-{index}', daemon=True)
+            for index in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def put_many(self, jobs):
+        for offset in range(0, len(jobs), ACTION_BATCH_SIZE):
+            self._queue.put(jobs[offset:offset + ACTION_BATCH_SIZE])
+
+    def join(self):
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            try:
+                batch = self._queue.get(timeout=1)
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return
+                continue
+            try:
+                close_old_connections()
+                execute_jobs(batch)
+            except Exception:
+                logger.exception("Marketing automation batch failed")
+            finally:
+                self._queue.task_done()
+
+    def stop(self, timeout=DRAIN_TIMEOUT):
+        """Deixa os workers esvaziarem a fila e terminarem; retorna quantos jobs ficaram sem executar"""
+        self._stopping.set()
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            worker.join(max(deadline - time.monotonic(), 0))
+        lost = 0
+        while True:
+            try:
+                lost += len(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if lost:
+            logger.error("Marketing automation stopped with %d jobs not executed", lost)
+        return lost
+
+
+def execute_jobs(jobs):
+    """Agrupa os jobs por tipo de ação e chama cada executor uma vez por lote"""
+    by_type = defaultdict(list)
+    for job in jobs:
+        for action in job['actions']:
+            if isinstance(action, dict):
+                by_type[action.get('type')].append({**job, 'action': action})
+    for action_type, items in by_type.items():
+        handler = _action_handlers.get(action_type)
+        if handler is None:
+            logger.warning("No handler registered for automation action %r", action_type)
+            continue
+        handler(items)
+
+
+def record_executions(executions, now=None):
+    """
+    Grava os contadores de um lote de execuções.
+
+    ``executions`` é uma lista de (automation_id, customer_id). Gera um único
+    UPDATE com CASE para ``total_executions`` e um ``bulk_create`` na tabela
+    de ``affected_customers``.
+    """
+    if not executions:
+        return
+    now = now or timezone.now()
+    counts = Counter(automation_id for automation_id, _customer in executions)
+    MarketingAutomation.objects.filter(pk__in=counts).update(
+        total_executions=F('total_executions') + Case(
+            *(When(pk=pk, then=Value(count)) for pk, count in counts.items()),
+            default=Value(0),
+            output_field=IntegerField(),
+        ),
+        last_execution=now,
+    )
+    through = MarketingAutomation.affected_customers.through
+    pairs = {(automation_id, customer_id) for automation_id, customer_id in executions if customer_id}
+    through.objects.bulk_create(
+        [through(marketingautomation_id=automation_id, customer_id=customer_id) for automation_id, customer_id in pairs],
+        ignore_conflicts=True,
+    )
+
+
+class AutomationRuntime:
+    """
+    Avalia eventos contra o índice e despacha as ações.
+
+    Evento: ``{'company_id': ..., 'event_name': ..., 'customer_id': ..., 'data': {...}}``.
+    """
+
+    def __init__(self, index=None, worker_queue=None):
+        self.index = index or AutomationIndex()
+        self.queue = worker_queue
+
+    def handle_events(self, events):
+        """Processa um lote de eventos; retorna quantas automações foram disparadas"""
+        self.index.refresh()
+        jobs, executions = [], []
+        for event in events:
+            for automation in self.index.candidates(event.get('company_id'), event.get('event_name')):
+                if not automation.matches(event):
+                    continue
+                jobs.append({
+                    'automation_id': automation.id,
+                    'customer_id': event.get('customer_id'),
+                    'event': event,
+                    'actions': automation.actions,
+                })
+                executions.append((automation.id, event.get('customer_id')))
+        if jobs:
+            if self.queue is None:
+                execute_jobs(jobs)
+            else:
+                self.queue.put_many(jobs)
+            record_executions(executions)
+        return len(jobs)
+
+    def handle_event(self, event):
+        return self.handle_events([event])
+
+
+_runtime = None
+_runtime_lock = threading.Lock()
+
+
+def get_runtime():
+    """Runtime compartilhado do processo, com a fila de workers em segundo plano"""
+    global _runtime
+    with _runtime_lock:
+        if _runtime is None:
+            _runtime = AutomationRuntime(worker_queue=WorkerQueue())
+        return _runtime
+
+
+def emit(company_id, event_name, customer_id=None, data=None):
+    """Entrega um evento ao runtime depois do commit; falhas só vão para o log"""
+    event = {'company_id': company_id, 'event_name': event_name, 'customer_id': customer_id, 'data': data or {}}
+
+    def handle():
+        try:
+            get_runtime().handle_event(event)
+        except Exception:
+            logger.exception("Marketing automation event %r failed", event_name)
+
+    transaction.on_commit(handle)
+
+
+@atexit.register
+def _drain_on_exit():
+    if _runtime is not None and _runtime.queue is not None:
+        _runtime.queue.stop()
@@ -0,0 +1,87 @@
+"""
+Chaves de bloqueio normalizadas para deduplicação de leads.
+
+Funções puras, sem acesso ao banco: usadas por ``LeadManagement.save`` e pelo
+motor de deduplicação (``marketing.dedup``).
+"""
+import re
+import unicodedata
+
+
+PHONE_KEY_DIGITS = 9
+
+SOUNDEX_CODES = {
+    **dict.fromkeys('bfpv', '1'),
+    **dict.fromkeys('cgjkqsxz', '2'),
+    **dict.fromkeys('dt', '3'),
+    'l': '4',
+    **dict.fromkeys('mn', '5'),
+    'r': '6',
+}
+
+
+def _ascii(value):
+    return unicodedata.normalize('NFKD', str(value)).encode('ascii', 'ignore').decode().lower()
+
+
+def email_key(value):
+    """E-mail em minúsculas, sem sufixo ``+tag`` na parte local"""
+    if not value or '@' not in str(value):
+        return ''
+    local, _, domain = str(value).strip().lower().rpartition('@')
+    return f"{local.split('+', 1)[0]}@{domain}"[:254]
+
+
+def phone_key(value):
+    """Últimos dígitos do telefone, ignorando formatação e código do país"""
+    digits = re.sub(r'\D', '', str(value or ''))
+    return digits[-PHONE_KEY_DIGITS:] if len(digits) >= 6 else ''
+
+
+def soundex(value):
+    letters = re.sub(r'[^a-z]', '', _ascii(value))
+    if not letters:
+        return ''
+    code = letters[0].upper()
+    previous = SOUNDEX_CODES.get(letters[0], '')
+    for letter in letters[1:]:
+        digit = SOUNDEX_CODES.get(letter, '')
+        if digit and digit != previous:
+            code += digit
+        if letter not in 'hw':
+            previous = digit
+    return (code + '000')[:4]
+
+
+def name_key(first_name, last_name):
+    """Soundex do sobrenome mais a inicial do nome"""
+    last = soundex(last_name)
+    if not last:
+        return ''
+    initial = re.sub(r'[^a-z]', '', _ascii(first_name))[:1]
+    return f'{last}:{initial}'
+
+
+def split_name(contact_info):
+    first = contact_info.get('first_name') or ''
+    last = contact_info.get('last_name') or ''
+    if not (first or last) and contact_info.get('name'):
+        parts = str(contact_info['name']).split()
+        first, last = parts[0], parts[-1] if len(parts) > 1 else ''
+    return first, last
+
+
+def full_name(contact_info):
+    """Nome completo sem acentos, em minúsculas e com espaços normalizados, ou vazio"""
+    first, last = split_name(contact_info if isinstance(contact_info, dict) else {})
+    return ' '.join(_ascii(f'{first} {last}').split())
+
+
+def contact_keys(contact_info):
+    """Chaves (email, telefone, nome) de um ``contact_info`` de lead"""
+    contact_info = contact_info if isinstance(contact_info, dict) else {}
+    return {
+        'email_key': email_key(contact_info.get('email')),
+        'phone_key': phone_key(contact_info.get('phone') or contact_info.get('mobile')),
+        'name_key': name_key(*split_name(contact_info)),
+    }
@@ -0,0 +1,248 @@
+"""
+Deduplicação e fusão de leads.
+
+Pares candidatos só são comparados dentro de um bloco (mesma empresa e mesma
+chave de email, telefone ou nome), lidos em fluxo na ordem do índice
+(company, chave). A memória usada fica limitada a um bloco por vez mais os
+leads que de fato têm duplicatas.
+
+A fusão automática exige, além do score, o mesmo e-mail ou o mesmo nome
+completo: telefone e sobrenome parecidos também descrevem pessoas da mesma
+casa. Esses pares vão para revisão manual em ``metadata['duplicate_candidates']``.
+"""
+from itertools import combinations, groupby, islice
+
+from django.db import transaction
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from commerce.models import Customer
+from .blocking import contact_keys, full_name
+from .models import BLOCKING_KEY_FIELDS, LeadInteraction, LeadManagement
+from .scoring import rescore_leads
+
+
+CHUNK_SIZE = 2000
+# Blocos maiores que isso (ex.: telefone genérico) geram pares demais e são ignorados
+MAX_BLOCK_SIZE = 50
+FIELD_WEIGHTS = {'email_key': 0.5, 'phone_key': 0.3, 'name_key': 0.2}
+AUTO_MERGE_THRESHOLD = 0.5
+
+# Ordem de avanço do status, para manter o mais avançado na fusão
+STATUS_RANK = {'new': 0, 'contacted': 1, 'qualified': 2, 'converted': 3, 'lost': -1}
+
+
+def similarity(a, b):
+    """Soma dos pesos das chaves iguais e não vazias entre duas linhas"""
+    return sum(weight for field, weight in FIELD_WEIGHTS.items() if a[field] and a[field] == b[field])
+
+
+def refresh_blocking_keys(leads=None, chunk_size=CHUNK_SIZE):
+    """Recalcula as chaves de leads gravados antes delas existirem; retorna quantos mudaram"""
+    leads = LeadManagement.objects.all() if leads is None else leads
+    rows = leads.only('pk', 'contact_info', *BLOCKING_KEY_FIELDS).order_by().iterator(chunk_size=chunk_size)
+    changed, batch = 0, []
+    for lead in rows:
+        keys = contact_keys(lead.contact_info)
+        if all(getattr(lead, field) == value for field, value in keys.items()):
+            continue
+        for field, value in keys.items():
+            setattr(lead, field, value)
+        batch.append(lead)
+        if len(batch) >= chunk_size:
+            LeadManagement.objects.bulk_update(batch, BLOCKING_KEY_FIELDS)
+            changed += len(batch)
+            batch = []
+    if batch:
+        LeadManagement.objects.bulk_update(batch, BLOCKING_KEY_FIELDS)
+        changed += len(batch)
+    return changed
+
+
+def candidate_pairs(company_id=None, max_block_size=MAX_BLOCK_SIZE, chunk_size=CHUNK_SIZE):
+    """
+    Gera (lead_a, lead_b, score, mesmo_email) para cada par que compartilha um bloco.
+
+    Um par que coincide em várias chaves só é emitido no bloco da primeira
+    delas que foi avaliada, então não há necessidade de guardar os pares já
+    vistos; só os blocos grandes demais (poucos) são lembrados, para que os
+    pares deles ainda sejam comparados nas chaves seguintes.
+    """
+    columns = ('company_id', 'pk', *BLOCKING_KEY_FIELDS)
+    oversized = set()
+    for position, field in enumerate(BLOCKING_KEY_FIELDS):
+        earlier = BLOCKING_KEY_FIELDS[:position]
+        leads = LeadManagement.objects.filter(is_active=True).exclude(**{field: ''})
+        if company_id is not None:
+            leads = leads.filter(company_id=company_id)
+        rows = (
+            dict(zip(columns, values))
+            for values in leads.order_by('company_id', field).values_list(*columns).iterator(chunk_size=chunk_size)
+        )
+        for (company, value), block in groupby(rows, key=lambda row: (row['company_id'], row[field])):
+            block = list(islice(block, max_block_size + 1))
+            if len(block) > max_block_size:
+                oversized.add((field, company, value))
+                continue
+            for a, b in combinations(block, 2):
+                if any(
+                    a[key] and a[key] == b[key] and (key, company, a[key]) not in oversized
+                    for key in earlier
+                ):
+                    continue
+                yield a['pk'], b['pk'], similarity(a, b), bool(a['email_key']) and a['email_key'] == b['email_key']
+
+
+def _full_names(lead_ids, chunk_size=CHUNK_SIZE):
+    names = {}
+    lead_ids = list(lead_ids)
+    for start in range(0, len(lead_ids), chunk_size):
+        rows = LeadManagement.objects.filter(pk__in=lead_ids[start:start + chunk_size]).values_list('pk', 'contact_info')
+        names.update((pk, full_name(contact_info)) for pk, contact_info in rows)
+    return names
+
+
+def find_clusters(company_id, threshold=AUTO_MERGE_THRESHOLD):
+    """
+    Agrupa (union-find) os leads ligados por pares de fusão automática.
+
+    Retorna ``(clusters, review)``: os pares com score >= ``threshold`` só
+    ligam leads com o mesmo e-mail ou o mesmo nome completo; os demais
+    ficam em ``review`` para revisão manual.
+    """
+    parent = {}
+
+    def root(node):
+        parent.setdefault(node, node)
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    pending = []
+    for a, b, score, same_email in candidate_pairs(company_id):
+        if score < threshold:
+            continue
+        if same_email:
+            parent[root(a)] = root(b)
+        else:
+            pending.append((a, b))
+
+    names = _full_names({pk for pair in pending for pk in pair})
+    review = []
+    for a, b in pending:
+        if names.get(a) and names.get(a) == names.get(b):
+            parent[root(a)] = root(b)
+        else:
+            review.append((a, b))
+
+    clusters = {}
+    for node in parent:
+        clusters.setdefault(root(node), set()).add(node)
+    return [cluster for cluster in clusters.values() if len(cluster) > 1], review
+
+
+def flag_for_review(pairs):
+    """Anota em ``metadata['duplicate_candidates']`` os possíveis duplicados de cada lead; retorna quantos"""
+    candidates = {}
+    for a, b in pairs:
+        candidates.setdefault(a, set()).add(str(b))
+        candidates.setdefault(b, set()).add(str(a))
+    leads = list(LeadManagement.objects.filter(pk__in=candidates, is_active=True).only('pk', 'metadata'))
+    for lead in leads:
+        known = set((lead.metadata or {}).get('duplicate_candidates', []))
+        lead.metadata = {**(lead.metadata or {}), 'duplicate_candidates': sorted(known | candidates[lead.pk])}
+    LeadManagement.objects.bulk_update(leads, ['metadata'])
+    return len(leads)
+
+
+def _primary_first(leads):
+    return sorted(
+        leads,
+        key=lambda lead: (lead.customer_id is None, -STATUS_RANK.get(lead.status, 0), lead.created_at),
+    )
+
+
+def merge_leads(primary, duplicates):
+    """
+    Funde ``duplicates`` em ``primary``.
+
+    Reaponta as LeadInteraction das duplicatas, completa ``contact_info`` e
+    ``customer``, mantém o status mais avançado e desativa as duplicatas com
+    ``metadata['merged_into']``. O JSON legado ``interactions`` não é tocado:
+    ``backfill_interactions`` o move para LeadInteraction do lead original.
+    """
+    duplicates = [lead for lead in duplicates if lead.pk != primary.pk]
+    if not duplicates:
+        return primary
+    duplicate_ids = [lead.pk for lead in duplicates]
+    with transaction.atomic():
+        LeadInteraction.objects.filter(lead_id__in=duplicate_ids).update(lead=primary)
+        contact_info = {}
+        for lead in reversed(duplicates):
+            contact_info.update(lead.contact_info or {})
+            primary.conversion_path = [*(primary.conversion_path or []), *(lead.conversion_path or [])]
+            if STATUS_RANK.get(lead.status, 0) > STATUS_RANK.get(primary.status, 0):
+                primary.status = lead.status
+            primary.customer_id = primary.customer_id or lead.customer_id
+            primary.campaign_id = primary.campaign_id or lead.campaign_id
+        primary.contact_info = {**contact_info, **(primary.contact_info or {})}
+        primary.metadata = {**(primary.metadata or {}), 'merged_leads': [
+            *(primary.metadata or {}).get('merged_leads', []), *(str(pk) for pk in duplicate_ids)
+        ]}
+        primary.save()
+
+        merged_at = timezone.now().isoformat()
+        for lead in duplicates:
+            lead.is_active = False
+            lead.metadata = {**(lead.metadata or {}), 'merged_into': str(primary.pk), 'merged_at': merged_at}
+        LeadManagement.objects.bulk_update(duplicates, ['is_active', 'metadata'])
+        rescore_leads(LeadManagement.objects.filter(pk=primary.pk))
+    return primary
+
+
+def link_customers(company_id=None, chunk_size=CHUNK_SIZE):
+    """Associa leads sem ``customer`` ao cliente da mesma empresa com o mesmo e-mail"""
+    leads = LeadManagement.objects.filter(is_active=True, customer__isnull=True).exclude(email_key='')
+    if company_id is not None:
+        leads = leads.filter(company_id=company_id)
+    rows = leads.only('pk', 'company_id', 'email_key', 'customer').order_by().iterator(chunk_size=chunk_size)
+    linked = 0
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return linked
+        customers = {
+            (company, email): pk
+            for pk, company, email in Customer.objects
+            .annotate(email_key=Lower('email'))
+            .filter(company_id__in={lead.company_id for lead in chunk}, email_key__in={lead.email_key for lead in chunk})
+            .values_list('pk', 'company_id', 'email_key')
+        }
+        matched = []
+        for lead in chunk:
+            customer_id = customers.get((lead.company_id, lead.email_key))
+            if customer_id:
+                lead.customer_id = customer_id
+                matched.append(lead)
+        LeadManagement.objects.bulk_update(matched, ['customer'])
+        linked += len(matched)
+
+
+def deduplicate(company_ids=None, threshold=AUTO_MERGE_THRESHOLD):
+    """
+    Rotina noturna: funde os grupos de duplicatas de cada empresa, marca os
+    pares duvidosos para revisão e liga leads a clientes.
+    """
+    if company_ids is None:
+        company_ids = list(LeadManagement.objects.order_by().values_list('company_id', flat=True).distinct())
+    merged = flagged = linked = 0
+    for company_id in company_ids:
+        clusters, review = find_clusters(company_id, threshold)
+        for cluster in clusters:
+            primary, *duplicates = _primary_first(LeadManagement.objects.filter(pk__in=cluster))
+            merge_leads(primary, duplicates)
+            merged += len(duplicates)
+        flagged += flag_for_review(review)
+        linked += link_customers(company_id)
+    return {'merged': merged, 'review': flagged, 'linked': linked}
@@ -0,0 +1,92 @@
+"""
+Registro e consulta das interações de leads na tabela LeadInteraction.
+
+Novas interações são inserções simples; ``backfill_interactions`` move o
+conteúdo legado de ``LeadManagement.interactions`` para a tabela em lotes.
+"""
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import LeadInteraction, LeadManagement
+
+
+BACKFILL_CHUNK_SIZE = 1000
+
+
+def _event_from_dict(lead_id, company_id, interaction, default_time):
+    # Import tardio: scoring depende deste módulo
+    from .scoring import interaction_time
+
+    data = {key: value for key, value in interaction.items() if key not in ('type', 'occurred_at', 'timestamp')}
+    return LeadInteraction(
+        lead_id=lead_id,
+        company_id=company_id,
+        type=str(interaction.get('type') or 'unknown')[:100],
+        occurred_at=interaction_time(interaction) or default_time,
+        data=data,
+    )
+
+
+def record_interaction(lead, interaction_type, data=None, occurred_at=None):
+    """Insere uma interação (O(1), sem reescrever o JSON do lead)"""
+    return LeadInteraction.objects.create(
+        lead=lead,
+        company_id=lead.company_id,
+        type=interaction_type,
+        occurred_at=occurred_at or timezone.now(),
+        data=data or {},
+    )
+
+
+def lead_interactions(lead_ids):
+    """Interações dos leads informados, agrupadas por lead, numa única consulta"""
+    grouped = {lead_id: [] for lead_id in lead_ids}
+    rows = (
+        LeadInteraction.objects
+        .filter(lead_id__in=lead_ids)
+        .order_by('lead_id', 'occurred_at')
+        .values_list('lead_id', 'type', 'occurred_at')
+    )
+    for lead_id, interaction_type, occurred_at in rows:
+        grouped[lead_id].append({'type': interaction_type, 'occurred_at': occurred_at})
+    return grouped
+
+
+def interaction_counts(company, since=None, until=None):
+    """Contagem de interações por tipo para uma empresa, pelo índice (company, type, occurred_at)"""
+    events = LeadInteraction.objects.filter(company=company)
+    if since:
+        events = events.filter(occurred_at__gte=since)
+    if until:
+        events = events.filter(occurred_at__lt=until)
+    return dict(events.order_by().values_list('type').annotate(total=Count('pk')).values_list('type', 'total'))
+
+
+def backfill_interactions(chunk_size=BACKFILL_CHUNK_SIZE):
+    """
+    Move o JSON legado de interações para LeadInteraction, lote a lote.
+
+    Cada lote insere os eventos e esvazia o JSON dos mesmos leads na mesma
+    transação, então o processo pode ser interrompido e retomado sem duplicar.
+    """
+    moved = 0
+    last_pk = None
+    while True:
+        leads = LeadManagement.objects.exclude(interactions=[]).order_by('pk')
+        if last_pk is not None:
+            leads = leads.filter(pk__gt=last_pk)
+        chunk = list(leads.values_list('pk', 'company_id', 'interactions', 'created_at')[:chunk_size])
+        if not chunk:
+            return moved
+        events = [
+            _event_from_dict(pk, company_id, interaction, created_at)
+            for pk, company_id, interactions, created_at in chunk
+            for interaction in interactions or []
+            if isinstance(interaction, dict)
+        ]
+        with transaction.atomic():
+            LeadInteraction.objects.bulk_create(events, batch_size=chunk_size)
+            LeadManagement.objects.filter(pk__in=[row[0] for row in chunk]).update(interactions=[])
+        moved += len(events)
+        last_pk = chunk[-1][0]
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from marketing.interactions import BACKFILL_CHUNK_SIZE, backfill_interactions
+
+
+class Command(BaseCommand):
+    help = "Move LeadManagement.interactions (JSON) para a tabela LeadInteraction"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=BACKFILL_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        moved = backfill_interactions(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"{moved} interactions moved."))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from marketing.dedup import AUTO_MERGE_THRESHOLD, deduplicate, refresh_blocking_keys
+
+
+class Command(BaseCommand):
+    help = "Funde leads duplicados (comparando apenas dentro dos blocos) e os liga a clientes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', action='append', dest='companies')
+        parser.add_argument('--threshold', type=float, default=AUTO_MERGE_THRESHOLD)
+        parser.add_argument(
+            '--refresh-keys', action='store_true',
+            help="Recalcula as chaves de bloqueio antes (leads gravados antes das chaves existirem)",
+        )
+
+    def handle(self, *args, **options):
+        if options['refresh_keys']:
+            refreshed = refresh_blocking_keys()
+            self.stdout.write(f"{refreshed} blocking keys refreshed.")
+        result = deduplicate(company_ids=options['companies'], threshold=options['threshold'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['merged']} leads merged, {result['review']} leads flagged for review, "
+            f"{result['linked']} leads linked to customers."
+        ))
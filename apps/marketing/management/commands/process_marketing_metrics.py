@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from marketing.pipeline import BATCH_SIZE, run_workers
+
+
+class Command(BaseCommand):
+    help = "Normaliza os MarketingMetrics pendentes em MarketingMetricFact"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=None)
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        processed = run_workers(processes=options['processes'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"{processed} marketing metrics rows processed."))
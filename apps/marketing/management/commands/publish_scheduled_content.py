@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from marketing.publishing import publish_due, start_scheduler
+
+
+class Command(BaseCommand):
+    help = "Publica os conteúdos aprovados quando a publish_date chega"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Publica o que já venceu e sai (para cron)")
+
+    def handle(self, *args, **options):
+        if options['once']:
+            published = publish_due()
+            self.stdout.write(self.style.SUCCESS(f"{published} contents published."))
+            return
+        scheduler = start_scheduler()
+        self.stdout.write("Publishing scheduler started.")
+        try:
+            scheduler.run_forever()
+        except KeyboardInterrupt:
+            scheduler.stop()
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from marketing.attribution import refresh_campaign_stats
+
+
+class Command(BaseCommand):
+    help = "Materializa a atribuição diária das campanhas (leads, conversões, receita e ROI)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help="Dias para trás (padrão: janela de atribuição)")
+
+    def handle(self, *args, **options):
+        written = refresh_campaign_stats(days=options['days'])
+        self.stdout.write(self.style.SUCCESS(f"{written} campaign daily rows refreshed."))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from marketing.models import ContentManagement
+from marketing.search import REINDEX_CHUNK_SIZE, get_backend
+
+
+class Command(BaseCommand):
+    help = "Reconstrói o índice de busca textual dos conteúdos de marketing"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', default=None, help="Reindexa apenas os conteúdos desta empresa (UUID)")
+        parser.add_argument('--chunk-size', type=int, default=REINDEX_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        contents = None
+        if options['company']:
+            contents = ContentManagement.objects.filter(company_id=options['company'])
+        indexed = get_backend().reindex(contents, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"{indexed} contents indexed."))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from marketing.scoring import RESCORE_CHUNK_SIZE, rescore_all
+
+
+class Command(BaseCommand):
+    help = "Recalcula o score dos leads, em paralelo por empresa"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=None)
+        parser.add_argument('--company', action='append', dest='companies')
+        parser.add_argument('--chunk-size', type=int, default=RESCORE_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        results = rescore_all(
+            processes=options['processes'],
+            company_ids=options['companies'],
+            chunk_size=options['chunk_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{sum(results.values())} lead scores changed across {len(results)} companies."
+        ))
@@ -0,0 +1,38 @@
+from django.db import migrations
+
+
+INDEX_TABLE = 'marketing_content_search'
+
+
+def create_index(apps, schema_editor):
+    """Tabela do índice de busca (marketing.search): FTS5 no SQLite, tsvector com GIN no Postgres"""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {INDEX_TABLE} USING fts5("
+            "content_id UNINDEXED, company_id UNINDEXED, title, content, meta_description, "
+            "keywords, categories, tags, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            f"CREATE TABLE IF NOT EXISTS {INDEX_TABLE} ("
+            "content_id uuid PRIMARY KEY, company_id uuid NOT NULL, document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {INDEX_TABLE}_document_idx ON {INDEX_TABLE} USING GIN (document)"
+        )
+        schema_editor.execute(f"CREATE INDEX IF NOT EXISTS {INDEX_TABLE}_company_idx ON {INDEX_TABLE} (company_id)")
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {INDEX_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = []
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
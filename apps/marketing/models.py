@@ -1,9 +1,23 @@
+import copy
 from decimal import Decimal
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from core.models import BaseModel
 from companies.models import Company, CompanyUser
 from commerce.models import Customer
+from .blocking import contact_keys
+
+BLOCKING_KEY_FIELDS = ('email_key', 'phone_key', 'name_key')
+
+class MarketingCampaignQuerySet(models.QuerySet):
+    def with_attribution(self):
+        """Totais de atribuição lidos da tabela diária materializada, sem joins com leads e pedidos"""
+        return self.annotate(
+            total_leads=models.Sum('daily_stats__leads'),
+            total_conversions=models.Sum('daily_stats__conversions'),
+            total_revenue=models.Sum('daily_stats__revenue'),
+            attributed_spend=models.Sum('daily_stats__spend'),
+        )
 
 class MarketingCampaign(BaseModel):
     """Campanha de marketing"""
@@ -44,10 +58,35 @@ class MarketingCampaign(BaseModel):
     channels = models.JSONField(default=list)
     created_by = models.ForeignKey(CompanyUser, on_delete=models.SET_NULL, null=True)
 
+    objects = MarketingCampaignQuerySet.as_manager()
+
     class Meta:
         verbose_name = _('Marketing Campaign')
         verbose_name_plural = _('Marketing Campaigns')
 
+class CampaignDailyStats(models.Model):
+    """Atribuição materializada por campanha e dia (leads, conversões, receita, gasto e ROI)"""
+    campaign = models.ForeignKey(MarketingCampaign, on_delete=models.CASCADE, related_name='daily_stats')
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='campaign_daily_stats')
+    day = models.DateField()
+    leads = models.PositiveIntegerField(default=0)
+    conversions = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0'))
+    spend = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0'))
+    roi = models.FloatField(null=True)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _('Campaign Daily Stats')
+        verbose_name_plural = _('Campaign Daily Stats')
+        constraints = [
+            models.UniqueConstraint(fields=['campaign', 'day'], name='unique_campaign_daily_stats'),
+        ]
+        indexes = [
+            models.Index(fields=['company', 'day']),
+        ]
+
+
 class EmailCampaign(BaseModel):
     """Campanha de email marketing"""
     campaign = models.ForeignKey(MarketingCampaign, on_delete=models.CASCADE, related_name='email_campaigns')
@@ -132,6 +171,16 @@ class ContentManagement(BaseModel):
     featured_image = models.JSONField(default=dict)
     seo_settings = models.JSONField(default=dict)
 
+    class Meta:
+        indexes = [
+            # Fila de publicação agendada: só os aprovados, por data
+            models.Index(
+                fields=['publish_date'],
+                condition=models.Q(status='approved'),
+                name='marketing_content_schedule_idx',
+            ),
+        ]
+
 class LeadManagement(BaseModel):
     """Gestão de leads"""
     company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='leads')
@@ -152,8 +201,67 @@ class LeadManagement(BaseModel):
     assigned_to = models.ForeignKey(CompanyUser, on_delete=models.SET_NULL, null=True)
     notes = models.TextField(blank=True)
     conversion_path = models.JSONField(default=list)
-    interactions = models.JSONField(default=list)
+    interactions = models.JSONField(default=list)  # legado: novas interações vão para LeadInteraction
     customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True, blank=True, related_name='leads')
+    # Chaves de bloqueio para deduplicação, derivadas de contact_info no save()
+    email_key = models.CharField(max_length=254, blank=True, default='')
+    phone_key = models.CharField(max_length=20, blank=True, default='')
+    name_key = models.CharField(max_length=20, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['company', 'email_key']),
+            models.Index(fields=['company', 'phone_key']),
+            models.Index(fields=['company', 'name_key']),
+            models.Index(fields=['campaign', 'created_at']),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Cópia do contact_info carregado, para só recalcular as chaves quando ele mudar
+        if 'contact_info' in instance.__dict__:
+            instance._loaded_contact_info = copy.deepcopy(instance.contact_info)
+        return instance
+
+    def refresh_blocking_keys(self):
+        for field, value in contact_keys(self.contact_info).items():
+            setattr(self, field, value)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        # contact_info adiado ou fora de update_fields não é gravado: as chaves ficam como estão
+        writes_contact = 'contact_info' in self.__dict__ and (update_fields is None or 'contact_info' in update_fields)
+        loaded = getattr(self, '_loaded_contact_info', None)
+        if writes_contact and (self._state.adding or loaded is None or loaded != self.contact_info):
+            self.refresh_blocking_keys()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, *BLOCKING_KEY_FIELDS}
+        super().save(*args, **kwargs)
+        if writes_contact:
+            self._loaded_contact_info = copy.deepcopy(self.contact_info)
+
+
+class LeadInteraction(models.Model):
+    """Interação de um lead; tabela somente de inserção que substitui LeadManagement.interactions"""
+    lead = models.ForeignKey(LeadManagement, on_delete=models.CASCADE, related_name='interaction_events')
+    # Desnormalizado para análises entre leads sem join
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='lead_interactions')
+    type = models.CharField(max_length=100)
+    occurred_at = models.DateTimeField()
+    data = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('Lead Interaction')
+        verbose_name_plural = _('Lead Interactions')
+        indexes = [
+            models.Index(fields=['lead', 'occurred_at']),
+            models.Index(fields=['company', 'type', 'occurred_at']),
+        ]
+
+    def as_dict(self):
+        return {**self.data, 'type': self.type, 'occurred_at': self.occurred_at.isoformat()}
 
 
 class MarketingMetrics(BaseModel):
@@ -174,4 +282,39 @@ class MarketingMetrics(BaseModel):
     metrics_data = models.JSONField()
     source = models.CharField(max_length=100)
     annotations = models.JSONField(default=dict)
-    is_processed = models.BooleanField(default=False)
\ No newline at end of file
+    is_processed = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # Fila de processamento: só as linhas pendentes, em ordem de chegada
+            models.Index(
+                fields=['created_at'],
+                condition=models.Q(is_processed=False),
+                name='marketing_metrics_pending_idx',
+            ),
+        ]
+
+class MarketingMetricFact(models.Model):
+    """Fato normalizado de métricas: um valor numérico por (empresa, tipo, período, origem, chave)"""
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='marketing_metric_facts')
+    metrics_type = models.CharField(max_length=50)
+    period_start = models.DateTimeField()
+    period_end = models.DateTimeField()
+    source = models.CharField(max_length=100)
+    key = models.CharField(max_length=200)
+    value = models.DecimalField(max_digits=20, decimal_places=6)
+    raw = models.ForeignKey(MarketingMetrics, on_delete=models.SET_NULL, null=True, related_name='facts')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _('Marketing Metric Fact')
+        verbose_name_plural = _('Marketing Metric Facts')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['company', 'metrics_type', 'period_start', 'period_end', 'source', 'key'],
+                name='unique_marketing_metric_fact',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['company', 'metrics_type', 'key', 'period_start']),
+        ]
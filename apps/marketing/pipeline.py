@@ -0,0 +1,129 @@
+"""
+Pipeline de processamento de MarketingMetrics.
+
+``MarketingMetrics`` funciona como tabela de staging: cada worker reivindica
+um lote de linhas pendentes, normaliza ``metrics_data`` em linhas de
+``MarketingMetricFact`` e marca o lote como processado com um único UPDATE,
+tudo na mesma transação.
+
+No Postgres o lote é reivindicado com ``SELECT ... FOR UPDATE SKIP LOCKED``,
+então vários workers nunca pegam as mesmas linhas. Bancos sem SKIP LOCKED
+(SQLite) rodam com um processo só: os workers pegariam as mesmas linhas e
+disputariam a trava de escrita. Os fatos são gravados com upsert na chave
+única, o que torna o reprocessamento (retry) idempotente.
+"""
+import multiprocessing
+from decimal import Decimal, InvalidOperation
+
+from django.db import close_old_connections, connection, connections, transaction
+
+from .models import MarketingMetricFact, MarketingMetrics
+
+
+BATCH_SIZE = 500
+FACT_UNIQUE_FIELDS = ['company', 'metrics_type', 'period_start', 'period_end', 'source', 'key']
+MAX_KEY_LENGTH = 200
+
+
+def _number(value):
+    if isinstance(value, bool) or value is None:
+        return None
+    try:
+        number = Decimal(str(value))
+    except (InvalidOperation, ValueError):
+        return None
+    return number if number.is_finite() else None
+
+
+def flatten(data, prefix=''):
+    """Achata ``metrics_data`` em pares (chave pontuada, valor numérico)"""
+    if isinstance(data, dict):
+        for name, value in data.items():
+            yield from flatten(value, f'{prefix}.{name}' if prefix else str(name))
+    elif isinstance(data, list):
+        for item in data:
+            # Listas no formato [{"key": ..., "value": ...}]
+            if isinstance(item, dict) and 'key' in item and 'value' in item:
+                yield from flatten(item['value'], f"{prefix}.{item['key']}" if prefix else str(item['key']))
+    else:
+        number = _number(data)
+        if number is not None and prefix:
+            yield prefix[:MAX_KEY_LENGTH], number
+
+
+def normalize(row):
+    """Fatos de uma linha de staging (últimos valores vencem em chaves repetidas)"""
+    facts = {}
+    for key, value in flatten(row.metrics_data):
+        facts[key] = MarketingMetricFact(
+            company_id=row.company_id,
+            metrics_type=row.metrics_type,
+            period_start=row.period_start,
+            period_end=row.period_end,
+            source=row.source,
+            key=key,
+            value=value,
+            raw_id=row.pk,
+        )
+    return facts
+
+
+def claim_batch(batch_size=BATCH_SIZE):
+    """Reivindica linhas pendentes; deve rodar dentro de ``atomic``"""
+    pending = MarketingMetrics.objects.filter(is_processed=False).order_by('created_at')
+    if connection.features.has_select_for_update_skip_locked:
+        pending = pending.select_for_update(skip_locked=True)
+    return list(pending.only(
+        'pk', 'company_id', 'metrics_type', 'period_start', 'period_end', 'source', 'metrics_data',
+    )[:batch_size])
+
+
+def process_batch(batch_size=BATCH_SIZE):
+    """Processa um lote; retorna quantas linhas de staging foram consumidas"""
+    with transaction.atomic():
+        rows = claim_batch(batch_size)
+        if not rows:
+            return 0
+        facts = {}
+        for row in rows:
+            for key, fact in normalize(row).items():
+                facts[fact.company_id, fact.metrics_type, fact.period_start, fact.period_end, fact.source, key] = fact
+        MarketingMetricFact.objects.bulk_create(
+            facts.values(),
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=FACT_UNIQUE_FIELDS,
+            update_fields=['value', 'raw', 'updated_at'],
+        )
+        MarketingMetrics.objects.filter(pk__in=[row.pk for row in rows]).update(is_processed=True)
+    return len(rows)
+
+
+def drain(batch_size=BATCH_SIZE, max_batches=None):
+    """Processa lotes até a fila esvaziar (ou ``max_batches``); retorna o total de linhas"""
+    total = batches = 0
+    while max_batches is None or batches < max_batches:
+        processed = process_batch(batch_size)
+        if not processed:
+            break
+        total += processed
+        batches += 1
+    return total
+
+
+def _drain_worker(batch_size):
+    close_old_connections()
+    try:
+        return drain(batch_size)
+    finally:
+        connections.close_all()
+
+
+def run_workers(processes=None, batch_size=BATCH_SIZE):
+    """Esvazia a fila com vários processos; seguro pelo SKIP LOCKED e pelo upsert idempotente"""
+    processes = processes or multiprocessing.cpu_count()
+    if processes == 1 or not connection.features.has_select_for_update_skip_locked:
+        return drain(batch_size)
+    connections.close_all()
+    with multiprocessing.get_context('fork').Pool(processes=processes) as pool:
+        return sum(pool.map(_drain_worker, [batch_size] * processes))
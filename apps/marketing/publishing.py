@@ -0,0 +1,151 @@
+"""
+Publicação agendada de ContentManagement.
+
+Conteúdos ``approved`` com ``publish_date`` passam a ``published`` quando a
+data chega. O agendador mantém um heap com as próximas datas, carregado pelo
+índice parcial (status='approved', publish_date), e dorme até a primeira
+delas em vez de varrer a tabela periodicamente.
+
+Na hora de publicar, um único UPDATE pega todos os aprovados já vencidos,
+então conteúdos reagendados ou aprovados por outros processos são tratados
+corretamente; o heap só decide quando acordar.
+
+Os agendamentos feitos pelos sinais (em qualquer processo) são avisados pelo
+canal ``publishing`` do ``core.pubsub``, que o agendador assina num thread
+próprio. Entre processos isso exige um ``PUSH_BACKEND`` compartilhado (Redis);
+com o backend em processo, o aviso só chega a um agendador do mesmo processo e
+os demais agendamentos entram no heap na próxima recarga (no máximo ``HORIZON``).
+"""
+import asyncio
+import heapq
+import logging
+import threading
+from datetime import timedelta
+
+from django.db import close_old_connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core import pubsub
+from .models import ContentManagement
+
+
+logger = logging.getLogger(__name__)
+
+# Janela carregada no heap; também é o sono máximo entre recargas
+HORIZON = timedelta(minutes=5)
+LOAD_LIMIT = 1000
+RETRY_SECONDS = 30
+CHANNEL = 'publishing'
+
+
+def scheduled_content():
+    return ContentManagement.objects.filter(status='approved', publish_date__isnull=False)
+
+
+def publish_due(now=None):
+    """Publica num único UPDATE os conteúdos aprovados com data vencida; retorna quantos"""
+    now = now or timezone.now()
+    return scheduled_content().filter(publish_date__lte=now).update(status='published', updated_at=now)
+
+
+class PublishingScheduler:
+    """Heap das próximas datas de publicação, com espera até o próximo vencimento"""
+
+    def __init__(self, horizon=HORIZON, load_limit=LOAD_LIMIT):
+        self.horizon = horizon
+        self.load_limit = load_limit
+        self._heap = []
+        self._loaded_until = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self.listening = threading.Event()
+
+    def load(self, now):
+        """Recarrega o heap com as datas até ``now + horizon``, em ordem pelo índice"""
+        until = now + self.horizon
+        dates = list(
+            scheduled_content()
+            .filter(publish_date__lte=until)
+            .order_by('publish_date')
+            .values_list('publish_date', flat=True)[:self.load_limit]
+        )
+        with self._lock:
+            # Lista ordenada já é um heap válido
+            self._heap = dates
+            # Com o limite atingido, a janela termina na última data carregada
+            self._loaded_until = dates[-1] if len(dates) >= self.load_limit else until
+
+    def notify(self, publish_date):
+        """Inclui uma data agendada e acorda o laço se ela estiver na janela"""
+        if publish_date is None or self._loaded_until is None or publish_date > self._loaded_until:
+            return
+        with self._lock:
+            heapq.heappush(self._heap, publish_date)
+        self._wakeup.set()
+
+    def run_pending(self, now=None):
+        """Publica o que venceu; retorna quantos conteúdos foram publicados"""
+        now = now or timezone.now()
+        if self._loaded_until is None or now >= self._loaded_until:
+            self.load(now)
+        due = False
+        with self._lock:
+            while self._heap and self._heap[0] <= now:
+                heapq.heappop(self._heap)
+                due = True
+        return publish_due(now) if due else 0
+
+    def seconds_until_next(self, now=None):
+        now = now or timezone.now()
+        with self._lock:
+            wake_at = min(self._heap[0], self._loaded_until) if self._heap else self._loaded_until
+        return max((wake_at - now).total_seconds(), 0) if wake_at else 0
+
+    def run_forever(self):
+        while not self._stopped.is_set():
+            close_old_connections()
+            try:
+                published = self.run_pending()
+                if published:
+                    logger.info("Published %d scheduled contents", published)
+                timeout = self.seconds_until_next()
+            except Exception:
+                logger.exception("Scheduled content publishing failed")
+                self._loaded_until = None
+                timeout = RETRY_SECONDS
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+    def listen(self):
+        """Assina o canal de agendamentos num thread com o seu próprio loop asyncio"""
+        thread = threading.Thread(target=asyncio.run, args=(self._listen(),), name='publishing-listener', daemon=True)
+        thread.start()
+        return thread
+
+    async def _listen(self):
+        async with pubsub.subscribe([CHANNEL]) as messages:
+            self.listening.set()
+            while not self._stopped.is_set():
+                try:
+                    message = await asyncio.wait_for(messages.get(), timeout=1)
+                except asyncio.TimeoutError:
+                    continue
+                self.notify(parse_datetime(message['data']['publish_date']))
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+
+def start_scheduler(**kwargs):
+    """Cria o agendador e passa a receber os agendamentos avisados pelos sinais"""
+    scheduler = PublishingScheduler(**kwargs)
+    scheduler.listen()
+    return scheduler
+
+
+def notify(publish_date):
+    """Avisa os agendadores, de qualquer processo, de uma nova data de publicação"""
+    pubsub.publish(CHANNEL, 'scheduled', {'publish_date': publish_date.isoformat()})
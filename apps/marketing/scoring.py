@@ -0,0 +1,208 @@
+"""
+Motor de pontuação de leads (LeadManagement.score).
+
+Cada interação vale o peso do seu tipo, com decaimento exponencial pela idade
+(meia-vida em dias). Pesos e meia-vida vêm de ``settings.LEAD_SCORING`` e
+podem ser sobrescritos por empresa em ``company_settings['lead_scoring']``.
+
+As interações vêm de ``LeadInteraction`` (e do JSON legado ainda não migrado).
+Para pontuar de forma incremental, o valor contínuo e o instante a que ele se
+refere ficam em ``metadata['scoring']``; uma nova interação apenas decai esse
+valor até agora e soma o seu peso, sem reler o histórico.
+"""
+import multiprocessing
+from datetime import datetime
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from companies.models import Company
+from .interactions import lead_interactions, record_interaction
+from .models import LeadManagement
+
+
+DEFAULT_WEIGHTS = {
+    'email_open': 1,
+    'email_click': 3,
+    'page_view': 1,
+    'form_submit': 10,
+    'download': 5,
+    'event_attended': 15,
+    'meeting': 20,
+    'call': 8,
+    'unsubscribe': -20,
+}
+DEFAULT_HALF_LIFE_DAYS = 30
+RESCORE_CHUNK_SIZE = 2000
+
+
+class ScoringRules:
+    """Pesos por tipo de interação e meia-vida do decaimento"""
+
+    def __init__(self, weights=None, half_life_days=DEFAULT_HALF_LIFE_DAYS, default_weight=0):
+        self.weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+        self.half_life_seconds = float(half_life_days) * 86400 if half_life_days else None
+        self.default_weight = default_weight
+
+    @classmethod
+    def for_company(cls, company_settings=None):
+        config = {**getattr(settings, 'LEAD_SCORING', {}), **((company_settings or {}).get('lead_scoring') or {})}
+        return cls(
+            weights=config.get('weights'),
+            half_life_days=config.get('half_life_days', DEFAULT_HALF_LIFE_DAYS),
+            default_weight=config.get('default_weight', 0),
+        )
+
+    def weight(self, interaction):
+        return self.weights.get(interaction.get('type'), self.default_weight)
+
+    def decay(self, value, since, now):
+        if not self.half_life_seconds or since is None or now <= since:
+            return value
+        return value * 0.5 ** ((now - since).total_seconds() / self.half_life_seconds)
+
+    def score(self, interactions, now=None):
+        """Valor contínuo das interações, decaído até ``now``"""
+        now = now or timezone.now()
+        total = 0.0
+        for interaction in interactions or []:
+            if not isinstance(interaction, dict):
+                continue
+            total += self.decay(self.weight(interaction), interaction_time(interaction), now)
+        return total
+
+
+def interaction_time(interaction):
+    """
+    Instante (com fuso) da interação, ou None.
+
+    O JSON legado é livre: só texto ISO e datetime são aceitos; valores sem
+    fuso ficam no fuso atual e o resto (epoch numérico, datas inválidas) é None.
+    """
+    value = interaction.get('occurred_at') or interaction.get('timestamp')
+    if isinstance(value, str):
+        try:
+            value = parse_datetime(value)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    return value if timezone.is_aware(value) else timezone.make_aware(value)
+
+
+def _store(lead, raw, now):
+    lead.metadata = {**(lead.metadata or {}), 'scoring': {'raw': raw, 'at': now.isoformat()}}
+    lead.score = round(raw)
+
+
+def append_interaction(lead, interaction, rules=None, now=None):
+    """
+    Registra uma interação e atualiza o score de forma incremental.
+
+    A interação vira uma linha de ``LeadInteraction`` e o score usa o valor
+    contínuo guardado em ``metadata['scoring']`` em vez de recalcular o histórico.
+    O lead é relido com ``select_for_update`` dentro da transação, para que
+    interações simultâneas não percam a contribuição uma da outra. Sem
+    ``occurred_at`` vale o ``timestamp`` informado e, sem nenhum dos dois, agora.
+    """
+    now = now or timezone.now()
+    rules = rules or ScoringRules.for_company(lead.company.company_settings)
+    occurred_at = interaction_time(interaction) or now
+    data = {key: value for key, value in interaction.items() if key not in ('type', 'occurred_at', 'timestamp')}
+    with transaction.atomic():
+        locked = (
+            LeadManagement.objects.select_for_update()
+            .only('pk', 'company_id', 'customer_id', 'score', 'metadata', 'interactions')
+            .get(pk=lead.pk)
+        )
+        state = (locked.metadata or {}).get('scoring')
+        if state:
+            raw = rules.decay(state['raw'], parse_datetime(state['at']), now)
+        else:
+            history = lead_interactions([locked.pk])[locked.pk]
+            raw = rules.score([*(locked.interactions or []), *history], now)
+        raw += rules.decay(rules.weight(interaction), occurred_at, now)
+        record_interaction(locked, interaction.get('type') or 'unknown', data, occurred_at)
+        _store(locked, raw, now)
+        locked.save(update_fields=['score', 'metadata', 'updated_at'])
+    lead.score, lead.metadata = locked.score, locked.metadata
+    return lead.score
+
+
+def _flush(batch, rules, company_rules, now):
+    """Pontua um lote com uma consulta de interações e grava com ``bulk_update``"""
+    events = lead_interactions([lead.pk for lead in batch])
+    changed = 0
+    for lead in batch:
+        lead_rules = rules or company_rules[lead.company_id]
+        previous = lead.score
+        _store(lead, lead_rules.score([*(lead.interactions or []), *events[lead.pk]], now), now)
+        changed += lead.score != previous
+    LeadManagement.objects.bulk_update(batch, ['score', 'metadata'])
+    return changed
+
+
+def rescore_leads(leads=None, rules=None, now=None, chunk_size=RESCORE_CHUNK_SIZE):
+    """
+    Recalcula o score de todos os leads do queryset em lotes.
+
+    Lê os leads em fluxo (``iterator``), busca as interações de cada lote numa
+    única consulta e grava com ``bulk_update``; retorna quantos leads mudaram.
+    """
+    now = now or timezone.now()
+    leads = LeadManagement.objects.all() if leads is None else leads
+    rows = leads.only('pk', 'company_id', 'score', 'interactions', 'metadata').order_by().iterator(chunk_size=chunk_size)
+    company_rules = {}
+    changed, batch = 0, []
+    for lead in rows:
+        if rules is None and lead.company_id not in company_rules:
+            company_settings = Company.objects.filter(pk=lead.company_id).values_list('company_settings', flat=True).first()
+            company_rules[lead.company_id] = ScoringRules.for_company(company_settings)
+        batch.append(lead)
+        if len(batch) >= chunk_size:
+            changed += _flush(batch, rules, company_rules, now)
+            batch = []
+    if batch:
+        changed += _flush(batch, rules, company_rules, now)
+    return changed
+
+
+def _rescore_company(args):
+    company_id, now, chunk_size = args
+    company_settings = Company.objects.filter(pk=company_id).values_list('company_settings', flat=True).first()
+    return company_id, rescore_leads(
+        LeadManagement.objects.filter(company_id=company_id),
+        rules=ScoringRules.for_company(company_settings),
+        now=now,
+        chunk_size=chunk_size,
+    )
+
+
+def _rescore_company_worker(args):
+    close_old_connections()
+    try:
+        return _rescore_company(args)
+    finally:
+        connections.close_all()
+
+
+def rescore_all(processes=None, company_ids=None, now=None, chunk_size=RESCORE_CHUNK_SIZE):
+    """
+    Reprocessa os scores de todas as empresas em processos paralelos.
+
+    O trabalho é particionado por empresa, então cada processo grava apenas
+    linhas da sua partição e não há disputa entre eles.
+    """
+    now = now or timezone.now()
+    if company_ids is None:
+        company_ids = list(LeadManagement.objects.order_by().values_list('company_id', flat=True).distinct())
+    tasks = [(company_id, now, chunk_size) for company_id in company_ids]
+    if processes == 1 or len(tasks) <= 1:
+        return dict(_rescore_company(task) for task in tasks)
+
+    # Conexões não podem ser herdadas pelos processos filhos
+    connections.close_all()
+    with multiprocessing.get_context('fork').Pool(processes=processes) as pool:
+        return dict(pool.imap_unordered(_rescore_company_worker, tasks))
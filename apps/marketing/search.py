@@ -0,0 +1,245 @@
+"""
+Busca textual em ContentManagement.
+
+O índice fica numa tabela auxiliar mantida por SQL próprio de cada banco:
+FTS5 no SQLite e ``tsvector`` com índice GIN no Postgres, criada pela migração
+``0001_content_search_index``. Os dois backends expõem a mesma interface
+(``index``, ``remove``, ``reindex`` e ``search_ids``); outros bancos caem numa
+busca ``icontains``.
+
+O índice é atualizado pelos sinais de ContentManagement (após o commit, só
+quando um campo indexado muda) e pode ser reconstruído com o comando
+``reindex_content``. Como a tabela não é um modelo, o ``flush`` (e os
+TransactionTestCase) não a esvaziam: entradas de conteúdos que não existem
+mais são removidas quando aparecem numa busca.
+"""
+import copy
+import re
+import uuid
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import ContentManagement
+
+
+INDEX_TABLE = 'marketing_content_search'
+REINDEX_CHUNK_SIZE = 1000
+ROWID_MASK = (1 << 63) - 1
+INDEXED_FIELDS = ('pk', 'company_id', 'title', 'content', 'meta_description', 'keywords', 'categories', 'tags')
+
+
+def _join(values):
+    if isinstance(values, (list, tuple)):
+        return ' '.join(str(value) for value in values if value)
+    return str(values or '')
+
+
+def document(content):
+    """Campos indexados de um conteúdo, na ordem usada pelos backends"""
+    return (
+        str(content.pk),
+        str(content.company_id),
+        content.title or '',
+        content.content or '',
+        content.meta_description or '',
+        _join(content.keywords),
+        _join(content.categories),
+        _join(content.tags),
+    )
+
+
+def indexed_state(content):
+    """
+    Campos indexados já carregados, para comparar no ``post_save``.
+
+    Lê de ``__dict__`` (campo adiado não dispara consulta) e copia as listas
+    JSON, para que alterações no lugar apareçam.
+    """
+    values = content.__dict__
+    return {name: copy.deepcopy(values[name]) for name in INDEXED_FIELDS[1:] if name in values}
+
+
+def _terms(query):
+    return re.findall(r'\w+', query or '', flags=re.UNICODE)
+
+
+class BaseSearchBackend:
+    def index(self, contents):
+        pass
+
+    def remove(self, content_ids):
+        pass
+
+    def clear(self):
+        pass
+
+    def search_ids(self, company_id, query, limit):
+        raise NotImplementedError
+
+    def reindex(self, contents=None, chunk_size=REINDEX_CHUNK_SIZE):
+        """
+        Reconstrói o índice em lotes; retorna quantos conteúdos foram indexados.
+
+        Sem ``contents`` o índice é esvaziado antes, removendo entradas órfãs.
+        """
+        if contents is None:
+            self.clear()
+            contents = ContentManagement.objects.all()
+        total, batch = 0, []
+        for content in contents.only(*INDEXED_FIELDS).order_by().iterator(chunk_size=chunk_size):
+            batch.append(content)
+            if len(batch) >= chunk_size:
+                self.index(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            self.index(batch)
+            total += len(batch)
+        return total
+
+
+class SQLiteFTS5Backend(BaseSearchBackend):
+    """Tabela virtual FTS5, ordenada por bm25 com peso maior no título e nas palavras-chave"""
+
+    # Pesos bm25 por coluna: title, content, meta_description, keywords, categories, tags
+    WEIGHTS = (10.0, 1.0, 3.0, 5.0, 2.0, 2.0)
+
+    @staticmethod
+    def rowid(content_id):
+        # Colunas UNINDEXED não têm índice; o rowid derivado do UUID permite
+        # substituir e remover entradas sem varrer a tabela
+        return uuid.UUID(str(content_id)).int & ROWID_MASK
+
+    def index(self, contents):
+        rows = [(self.rowid(row[0]), *row) for row in map(document, contents)]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT OR REPLACE INTO {INDEX_TABLE} (rowid, content_id, company_id, title, content, "
+                "meta_description, keywords, categories, tags) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                rows,
+            )
+
+    def remove(self, content_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {INDEX_TABLE} WHERE rowid = %s", [(self.rowid(pk),) for pk in content_ids])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {INDEX_TABLE}")
+
+    def search_ids(self, company_id, query, limit):
+        terms = _terms(query)
+        if not terms:
+            return []
+        # Termos entre aspas (sem sintaxe FTS do usuário) e prefixo no último
+        match = ' '.join(f'"{term}"' for term in terms[:-1]) + f' "{terms[-1]}"*'
+        weights = ', '.join(str(weight) for weight in self.WEIGHTS)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT content_id FROM {INDEX_TABLE} "
+                f"WHERE {INDEX_TABLE} MATCH %s AND company_id = %s "
+                f"ORDER BY bm25({INDEX_TABLE}, 0, 0, {weights}) LIMIT %s",
+                [match.strip(), str(company_id), limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """Tabela com ``tsvector`` ponderado e índice GIN, ordenada por ``ts_rank``"""
+
+    @property
+    def config(self):
+        return getattr(settings, 'CONTENT_SEARCH_CONFIG', 'simple')
+
+    def index(self, contents):
+        config = self.config
+        vector = (
+            "setweight(to_tsvector(%(config)s::regconfig, %(title)s), 'A') || "
+            "setweight(to_tsvector(%(config)s::regconfig, %(keywords)s), 'A') || "
+            "setweight(to_tsvector(%(config)s::regconfig, %(meta)s), 'B') || "
+            "setweight(to_tsvector(%(config)s::regconfig, %(categories)s || ' ' || %(tags)s), 'C') || "
+            "setweight(to_tsvector(%(config)s::regconfig, %(content)s), 'D')"
+        )
+        params = [
+            {
+                'id': row[0], 'company': row[1], 'title': row[2], 'content': row[3], 'meta': row[4],
+                'keywords': row[5], 'categories': row[6], 'tags': row[7], 'config': config,
+            }
+            for row in map(document, contents)
+        ]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {INDEX_TABLE} (content_id, company_id, document) "
+                f"VALUES (%(id)s, %(company)s, {vector}) "
+                "ON CONFLICT (content_id) DO UPDATE SET company_id = EXCLUDED.company_id, document = EXCLUDED.document",
+                params,
+            )
+
+    def remove(self, content_ids):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {INDEX_TABLE} WHERE content_id = ANY(%s::uuid[])", [[str(pk) for pk in content_ids]])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"TRUNCATE {INDEX_TABLE}")
+
+    def search_ids(self, company_id, query, limit):
+        terms = _terms(query)
+        if not terms:
+            return []
+        tsquery = ' & '.join(terms[:-1] + [f'{terms[-1]}:*'])
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT content_id FROM {INDEX_TABLE}, to_tsquery(%s::regconfig, %s) query "
+                "WHERE company_id = %s AND document @@ query "
+                "ORDER BY ts_rank(document, query) DESC LIMIT %s",
+                [self.config, tsquery, str(company_id), limit],
+            )
+            return [str(row[0]) for row in cursor.fetchall()]
+
+
+class FallbackSearchBackend(BaseSearchBackend):
+    """Sem índice: ``icontains`` nos campos de texto (bancos sem suporte)"""
+
+    def search_ids(self, company_id, query, limit):
+        filters = Q()
+        for term in _terms(query):
+            filters &= Q(title__icontains=term) | Q(content__icontains=term) | Q(meta_description__icontains=term)
+        if not filters:
+            return []
+        return list(
+            ContentManagement.objects.filter(filters, company_id=company_id)
+            .values_list('pk', flat=True)[:limit]
+        )
+
+
+BACKENDS = {
+    'sqlite': SQLiteFTS5Backend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend():
+    return BACKENDS.get(connection.vendor, FallbackSearchBackend)()
+
+
+def search(company, query, limit=20):
+    """Conteúdos da empresa que casam com ``query``, do mais relevante para o menos"""
+    company_id = getattr(company, 'pk', company)
+    backend = get_backend()
+    ids = [ContentManagement._meta.pk.to_python(pk) for pk in backend.search_ids(company_id, query, limit)]
+    found = ContentManagement.objects.in_bulk(ids)
+    missing = [pk for pk in ids if pk not in found]
+    if missing:
+        backend.remove(missing)
+    return [found[pk] for pk in ids if pk in found]
+
+
+def index_content(content):
+    transaction.on_commit(lambda: get_backend().index([content]))
+
+
+def remove_content(content_id):
+    transaction.on_commit(lambda: get_backend().remove([content_id]))
@@ -0,0 +1,83 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from commerce.models import Customer, Order
+from . import automation, publishing, search
+from .models import ContentManagement, LeadInteraction, LeadManagement, MarketingAutomation
+
+
+@receiver(post_save, sender=MarketingAutomation)
+@receiver(post_delete, sender=MarketingAutomation)
+def invalidate_automation_index(sender, **kwargs):
+    transaction.on_commit(automation.invalidate_index)
+
+
+@receiver(post_save, sender=Customer)
+def customer_created_event(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        automation.emit(instance.company_id, 'customer_created', instance.pk, {
+            'customer_type': instance.customer_type, 'email': instance.email,
+        })
+
+
+@receiver(post_save, sender=Order)
+def order_placed_event(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        automation.emit(instance.company_id, 'order_placed', instance.customer_id, {
+            'order_number': instance.order_number, 'status': instance.status, 'total': float(instance.total),
+        })
+
+
+@receiver(post_init, sender=LeadManagement)
+def remember_lead_status(sender, instance, **kwargs):
+    instance._automation_status = instance.__dict__.get('status')
+
+
+@receiver(post_save, sender=LeadManagement)
+def lead_events(sender, instance, created, raw=False, **kwargs):
+    status = instance.__dict__.get('status')
+    if raw or (not created and status == instance._automation_status):
+        return
+    previous, instance._automation_status = instance._automation_status, status
+    data = {'source': instance.source, 'status': status}
+    if created:
+        automation.emit(instance.company_id, 'lead_created', instance.customer_id, data)
+    elif status is not None:
+        data['previous_status'] = previous
+        automation.emit(instance.company_id, 'lead_status_changed', instance.customer_id, data)
+
+
+@receiver(post_save, sender=LeadInteraction)
+def lead_interaction_event(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        data = instance.data if isinstance(instance.data, dict) else {}
+        automation.emit(instance.company_id, 'lead_interaction', instance.lead.customer_id, {
+            **data, 'type': instance.type, 'lead_id': str(instance.lead_id),
+        })
+
+
+@receiver(post_init, sender=ContentManagement)
+def remember_indexed_state(sender, instance, **kwargs):
+    instance._search_snapshot = search.indexed_state(instance)
+
+
+@receiver(post_save, sender=ContentManagement)
+def index_content(sender, instance, created, raw=False, **kwargs):
+    state = search.indexed_state(instance)
+    if raw or (not created and state == instance._search_snapshot):
+        return
+    instance._search_snapshot = state
+    search.index_content(instance)
+
+
+@receiver(post_delete, sender=ContentManagement)
+def remove_content_from_index(sender, instance, **kwargs):
+    search.remove_content(instance.pk)
+
+
+@receiver(post_save, sender=ContentManagement)
+def schedule_content(sender, instance, raw=False, **kwargs):
+    if not raw and instance.status == 'approved' and instance.publish_date:
+        publish_date = instance.publish_date
+        transaction.on_commit(lambda: publishing.notify(publish_date))
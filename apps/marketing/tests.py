@@ -1,3 +1,493 @@
-from django.test import TestCase
+from datetime import datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from commerce.models import Customer, CustomerAddress, Order
+from companies.models import Company, CompanyUser
+from core.models import Language, Notification
+from . import attribution, automation, dedup, interactions, pipeline, publishing, scoring, search
+from .automation import AutomationRuntime, WorkerQueue
+from .models import (
+    CampaignDailyStats, ContentManagement, LeadInteraction, LeadManagement, MarketingAutomation, MarketingCampaign,
+    MarketingMetricFact, MarketingMetrics,
+)
+
+
+def create_company(suffix=''):
+    owner = get_user_model().objects.create_user(email=f'owner{suffix}@example.com', password='secret')
+    language, _ = Language.objects.get_or_create(
+        code='fr', defaults={'name': 'French', 'native_name': 'Français', 'date_format': 'd/m/Y'}
+    )
+    return Company.objects.create(
+        owner=owner, business_name='Batmart', trading_name='Batmart', tax_id=f'FR{suffix}',
+        registration_number='1', legal_form='SAS', primary_language=language,
+    )
+
+
+class MetricsPipelineTests(TestCase):
+    def setUp(self):
+        self.company = create_company('1')
+        start = timezone.now() - timedelta(days=1)
+        MarketingMetrics.objects.bulk_create([
+            MarketingMetrics(
+                company=self.company, period_start=start + timedelta(minutes=index),
+                period_end=start + timedelta(minutes=index + 1), metrics_type='website', source='ga',
+                metrics_data={'visits': index, 'pages': [{'key': 'home', 'value': 2}], 'label': 'x'},
+            )
+            for index in range(30)
+        ])
+
+    def test_workers_drain_queue(self):
+        self.assertEqual(pipeline.run_workers(processes=4, batch_size=7), 30)
+        self.assertFalse(MarketingMetrics.objects.filter(is_processed=False).exists())
+        self.assertEqual(MarketingMetricFact.objects.count(), 60)
+        self.assertEqual(pipeline.run_workers(processes=4), 0)
+
+    def test_without_skip_locked_runs_in_one_process(self):
+        with mock.patch.object(connection.features, 'has_select_for_update_skip_locked', False), \
+                mock.patch.object(pipeline.multiprocessing, 'get_context') as get_context:
+            self.assertEqual(pipeline.run_workers(processes=4), 30)
+        get_context.assert_not_called()
+
+    def test_reprocessing_is_idempotent(self):
+        pipeline.drain()
+        MarketingMetrics.objects.update(is_processed=False)
+        pipeline.drain()
+        self.assertEqual(MarketingMetricFact.objects.count(), 60)
+
+
+class InteractionTimeTests(TestCase):
+    def test_accepts_iso_strings_and_datetimes(self):
+        aware = timezone.now().replace(microsecond=0)
+        self.assertEqual(scoring.interaction_time({'occurred_at': aware.isoformat()}), aware)
+        self.assertEqual(scoring.interaction_time({'timestamp': aware}), aware)
+        naive = scoring.interaction_time({'occurred_at': '2026-01-05T10:00:00'})
+        self.assertTrue(timezone.is_aware(naive))
+        self.assertTrue(timezone.is_aware(scoring.interaction_time({'occurred_at': datetime(2026, 1, 5)})))
+
+    def test_other_values_are_ignored(self):
+        for value in (1767225600, 1767225600.5, '2026-13-40T10:00:00', 'hier', ['2026-01-05'], {'at': 1}):
+            self.assertIsNone(scoring.interaction_time({'occurred_at': value}))
+
+    def test_legacy_json_does_not_break_rescore(self):
+        company = create_company('2')
+        LeadManagement.objects.create(
+            company=company, source='web', contact_info={'email': 'lead@example.com'}, status='new',
+            interactions=[
+                {'type': 'meeting', 'occurred_at': '2026-01-05T10:00:00'},
+                {'type': 'call', 'timestamp': 1767225600},
+                {'type': 'form_submit', 'occurred_at': timezone.now().isoformat()},
+            ],
+        )
+        self.assertEqual(scoring.rescore_leads(), 1)
+        self.assertGreaterEqual(LeadManagement.objects.get().score, 10)
+
+    def test_append_uses_supplied_timestamp(self):
+        company = create_company('2')
+        lead = LeadManagement.objects.create(company=company, source='web', contact_info={}, status='new')
+        now = timezone.now()
+        at = now - timedelta(days=30)
+        scoring.append_interaction(lead, {'type': 'meeting', 'timestamp': at.isoformat()}, now=now)
+        self.assertEqual(LeadInteraction.objects.get(lead=lead).occurred_at, at)
+        self.assertEqual(LeadManagement.objects.get(pk=lead.pk).score, 10)
+
+    def test_append_on_stale_instances_keeps_both_contributions(self):
+        company = create_company('2')
+        lead = LeadManagement.objects.create(company=company, source='web', contact_info={}, status='new')
+        now = timezone.now()
+        scoring.append_interaction(lead, {'type': 'form_submit'}, now=now)
+        first, second = LeadManagement.objects.get(pk=lead.pk), LeadManagement.objects.get(pk=lead.pk)
+        scoring.append_interaction(first, {'type': 'meeting'}, now=now)
+        self.assertEqual(scoring.append_interaction(second, {'type': 'call'}, now=now), 38)
+        self.assertEqual(LeadManagement.objects.get(pk=lead.pk).score, 38)
+
+
+class InteractionBackfillTests(TestCase):
+    def setUp(self):
+        self.company = create_company('2')
+
+    def test_backfill_moves_legacy_json_in_chunks(self):
+        at = timezone.now().replace(microsecond=0) - timedelta(days=3)
+        leads = [
+            LeadManagement.objects.create(
+                company=self.company, source='web', contact_info={}, status='new',
+                interactions=[{'type': 'call', 'occurred_at': at.isoformat(), 'duration': 5}, 'bruit'],
+            )
+            for _ in range(3)
+        ]
+        LeadManagement.objects.create(company=self.company, source='web', contact_info={}, status='new')
+        self.assertEqual(interactions.backfill_interactions(chunk_size=2), 3)
+        self.assertFalse(LeadManagement.objects.exclude(interactions=[]).exists())
+        self.assertEqual(
+            sorted(LeadInteraction.objects.values_list('lead_id', 'type', 'occurred_at', 'data')),
+            sorted((lead.pk, 'call', at, {'duration': 5}) for lead in leads),
+        )
+        self.assertEqual(interactions.backfill_interactions(), 0)
+        self.assertEqual(LeadInteraction.objects.count(), 3)
+
+    def test_backfill_defaults_to_lead_creation_time(self):
+        lead = LeadManagement.objects.create(
+            company=self.company, source='web', contact_info={}, status='new',
+            interactions=[{'occurred_at': 1767225600}],
+        )
+        interactions.backfill_interactions()
+        event = LeadInteraction.objects.get()
+        self.assertEqual(
+            (event.type, event.occurred_at, event.company_id), ('unknown', lead.created_at, self.company.pk)
+        )
+
+
+class AutomationActionTests(TestCase):
+    def setUp(self):
+        self.company = create_company('3')
+        self.admin = CompanyUser.objects.create(
+            company=self.company, user=get_user_model().objects.create_user(email='admin@example.com', password='secret'),
+            job_title='Gérant', department='Ventes', status='active', access_level='admin',
+        )
+        self.customer = Customer.objects.create(
+            company=self.company, customer_type='individual', first_name='Jean', last_name='Dupont',
+            email='jean@example.com', phone='0600000000',
+        )
+        MarketingAutomation.objects.create(
+            company=self.company, name='Bienvenue', description='', trigger_type='event',
+            trigger_conditions={'event_name': 'signup'},
+            actions=[
+                {'type': 'send_email', 'subject': 'Bienvenue $first_name', 'body': 'Code $code'},
+                {'type': 'notify', 'title': 'Inscription', 'message': 'Nouveau client $code'},
+            ],
+        )
+        self.runtime = AutomationRuntime()
+
+    def event(self, customer):
+        return {'company_id': self.company.pk, 'event_name': 'signup', 'customer_id': customer.pk, 'data': {'code': 'B42'}}
+
+    def test_email_and_notification_actions_run(self):
+        self.assertEqual(self.runtime.handle_event(self.event(self.customer)), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, 'Bienvenue Jean')
+        self.assertEqual(mail.outbox[0].to, ['jean@example.com'])
+        self.assertEqual(mail.outbox[0].body, 'Code B42')
+        notification = Notification.objects.get(recipient=self.admin.user)
+        self.assertEqual((notification.title, notification.message), ('Inscription', 'Nouveau client B42'))
+
+    def test_email_respects_opt_out_and_company(self):
+        self.customer.marketing_preferences = {'email': False}
+        self.customer.save()
+        other = Customer.objects.create(
+            company=create_company('4'), customer_type='individual', first_name='Marie', last_name='Curie',
+            email='marie@example.com', phone='0600000001',
+        )
+        self.runtime.handle_events([self.event(self.customer), self.event(other)])
+        self.assertEqual(mail.outbox, [])
+
+
+
+@override_settings(AUDIT_ASYNC=False)
+class AutomationEventTests(TestCase):
+    def setUp(self):
+        self.company = create_company('9')
+        self.admin = CompanyUser.objects.create(
+            company=self.company, user=get_user_model().objects.create_user(email='admin@example.com', password='secret'),
+            job_title='Gérant', department='Ventes', status='active', access_level='admin',
+        )
+        patcher = mock.patch.object(automation, '_runtime', AutomationRuntime())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_automation(self, event_name, filters):
+        with self.captureOnCommitCallbacks(execute=True):
+            return MarketingAutomation.objects.create(
+                company=self.company, name=event_name, description='', trigger_type='event',
+                trigger_conditions={'event_name': event_name, 'filters': filters},
+                actions=[{'type': 'notify', 'title': event_name, 'message': '$status'}],
+            )
+
+    def notifications(self):
+        return set(Notification.objects.filter(recipient=self.admin.user).values_list('title', 'message'))
+
+    def test_lead_status_change_triggers_automation(self):
+        created = self.create_automation('lead_created', {})
+        changed = self.create_automation('lead_status_changed', {'status': 'qualified'})
+        with self.captureOnCommitCallbacks(execute=True):
+            lead = create_lead(self.company, email='jean@example.com')
+        for status in ('contacted', 'qualified', 'qualified'):
+            lead.status = status
+            with self.captureOnCommitCallbacks(execute=True):
+                lead.save()
+        self.assertEqual(self.notifications(), {('lead_created', 'new'), ('lead_status_changed', 'qualified')})
+        counts = dict(MarketingAutomation.objects.values_list('pk', 'total_executions'))
+        self.assertEqual(counts, {created.pk: 1, changed.pk: 1})
+
+    def test_order_and_interaction_events(self):
+        self.create_automation('order_placed', {'total': {'op': 'gte', 'value': 100}})
+        self.create_automation('lead_interaction', {'type': 'meeting'})
+        customer = Customer.objects.create(
+            company=self.company, customer_type='individual', first_name='Jean', last_name='Dupont',
+            email='jean@example.com', phone='0600000000',
+        )
+        address = CustomerAddress.objects.create(
+            customer=customer, address_type='both', street_line1='1 rue de Paris', city='Paris',
+            state='IDF', postal_code='75001', country='FR',
+        )
+        for number, total in (('A1', 50), ('A2', 150)):
+            with self.captureOnCommitCallbacks(execute=True):
+                Order.objects.create(
+                    company=self.company, customer=customer, order_number=number, status='confirmed', subtotal=total,
+                    tax_total=0, shipping_total=0, total=total, shipping_address=address, billing_address=address,
+                )
+        lead = create_lead(self.company, email='jean@example.com')
+        for interaction_type in ('call', 'meeting'):
+            with self.captureOnCommitCallbacks(execute=True):
+                scoring.append_interaction(lead, {'type': interaction_type})
+        self.assertEqual(self.notifications(), {('order_placed', 'confirmed'), ('lead_interaction', '$status')})
+
+    def test_stop_drains_pending_jobs(self):
+        executed = []
+        with mock.patch.dict(automation._action_handlers, {'record': lambda items: executed.extend(items)}):
+            workers = WorkerQueue(workers=1)
+            workers.put_many([{'actions': [{'type': 'record'}], 'event': {}} for _ in range(1200)])
+            self.assertEqual(workers.stop(timeout=10), 0)
+        self.assertEqual(len(executed), 1200)
+
+
+def create_lead(company, **contact_info):
+    return LeadManagement.objects.create(company=company, source='web', contact_info=contact_info, status='new')
+
+
+class DeduplicationTests(TestCase):
+    def setUp(self):
+        self.company = create_company('5')
+
+    def test_pairs_of_oversized_block_are_compared_on_later_keys(self):
+        shared = [create_lead(self.company, email='info@example.com', phone='0600000000') for _ in range(2)]
+        create_lead(self.company, email='info@example.com', phone='0611111111')
+        pairs = {
+            frozenset((a, b)): score for a, b, score, _same_email in dedup.candidate_pairs(self.company.pk, max_block_size=2)
+        }
+        self.assertEqual(pairs, {frozenset(lead.pk for lead in shared): 0.8})
+
+    def test_pair_matching_several_keys_is_emitted_once(self):
+        leads = [create_lead(self.company, email='jean@example.com', phone='0600000000') for _ in range(2)]
+        pairs = list(dedup.candidate_pairs(self.company.pk))
+        self.assertEqual([frozenset(pair[:2]) for pair in pairs], [frozenset(lead.pk for lead in leads)])
+
+    def test_deduplicate_only_links_requested_companies(self):
+        other = create_company('6')
+        for company in (self.company, other):
+            Customer.objects.create(
+                company=company, customer_type='individual', first_name='Jean', last_name='Dupont',
+                email='jean@example.com', phone='0600000000',
+            )
+        create_lead(self.company, email='jean@example.com')
+        untouched = create_lead(other, email='jean@example.com')
+        self.assertEqual(dedup.deduplicate([self.company.pk]), {'merged': 0, 'review': 0, 'linked': 1})
+        untouched.refresh_from_db()
+        self.assertIsNone(untouched.customer_id)
+
+    def test_shared_phone_and_surname_go_to_review(self):
+        jean = create_lead(self.company, first_name='Jean', last_name='Dupont', phone='06 00 00 00 00')
+        julie = create_lead(self.company, first_name='Julie', last_name='Dupont', phone='0600000000')
+        self.assertEqual(dedup.deduplicate([self.company.pk]), {'merged': 0, 'review': 2, 'linked': 0})
+        for lead, other in ((jean, julie), (julie, jean)):
+            lead.refresh_from_db()
+            self.assertTrue(lead.is_active)
+            self.assertEqual(lead.metadata['duplicate_candidates'], [str(other.pk)])
+
+    def test_email_or_full_name_match_is_merged(self):
+        create_lead(self.company, name='Jean Dupont', phone='0600000000')
+        create_lead(self.company, first_name='Jéan', last_name='DUPONT', phone='0600000000')
+        create_lead(self.company, email='marie@example.com')
+        create_lead(self.company, email='Marie+promo@example.com')
+        self.assertEqual(dedup.deduplicate([self.company.pk]), {'merged': 2, 'review': 0, 'linked': 0})
+        self.assertEqual(LeadManagement.objects.filter(is_active=True).count(), 2)
+
+    def test_merge_repoints_interaction_rows_and_leaves_legacy_json(self):
+        primary = create_lead(self.company, email='jean@example.com')
+        duplicate = create_lead(self.company, email='jean@example.com')
+        LeadManagement.objects.filter(pk=duplicate.pk).update(interactions=[{'type': 'call'}])
+        duplicate.refresh_from_db()
+        interactions.record_interaction(duplicate, 'meeting')
+        dedup.merge_leads(primary, [duplicate])
+        self.assertEqual(list(LeadInteraction.objects.values_list('lead_id', flat=True)), [primary.pk])
+        primary.refresh_from_db()
+        duplicate.refresh_from_db()
+        self.assertEqual(primary.interactions, [])
+        self.assertEqual(duplicate.interactions, [{'type': 'call'}])
+        self.assertFalse(duplicate.is_active)
+        self.assertEqual(duplicate.metadata['merged_into'], str(primary.pk))
+
+    def test_blocking_keys_follow_contact_info_changes_only(self):
+        lead = create_lead(self.company, email='jean@example.com')
+        partial = LeadManagement.objects.only('pk', 'status', 'updated_at').get(pk=lead.pk)
+        partial.status = 'contacted'
+        partial.save(update_fields=['status'])
+        self.assertNotIn('contact_info', partial.__dict__)
+        lead = LeadManagement.objects.get(pk=lead.pk)
+        with mock.patch.object(LeadManagement, 'refresh_blocking_keys') as refresh:
+            lead.save()
+            refresh.assert_not_called()
+        lead.contact_info['email'] = 'Jean.Dupont@example.com'
+        lead.save(update_fields=['contact_info'])
+        self.assertEqual(LeadManagement.objects.get(pk=lead.pk).email_key, 'jean.dupont@example.com')
+
+
+class AttributionTests(TestCase):
+    def setUp(self):
+        self.company = create_company('7')
+        self.now = timezone.now()
+        self.customer = Customer.objects.create(
+            company=self.company, customer_type='individual', first_name='Jean', last_name='Dupont',
+            email='jean@example.com', phone='0600000000',
+        )
+
+    def create_campaign(self, name, start, end):
+        return MarketingCampaign.objects.create(
+            company=self.company, name=name, description='', campaign_type='email', status='active',
+            start_date=start, end_date=end, budget=100, actual_spend=0,
+        )
+
+    def create_lead(self, campaign, created_at, customer=None):
+        lead = LeadManagement.objects.create(
+            company=self.company, source='web', contact_info={}, status='new', campaign=campaign, customer=customer,
+        )
+        LeadManagement.objects.filter(pk=lead.pk).update(created_at=created_at)
+        return lead
+
+    def create_order(self, total):
+        address = CustomerAddress.objects.create(
+            customer=self.customer, address_type='both', street_line1='1 rue de Paris', city='Paris',
+            state='IDF', postal_code='75001', country='FR',
+        )
+        return Order.objects.create(
+            company=self.company, customer=self.customer, order_number=f'C{total}', status='confirmed',
+            subtotal=total, tax_total=0, shipping_total=0, total=total, shipping_address=address, billing_address=address,
+        )
+
+    def test_order_is_attributed_once_to_latest_lead(self):
+        old = self.create_campaign('Soldes', self.now - timedelta(days=5), self.now)
+        recent = self.create_campaign('Rentrée', self.now - timedelta(days=5), self.now)
+        self.create_lead(old, self.now - timedelta(days=3), self.customer)
+        self.create_lead(old, self.now - timedelta(days=2), self.customer)
+        self.create_lead(recent, self.now - timedelta(hours=1), self.customer)
+        self.create_order(50)
+        attribution.refresh_campaign_stats(until=self.now + timedelta(hours=1))
+        revenue = {
+            campaign: sum(CampaignDailyStats.objects.filter(campaign=campaign).values_list('revenue', flat=True))
+            for campaign in (old, recent)
+        }
+        self.assertEqual(revenue, {old: 0, recent: 50})
+
+    def test_each_order_goes_to_the_latest_lead_before_it(self):
+        old = self.create_campaign('Soldes', self.now - timedelta(days=5), self.now)
+        recent = self.create_campaign('Rentrée', self.now - timedelta(days=5), self.now)
+        self.create_lead(old, self.now - timedelta(days=3), self.customer)
+        self.create_lead(recent, self.now - timedelta(days=1), self.customer)
+        early = self.create_order(30)
+        Order.objects.filter(pk=early.pk).update(created_at=self.now - timedelta(days=2))
+        self.create_order(50)
+        rows = attribution.attribution_rows(self.now - timedelta(days=5), self.now + timedelta(hours=1))
+        revenue = {row['campaign_id']: row['revenue'] for row in rows}
+        self.assertEqual(revenue, {old.pk: 30, recent.pk: 50})
+
+    def test_running_campaign_spend_is_spread_up_to_today(self):
+        campaign = self.create_campaign('Soldes', self.now - timedelta(days=9), self.now + timedelta(days=10))
+        campaign.actual_spend = 100
+        campaign.save()
+        attribution.refresh_campaign_stats(since=self.now - timedelta(days=9), until=self.now)
+        spend = dict(CampaignDailyStats.objects.values_list('day', 'spend'))
+        self.assertEqual(len(spend), 10)
+        self.assertEqual(sum(spend.values()), 100)
+        # O gasto dos dias fora do intervalo recalculado acompanha o novo total
+        campaign.actual_spend = 200
+        campaign.save()
+        attribution.refresh_campaign_stats(days=2, until=self.now)
+        self.assertEqual(set(CampaignDailyStats.objects.values_list('spend', flat=True)), {20})
+
+    def test_days_without_data_are_removed(self):
+        campaign = self.create_campaign('Soldes', self.now - timedelta(days=20), self.now - timedelta(days=10))
+        lead = self.create_lead(campaign, self.now)
+        attribution.refresh_campaign_stats(until=self.now + timedelta(hours=1))
+        self.assertEqual(CampaignDailyStats.objects.get(day=timezone.localdate(self.now)).leads, 1)
+        lead.delete()
+        attribution.refresh_campaign_stats(until=self.now + timedelta(hours=1))
+        self.assertFalse(CampaignDailyStats.objects.filter(day=timezone.localdate(self.now)).exists())
+
+
+@override_settings(AUDIT_ASYNC=False)
+class PublishingTests(TestCase):
+    def setUp(self):
+        self.company = create_company('6')
+        self.now = timezone.now()
+
+    def create_content(self, publish_date, status='approved'):
+        return ContentManagement.objects.create(
+            company=self.company, title='Soldes', content_type='blog', content='...', status=status,
+            publish_date=publish_date,
+        )
+
+    def test_only_due_contents_are_published(self):
+        due = self.create_content(self.now - timedelta(minutes=1))
+        later = self.create_content(self.now + timedelta(minutes=1))
+        draft = self.create_content(self.now - timedelta(minutes=1), status='draft')
+        self.assertEqual(publishing.PublishingScheduler().run_pending(self.now), 1)
+        statuses = dict(ContentManagement.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses, {due.pk: 'published', later.pk: 'approved', draft.pk: 'draft'})
+
+    def test_scheduling_wakes_the_listening_scheduler(self):
+        scheduler = publishing.PublishingScheduler()
+        scheduler.load(self.now)
+        self.assertGreaterEqual(scheduler.seconds_until_next(self.now), 60)
+        thread = scheduler.listen()
+        try:
+            self.assertTrue(scheduler.listening.wait(5))
+            with self.captureOnCommitCallbacks(execute=True):
+                content = self.create_content(self.now + timedelta(seconds=30))
+            self.assertTrue(scheduler._wakeup.wait(5))
+            self.assertEqual(scheduler.seconds_until_next(self.now), 30)
+            self.assertEqual(scheduler.run_pending(self.now + timedelta(seconds=31)), 1)
+        finally:
+            scheduler.stop()
+            thread.join(5)
+        content.refresh_from_db()
+        self.assertEqual(content.status, 'published')
+
+
+@override_settings(AUDIT_ASYNC=False)
+class ContentSearchTests(TestCase):
+    def setUp(self):
+        self.company = create_company('7')
+
+    def create_content(self, title, content='...', **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ContentManagement.objects.create(
+                company=self.company, title=title, content_type='blog', content=content, status='draft', **fields
+            )
+
+    def test_title_matches_rank_first(self):
+        body = self.create_content('Guide', content='Choisir une perceuse sans fil')
+        title = self.create_content('Perceuses à percussion')
+        self.assertEqual(search.search(self.company, 'perceuse'), [title, body])
+        self.assertEqual(search.search(create_company('8'), 'perceuse'), [])
+
+    def test_only_indexed_field_changes_reindex(self):
+        content = self.create_content('Soldes')
+        with mock.patch.object(search, 'index_content') as index_content:
+            content.status = 'approved'
+            content.save()
+            ContentManagement.objects.get(pk=content.pk).save()
+            index_content.assert_not_called()
+            content.tags.append('outillage')
+            content.save()
+            index_content.assert_called_once_with(content)
+
+    def test_orphan_entries_are_pruned(self):
+        content = self.create_content('Soldes')
+        with self.captureOnCommitCallbacks(execute=False):
+            ContentManagement.objects.filter(pk=content.pk).delete()
+        self.assertEqual(search.search(self.company, 'soldes'), [])
+        self.assertEqual(search.get_backend().search_ids(self.company.pk, 'soldes', 10), [])
@@ -0,0 +1,293 @@
+"""
+Motor de disponibilidade dos serviços.
+
+As regras de ``Service.availability_rules`` são expandidas num bitmap por dia
+(um bit por bloco de ``GRANULARITY_MINUTES``) e os agendamentos existentes são
+subtraídos a partir de uma única consulta por intervalo. O bitmap livre de cada
+(serviço, dia) fica em cache e é invalidado pelos sinais de agendamento.
+
+Formato esperado de ``availability_rules``::
+
+    {
+        "timezone": "Europe/Paris",
+        "weekly": {"0": [["09:00", "12:00"], ["14:00", "18:00"]], ...},
+        "exceptions": {"2025-12-25": []}
+    }
+
+Chaves de ``booking_settings`` usadas: ``slot_interval`` (minutos),
+``buffer_minutes``, ``min_notice_minutes`` e ``max_advance_days``.
+"""
+import hashlib
+import json
+import math
+from datetime import datetime, time, timedelta
+from typing import Iterable, NamedTuple
+from zoneinfo import ZoneInfo
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Service, ServiceAppointment
+
+
+GRANULARITY_MINUTES = 5
+BLOCKS_PER_DAY = 24 * 60 // GRANULARITY_MINUTES
+CACHE_TIMEOUT = 60 * 60
+CACHE_KEY = 'service-availability:{service_id}:{day}'
+
+DEFAULT_SLOT_INTERVAL = 30
+DEFAULT_MAX_ADVANCE_DAYS = 60
+# Quantidade de dias carregados por consulta ao procurar horários
+WINDOW_DAYS = 7
+
+# Agendamentos nestes status não ocupam a agenda
+INACTIVE_STATUSES = ('cancelled', 'no_show')
+
+WEEKDAY_NAMES = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+
+class Slot(NamedTuple):
+    service_id: object
+    start: datetime
+    end: datetime
+
+
+def cache_key(service_id, day):
+    return CACHE_KEY.format(service_id=service_id, day=day.isoformat())
+
+
+def service_timezone(service):
+    name = (service.availability_rules or {}).get('timezone')
+    return ZoneInfo(name) if name else timezone.get_current_timezone()
+
+
+def rules_fingerprint(service):
+    """Hash das regras que alteram o bitmap; invalida o cache quando o serviço muda"""
+    payload = json.dumps(
+        [service.availability_rules, service.booking_settings, service.duration_minutes],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.md5(payload.encode()).hexdigest()
+
+
+def _parse_minutes(value):
+    hours, minutes = str(value).split(':')[:2]
+    return int(hours) * 60 + int(minutes)
+
+
+def _block_mask(start_minute, end_minute):
+    first = max(start_minute // GRANULARITY_MINUTES, 0)
+    last = min(-(-end_minute // GRANULARITY_MINUTES), BLOCKS_PER_DAY)
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+def _intervals_for_day(rules, day):
+    exceptions = rules.get('exceptions') or {}
+    if day.isoformat() in exceptions:
+        return exceptions[day.isoformat()] or []
+    weekly = rules.get('weekly') or {}
+    weekday = day.weekday()
+    return weekly.get(str(weekday)) or weekly.get(WEEKDAY_NAMES[weekday]) or []
+
+
+def open_bitmap(service, day):
+    """Bitmap dos blocos abertos do dia segundo as regras do serviço"""
+    bitmap = 0
+    for start, end in _intervals_for_day(service.availability_rules or {}, day):
+        bitmap |= _block_mask(_parse_minutes(start), _parse_minutes(end))
+    return bitmap
+
+
+def busy_bitmap(intervals, day, tz, buffer_minutes=0):
+    """Bitmap dos blocos ocupados por ``intervals`` (pares início/fim) no dia"""
+    day_start = datetime.combine(day, time.min, tzinfo=tz)
+    day_end = day_start + timedelta(days=1)
+    bitmap = 0
+    for start, end in intervals:
+        start = start - timedelta(minutes=buffer_minutes)
+        end = end + timedelta(minutes=buffer_minutes)
+        if end <= day_start or start >= day_end:
+            continue
+        start_minute = max(int((start - day_start).total_seconds() // 60), 0)
+        end_minute = min(math.ceil((end - day_start).total_seconds() / 60), 24 * 60)
+        bitmap |= _block_mask(start_minute, end_minute)
+    return bitmap
+
+
+def _day_bounds(days, tz):
+    start = datetime.combine(min(days), time.min, tzinfo=tz)
+    end = datetime.combine(max(days) + timedelta(days=1), time.min, tzinfo=tz)
+    return start, end
+
+
+def booked_intervals(service_ids, start, end):
+    """Uma única consulta por intervalo para todos os serviços informados"""
+    rows = (
+        ServiceAppointment.objects
+        .filter(service_id__in=service_ids, scheduled_start__lt=end, scheduled_end__gt=start)
+        .exclude(status__in=INACTIVE_STATUSES)
+        .values_list('service_id', 'scheduled_start', 'scheduled_end')
+    )
+    intervals = {service_id: [] for service_id in service_ids}
+    for service_id, scheduled_start, scheduled_end in rows:
+        intervals[service_id].append((scheduled_start, scheduled_end))
+    return intervals
+
+
+def staff_intervals(staff, start, end):
+    """Intervalos ocupados de um membro da equipe, em qualquer serviço"""
+    return list(
+        ServiceAppointment.objects
+        .filter(assigned_staff=staff, scheduled_start__lt=end, scheduled_end__gt=start)
+        .exclude(status__in=INACTIVE_STATUSES)
+        .values_list('scheduled_start', 'scheduled_end')
+    )
+
+
+def free_bitmaps(services, days):
+    """
+    Bitmaps livres de vários serviços para vários dias, indexados por (serviço, dia).
+
+    Lê o cache com ``get_many`` e resolve as ausências com uma só consulta por
+    intervalo para todo o bloco de dias.
+    """
+    services = list(services)
+    keys = {
+        (service.pk, day): cache_key(service.pk, day)
+        for service in services for day in days
+    }
+    cached = cache.get_many(keys.values())
+    result, missing = {}, {}
+    for service in services:
+        fingerprint = rules_fingerprint(service)
+        for day in days:
+            entry = cached.get(keys[service.pk, day])
+            if entry and entry[0] == fingerprint:
+                result[service.pk, day] = entry[1]
+            else:
+                missing.setdefault(service, []).append(day)
+
+    if missing:
+        by_tz = {}
+        for service in missing:
+            by_tz.setdefault(service_timezone(service), []).append(service)
+        to_cache = {}
+        for tz, group in by_tz.items():
+            span = _day_bounds([day for service in group for day in missing[service]], tz)
+            intervals = booked_intervals([service.pk for service in group], *span)
+            for service in group:
+                fingerprint = rules_fingerprint(service)
+                buffer_minutes = int((service.booking_settings or {}).get('buffer_minutes', 0))
+                for day in missing[service]:
+                    bitmap = open_bitmap(service, day) & ~busy_bitmap(
+                        intervals[service.pk], day, tz, buffer_minutes
+                    )
+                    result[service.pk, day] = bitmap
+                    to_cache[keys[service.pk, day]] = (fingerprint, bitmap)
+        cache.set_many(to_cache, CACHE_TIMEOUT)
+    return result
+
+
+def _slot_starts(bitmap, duration_minutes, interval_minutes):
+    length = max(-(-duration_minutes // GRANULARITY_MINUTES), 1)
+    step = max(interval_minutes // GRANULARITY_MINUTES, 1)
+    mask = (1 << length) - 1
+    for block in range(0, BLOCKS_PER_DAY - length + 1, step):
+        if (bitmap >> block) & mask == mask:
+            yield block
+
+
+def _day_slots(service, day, bitmap, not_before):
+    tz = service_timezone(service)
+    settings = service.booking_settings or {}
+    interval = int(settings.get('slot_interval', DEFAULT_SLOT_INTERVAL))
+    day_start = datetime.combine(day, time.min, tzinfo=tz)
+    for block in _slot_starts(bitmap, service.duration_minutes, interval):
+        start = day_start + timedelta(minutes=block * GRANULARITY_MINUTES)
+        if start < not_before:
+            continue
+        yield Slot(service.pk, start, start + timedelta(minutes=service.duration_minutes))
+
+
+def find_free_slots(services: Iterable[Service], limit=10, start=None, staff=None, max_days=None):
+    """
+    Próximos ``limit`` horários livres entre vários serviços, em ordem cronológica.
+
+    Percorre os dias a partir de ``start`` até encontrar horários suficientes ou
+    atingir o ``max_advance_days`` dos serviços. Com ``staff`` informado, os
+    agendamentos desse membro da equipe também são subtraídos.
+    """
+    services = [service for service in services if service.is_active]
+    if not services or limit <= 0:
+        return []
+    now = timezone.now()
+    start = start or now
+    horizon = max_days or max(
+        int((service.booking_settings or {}).get('max_advance_days', DEFAULT_MAX_ADVANCE_DAYS))
+        for service in services
+    )
+    first_day = timezone.localtime(start).date()
+    days = [first_day + timedelta(days=offset) for offset in range(horizon + 1)]
+
+    staff_busy = None
+    if staff is not None:
+        tz = timezone.get_current_timezone()
+        staff_busy = staff_intervals(staff, *_day_bounds(days, tz))
+
+    slots = []
+    for offset in range(0, len(days), WINDOW_DAYS):
+        window = days[offset:offset + WINDOW_DAYS]
+        bitmaps = free_bitmaps(services, window)
+        for day in window:
+            for service in services:
+                bitmap = bitmaps[service.pk, day]
+                if not bitmap:
+                    continue
+                if staff_busy:
+                    bitmap &= ~busy_bitmap(staff_busy, day, service_timezone(service))
+                notice = int((service.booking_settings or {}).get('min_notice_minutes', 0))
+                not_before = max(start, now + timedelta(minutes=notice))
+                slots.extend(_day_slots(service, day, bitmap, not_before))
+            if len(slots) >= limit:
+                break
+        if len(slots) >= limit:
+            break
+    slots.sort(key=lambda slot: slot.start)
+    return slots[:limit]
+
+
+def is_slot_free(service, start, end, staff=()):
+    """Confere se o intervalo cabe nas regras e não colide com outros agendamentos"""
+    tz = service_timezone(service)
+    local_start = start.astimezone(tz)
+    local_end = end.astimezone(tz)
+    if local_start.date() != (local_end - timedelta(microseconds=1)).date():
+        return False
+    day = local_start.date()
+    wanted = busy_bitmap([(start, end)], day, tz)
+    free = free_bitmaps([service], [day])[service.pk, day]
+    if free & wanted != wanted:
+        return False
+    day_bounds = _day_bounds([day], tz)
+    for member in staff:
+        if busy_bitmap(staff_intervals(member, *day_bounds), day, tz) & wanted:
+            return False
+    return True
+
+
+def invalidate(service_id, start, end):
+    """Remove do cache os dias tocados por um agendamento"""
+    if not (service_id and start and end):
+        return
+    tz = timezone.get_current_timezone()
+    # Margem de um dia para cobrir serviços com fuso diferente do padrão
+    day = (start.astimezone(tz) - timedelta(days=1)).date()
+    last = (end.astimezone(tz) + timedelta(days=1)).date()
+    keys = []
+    while day <= last:
+        keys.append(cache_key(service_id, day))
+        day += timedelta(days=1)
+    cache.delete_many(keys)
@@ -0,0 +1,152 @@
+"""
+API de reserva de agendamentos sem sobreposição.
+
+A ``UniqueConstraint`` de ``ServiceAppointment`` só bloqueia horários idênticos.
+Aqui cada reserva trava, dentro da transação, as linhas de
+``ServiceBookingLock`` do serviço e de cada membro da equipe para os dias
+tocados, e só então verifica sobreposições. Reservas de serviços e dias
+diferentes não disputam a mesma trava. As travas de dias passados são
+apagadas por ``purge_booking_locks`` (comando ``purge_booking_locks``).
+"""
+import random
+import time as time_module
+from datetime import timedelta
+
+from django.core.exceptions import ValidationError
+from django.db import OperationalError, connection, transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from . import availability
+from .models import ServiceAppointment, ServiceBookingLock
+
+
+# Quando o banco recusa a trava ("database is locked"/"database table is locked" no
+# SQLite; no banco em memória dos testes a espera do busy_timeout não se aplica) a
+# reserva é repetida com espera crescente até LOCK_TIMEOUT segundos
+LOCK_TIMEOUT = 10
+LOCK_RETRY_DELAY = 0.02
+LOCK_RETRY_MAX_DELAY = 0.5
+
+
+class BookingConflict(ValidationError):
+    """Horário sobreposto a outro agendamento do serviço ou da equipe"""
+
+
+def _lock_days(start, end):
+    tz = timezone.get_current_timezone()
+    day = timezone.localtime(start, tz).date()
+    last = timezone.localtime(end - timedelta(microseconds=1), tz).date()
+    days = []
+    while day <= last:
+        days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def _lock_resources(service, staff):
+    resources = [f'service:{service.pk}']
+    resources.extend(f'staff:{member.pk}' for member in staff)
+    return sorted(resources)
+
+
+def acquire_locks(service, start, end, staff=()):
+    """
+    Trava as linhas (recurso, dia) do agendamento; deve rodar dentro de ``atomic``.
+
+    As linhas são criadas sob demanda e travadas sempre na mesma ordem para
+    evitar deadlocks entre reservas que compartilham recursos.
+    """
+    keys = [(resource, day) for resource in _lock_resources(service, staff) for day in _lock_days(start, end)]
+    ServiceBookingLock.objects.bulk_create(
+        [ServiceBookingLock(resource=resource, day=day) for resource, day in keys],
+        ignore_conflicts=True,
+    )
+    locks = ServiceBookingLock.objects.filter(
+        resource__in={resource for resource, _day in keys},
+        day__in={day for _resource, day in keys},
+    )
+    if connection.features.has_select_for_update:
+        list(locks.select_for_update().order_by('resource', 'day').values_list('pk', flat=True))
+    else:
+        # Sem SELECT ... FOR UPDATE (SQLite) a escrita garante a trava do banco
+        locks.update(locked_at=timezone.now())
+
+
+def purge_booking_locks(before=None):
+    """Apaga as travas dos dias anteriores a ``before`` (hoje); retorna quantas"""
+    before = before or timezone.localdate()
+    deleted, _counts = ServiceBookingLock.objects.filter(day__lt=before).delete()
+    return deleted
+
+
+def conflicting_appointments(service, start, end, staff=(), exclude=None):
+    """Agendamentos ativos que se sobrepõem ao intervalo no serviço ou na equipe"""
+    overlap = ServiceAppointment.objects.filter(
+        scheduled_start__lt=end,
+        scheduled_end__gt=start,
+    ).exclude(status__in=availability.INACTIVE_STATUSES)
+    if exclude is not None:
+        overlap = overlap.exclude(pk=exclude.pk)
+    conflicts = overlap.filter(service=service)
+    if staff:
+        conflicts = conflicts | overlap.filter(assigned_staff__in=list(staff))
+    return conflicts.distinct()
+
+
+def rescheduling_conflicts(appointment, service, start, end):
+    """Conflitos do agendamento (novo ou existente, com a equipe atribuída) movido para o intervalo"""
+    if appointment.pk is None:
+        return conflicting_appointments(service, start, end)
+    staff = list(appointment.assigned_staff.all())
+    return conflicting_appointments(service, start, end, staff=staff, exclude=appointment)
+
+
+def check_rules(service, start, end):
+    """Confere se o intervalo está dentro das regras de disponibilidade do serviço"""
+    tz = availability.service_timezone(service)
+    day = timezone.localtime(start, tz).date()
+    wanted = availability.busy_bitmap([(start, end)], day, tz)
+    if not wanted or timezone.localtime(end - timedelta(microseconds=1), tz).date() != day:
+        return False
+    return availability.open_bitmap(service, day) & wanted == wanted
+
+
+def book_appointment(service, customer, start, end, staff=(), status='scheduled', enforce_rules=True, **fields):
+    """
+    Cria o agendamento garantindo que não há sobreposição por serviço nem por membro da equipe.
+
+    Levanta ``BookingConflict`` se o horário estiver ocupado ou fora das regras.
+    """
+    if start >= end:
+        raise ValidationError(_("End time must be after start time."))  # FR: L'heure de fin doit être après l'heure de début.
+    if enforce_rules and service.availability_rules and not check_rules(service, start, end):
+        raise BookingConflict(_("The requested time is outside the service availability."))  # FR: L'horaire demandé est en dehors des disponibilités du service.
+
+    staff = list(staff)
+    deadline = time_module.monotonic() + LOCK_TIMEOUT
+    attempt = 0
+    while True:
+        try:
+            with transaction.atomic():
+                acquire_locks(service, start, end, staff)
+                if conflicting_appointments(service, start, end, staff).exists():
+                    raise BookingConflict(_("This time slot overlaps another appointment."))  # FR: Ce créneau chevauche un autre rendez-vous.
+                appointment = ServiceAppointment.objects.create(
+                    service=service,
+                    customer=customer,
+                    scheduled_start=start,
+                    scheduled_end=end,
+                    status=status,
+                    **fields,
+                )
+                if staff:
+                    appointment.assigned_staff.set(staff)
+                return appointment
+        except OperationalError:
+            # Dentro de uma transação externa não há como repetir com segurança
+            if connection.in_atomic_block or time_module.monotonic() >= deadline:
+                raise
+            delay = min(LOCK_RETRY_DELAY * 2 ** attempt, LOCK_RETRY_MAX_DELAY)
+            time_module.sleep(delay * random.uniform(0.5, 1.5))
+            attempt += 1
@@ -2,6 +2,7 @@ from django import forms
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from .models import Service, ServiceAppointment, ServiceQuote, ServiceDeliverable, ServiceReview
+from .booking import rescheduling_conflicts
 from django.forms.widgets import JSONInput
 
 class ServiceForm(forms.ModelForm):
@@ -108,6 +109,12 @@ class ServiceAppointmentForm(forms.ModelForm):
             if start >= end:
                 raise forms.ValidationError(_("End time must be after start time."))  # FR: L'heure de fin doit être après l'heure de début.
 
+        service = cleaned_data.get("service")
+        if service and start and end:
+            # Mesma regra da API de reserva: o serviço e a equipe já atribuída
+            if rescheduling_conflicts(self.instance, service, start, end).exists():
+                raise forms.ValidationError(_("This time slot overlaps another appointment."))  # FR: Ce créneau chevauche un autre rendez-vous.
+
         return cleaned_data
 
     def clean_status(self):
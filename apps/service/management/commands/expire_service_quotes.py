@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from service.quotes import EXPIRE_BATCH_SIZE, expire_stale_quotes
+
+
+class Command(BaseCommand):
+    help = "Marca como expirados os orçamentos draft/sent com validade vencida"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=EXPIRE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        expired = expire_stale_quotes(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"{expired} quotes expired."))
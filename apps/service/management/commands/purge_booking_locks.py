@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from service.booking import purge_booking_locks
+
+
+class Command(BaseCommand):
+    help = "Apaga as travas de reserva (ServiceBookingLock) de dias já passados"
+
+    def handle(self, *args, **options):
+        deleted = purge_booking_locks()
+        self.stdout.write(self.style.SUCCESS(f"{deleted} booking locks deleted."))
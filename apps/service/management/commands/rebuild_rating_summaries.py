@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from commerce import ratings as product_ratings
+from service import ratings as service_ratings
+
+
+class Command(BaseCommand):
+    help = "Reconstrói os resumos de avaliação de serviços e produtos"
+
+    def handle(self, *args, **options):
+        services = service_ratings.rebuild()
+        products = product_ratings.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"{services} service summaries and {products} product summaries rebuilt."
+        ))
@@ -1,12 +1,20 @@
 from django.db import models
 from django.utils.translation import gettext_lazy as _
-from core.models import BaseModel
+from core.models import BaseModel, RatingSummaryBase
 from companies.models import Company, CompanyUser
 from commerce.models import Customer
 from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 
+class ServiceQuerySet(models.QuerySet):
+    def by_rating(self):
+        """Ordena pela média do resumo desnormalizado, sem agregar avaliações"""
+        return self.select_related('rating_summary').order_by(
+            models.F('rating_summary__average_rating').desc(nulls_last=True),
+            models.F('rating_summary__rating_count').desc(nulls_last=True),
+        )
+
 class Service(BaseModel):
     """Serviço oferecido pela empresa"""
     company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='services')
@@ -22,6 +30,8 @@ class Service(BaseModel):
     is_active = models.BooleanField(default=True)
     categories = models.JSONField(default=list)
 
+    objects = ServiceQuerySet.as_manager()
+
     class Meta:
         verbose_name = _('Service')
         verbose_name_plural = _('Services')
@@ -59,6 +69,15 @@ class ServiceAppointment(BaseModel):
                 name='unique_service_appointment'
             )
         ]
+        indexes = [
+            # Consultas de disponibilidade por intervalo (início < fim_busca e fim > início_busca)
+            models.Index(fields=['service', 'scheduled_start', 'scheduled_end']),
+        ]
+class ServiceQuoteQuerySet(models.QuerySet):
+    def stale(self, now=None):
+        """Orçamentos ainda abertos cuja validade já passou"""
+        return self.filter(status__in=('draft', 'sent'), valid_until__lt=now or timezone.now())
+
 class ServiceQuote(BaseModel):
     """Orçamento para serviço"""
     service = models.ForeignKey(Service, on_delete=models.PROTECT, related_name='quotes')
@@ -77,12 +96,24 @@ class ServiceQuote(BaseModel):
         # outros status...
     ]
     
+    # Status que ainda podem expirar pela passagem de valid_until
+    OPEN_STATUSES = ('draft', 'sent')
+
     status = models.CharField(max_length=50,choices=STATUS_CHOICES)
     notes = models.TextField(blank=True)
     terms_conditions = models.TextField()
+
+    objects = ServiceQuoteQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Varredura de expiração: status aberto com valid_until vencido
+            models.Index(fields=['status', 'valid_until']),
+            models.Index(fields=['service', 'status']),
+        ]
     
     def is_expired(self):
-        return timezone.now() > self.valid_until
+        return self.status == 'expired' or timezone.now() > self.valid_until
 
 class ServiceDeliverable(BaseModel):
     """Entregáveis do serviço"""
@@ -117,4 +148,24 @@ class ServiceReview(BaseModel):
     response_date = models.DateTimeField(null=True, blank=True)
     rating = models.IntegerField(
         validators=[MinValueValidator(1), MaxValueValidator(5)]
-    )
\ No newline at end of file
+    )
+
+class ServiceBookingLock(models.Model):
+    """Linha de trava por recurso (serviço ou membro da equipe) e dia para reservas concorrentes"""
+    resource = models.CharField(max_length=100)
+    day = models.DateField()
+    locked_at = models.DateTimeField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['resource', 'day'], name='unique_service_booking_lock'),
+        ]
+
+
+class ServiceRatingSummary(RatingSummaryBase):
+    """Resumo das avaliações públicas de um serviço, mantido pelos sinais de ServiceReview"""
+    service = models.OneToOneField(Service, on_delete=models.CASCADE, related_name='rating_summary')
+
+    class Meta:
+        verbose_name = _('Service Rating Summary')
+        verbose_name_plural = _('Service Rating Summaries')
@@ -0,0 +1,78 @@
+"""
+Expiração em lote e funil de conversão dos orçamentos (ServiceQuote).
+"""
+from django.db.models import Count, Exists, OuterRef, Q, Sum
+from django.utils import timezone
+
+from .availability import INACTIVE_STATUSES
+from .models import ServiceAppointment, ServiceQuote
+
+
+EXPIRE_BATCH_SIZE = 1000
+
+# Status que indicam que o orçamento chegou ao cliente (os expirados não distinguem draft de sent)
+DELIVERED_STATUSES = ('sent', 'accepted', 'rejected')
+
+
+def expire_stale_quotes(now=None, batch_size=EXPIRE_BATCH_SIZE):
+    """
+    Move orçamentos ``draft``/``sent`` vencidos para ``expired``.
+
+    Cada lote é um único UPDATE com subconsulta limitada sobre o índice
+    (status, valid_until); retorna o total de orçamentos expirados.
+    """
+    now = now or timezone.now()
+    total = 0
+    while True:
+        batch = ServiceQuote.objects.stale(now).values('pk')[:batch_size]
+        updated = ServiceQuote.objects.filter(pk__in=batch).update(status='expired', updated_at=now)
+        total += updated
+        if updated < batch_size:
+            return total
+
+
+def conversion_funnel(quotes=None, since=None, until=None):
+    """
+    Funil orçamento → agendamento por serviço, calculado numa única consulta agrupada.
+
+    A conversão conta clientes, não orçamentos: ``converted`` é o número de
+    clientes distintos com um agendamento ativo do mesmo serviço criado depois
+    de um dos seus orçamentos, e ``conversion_rate`` o divide pelos clientes
+    que receberam orçamento (``customers``). Assim vários orçamentos do mesmo
+    cliente seguidos de um agendamento contam uma conversão só.
+    """
+    quotes = ServiceQuote.objects.all() if quotes is None else quotes
+    if since:
+        quotes = quotes.filter(created_at__gte=since)
+    if until:
+        quotes = quotes.filter(created_at__lt=until)
+
+    appointments = ServiceAppointment.objects.filter(
+        service=OuterRef('service'),
+        customer=OuterRef('customer'),
+        created_at__gte=OuterRef('created_at'),
+    ).exclude(status__in=INACTIVE_STATUSES)
+
+    rows = (
+        quotes.order_by()
+        .annotate(converted=Exists(appointments))
+        .values('service_id', 'service__name')
+        .annotate(
+            quotes=Count('pk'),
+            customers=Count('customer', distinct=True),
+            sent=Count('pk', filter=Q(status__in=DELIVERED_STATUSES)),
+            accepted=Count('pk', filter=Q(status='accepted')),
+            rejected=Count('pk', filter=Q(status='rejected')),
+            expired=Count('pk', filter=Q(status='expired')),
+            converted=Count('customer', filter=Q(converted=True), distinct=True),
+            quoted_value=Sum('estimated_cost'),
+            accepted_value=Sum('estimated_cost', filter=Q(status='accepted')),
+        )
+        .order_by('service__name')
+    )
+    funnel = []
+    for row in rows:
+        row['acceptance_rate'] = row['accepted'] / row['sent'] if row['sent'] else 0
+        row['conversion_rate'] = row['converted'] / row['customers'] if row['customers'] else 0
+        funnel.append(row)
+    return funnel
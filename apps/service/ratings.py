@@ -0,0 +1,34 @@
+from core.ratings import apply_review_change, rebuild_summaries, review_state
+from .models import ServiceAppointment, ServiceRatingSummary, ServiceReview
+
+
+REVIEW_FIELDS = ('appointment_id', 'rating', 'attributes', 'is_public')
+
+def _service_ids(*appointment_ids):
+    ids = {pk for pk in appointment_ids if pk}
+    return dict(ServiceAppointment.objects.filter(pk__in=ids).values_list('pk', 'service_id'))
+
+
+def snapshot(values):
+    """Estado relevante para o resumo, a partir dos valores de REVIEW_FIELDS; só avaliações públicas contam"""
+    if not values.get('is_public', True):
+        return None
+    return values.get('appointment_id'), values.get('rating'), dict(values.get('attributes') or {})
+
+
+def update_summary(old, new):
+    """Aplica a troca de ``old`` por ``new`` (snapshots) no resumo do serviço"""
+    services = _service_ids(old and old[0], new and new[0])
+    apply_review_change(
+        ServiceRatingSummary,
+        'service',
+        old=old and review_state(services.get(old[0]), old[1], old[2]),
+        new=new and review_state(services.get(new[0]), new[1], new[2]),
+    )
+
+
+def rebuild():
+    reviews = ServiceReview.objects.filter(is_public=True, rating__range=(1, 5))
+    return rebuild_summaries(
+        ServiceRatingSummary, 'service', reviews, 'appointment__service_id', attributes_path='attributes'
+    )
@@ -0,0 +1,62 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from core.ratings import complete_review_values, review_values
+from . import availability, ratings
+from .models import ServiceAppointment, ServiceReview
+
+
+@receiver(post_init, sender=ServiceAppointment)
+def remember_appointment_span(sender, instance, **kwargs):
+    # Guarda o horário carregado para invalidar também o dia antigo ao reagendar.
+    # Lido de __dict__: campo adiado não dispara consulta (nem recursão no post_init)
+    values = instance.__dict__
+    instance._availability_span = (
+        values.get('service_id'), values.get('scheduled_start'), values.get('scheduled_end'),
+    )
+
+
+@receiver(post_save, sender=ServiceAppointment)
+def invalidate_availability_on_save(sender, instance, **kwargs):
+    # Só após o commit, para que uma leitura concorrente não recoloque o bitmap antigo no cache
+    previous = getattr(instance, '_availability_span', (None, None, None))
+    transaction.on_commit(partial(availability.invalidate, *previous))
+    transaction.on_commit(partial(
+        availability.invalidate, instance.service_id, instance.scheduled_start, instance.scheduled_end
+    ))
+    remember_appointment_span(sender, instance)
+
+
+@receiver(post_delete, sender=ServiceAppointment)
+def invalidate_availability_on_delete(sender, instance, **kwargs):
+    transaction.on_commit(partial(
+        availability.invalidate, instance.service_id, instance.scheduled_start, instance.scheduled_end
+    ))
+
+
+@receiver(post_init, sender=ServiceReview)
+def remember_review_state(sender, instance, **kwargs):
+    instance._rating_values = review_values(instance, ratings.REVIEW_FIELDS)
+
+
+@receiver(pre_save, sender=ServiceReview)
+@receiver(pre_delete, sender=ServiceReview)
+def load_deferred_review_state(sender, instance, **kwargs):
+    instance._rating_values = complete_review_values(instance, instance._rating_values, ratings.REVIEW_FIELDS)
+
+
+@receiver(post_save, sender=ServiceReview)
+def update_service_rating_on_save(sender, instance, created, **kwargs):
+    old = None if created else ratings.snapshot(instance._rating_values)
+    # Campos ainda adiados não foram gravados: valem os do banco
+    current = {**instance._rating_values, **review_values(instance, ratings.REVIEW_FIELDS)}
+    ratings.update_summary(old, ratings.snapshot(current))
+    instance._rating_values = current
+
+
+@receiver(post_delete, sender=ServiceReview)
+def update_service_rating_on_delete(sender, instance, **kwargs):
+    ratings.update_summary(ratings.snapshot(instance._rating_values), None)
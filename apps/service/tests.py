@@ -1,3 +1,277 @@
-from django.test import TestCase
+import threading
+from datetime import datetime, time, timedelta
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from commerce.models import Customer
+from companies.models import Company, CompanyUser
+from core.models import Language
+from . import availability, quotes, ratings
+from .booking import BookingConflict, book_appointment, purge_booking_locks, rescheduling_conflicts
+from .models import Service, ServiceAppointment, ServiceBookingLock, ServiceQuote, ServiceRatingSummary, ServiceReview
+
+
+def create_company(suffix=''):
+    owner = get_user_model().objects.create_user(email=f'owner{suffix}@example.com', password='secret')
+    language, _ = Language.objects.get_or_create(
+        code='fr', defaults={'name': 'French', 'native_name': 'Français', 'date_format': 'd/m/Y'}
+    )
+    return Company.objects.create(
+        owner=owner, business_name='Batmart', trading_name='Batmart', tax_id=f'FR{suffix}',
+        registration_number='1', legal_form='SAS', primary_language=language,
+    )
+
+
+def create_customer(company, index=0):
+    return Customer.objects.create(
+        company=company, customer_type='individual', first_name='Jean', last_name='Dupont',
+        email=f'client{index}@example.com', phone='0600000000',
+    )
+
+
+def create_service(company, name='Installation'):
+    return Service.objects.create(
+        company=company, name=name, description='', base_price=100, duration_minutes=60,
+        availability_rules={'weekly': {str(day): [['08:00', '18:00']] for day in range(7)}},
+    )
+
+
+def tomorrow_at(hour, minute=0):
+    day = timezone.localdate() + timedelta(days=1)
+    return datetime.combine(day, time(hour, minute), tzinfo=timezone.get_current_timezone())
+
+
+class BookAppointmentTests(TestCase):
+    def setUp(self):
+        self.company = create_company('1')
+        self.customer = create_customer(self.company)
+        self.service = create_service(self.company)
+
+    def test_overlapping_booking_is_rejected(self):
+        book_appointment(self.service, self.customer, tomorrow_at(9), tomorrow_at(10))
+        with self.assertRaises(BookingConflict):
+            book_appointment(self.service, self.customer, tomorrow_at(9, 30), tomorrow_at(10, 30))
+        book_appointment(self.service, self.customer, tomorrow_at(10), tomorrow_at(11))
+
+    def test_staff_overlap_across_services_is_rejected(self):
+        user = get_user_model().objects.create_user(email='staff@example.com', password='secret')
+        member = CompanyUser.objects.create(company=self.company, user=user, job_title='Tech', department='Ops')
+        other = create_service(self.company, name='Maintenance')
+        book_appointment(self.service, self.customer, tomorrow_at(9), tomorrow_at(10), staff=[member])
+        with self.assertRaises(BookingConflict):
+            book_appointment(other, self.customer, tomorrow_at(9, 30), tomorrow_at(10, 30), staff=[member])
+        book_appointment(other, self.customer, tomorrow_at(9, 30), tomorrow_at(10, 30))
+
+    def test_rescheduling_checks_staff_overlap_like_booking(self):
+        user = get_user_model().objects.create_user(email='staff@example.com', password='secret')
+        member = CompanyUser.objects.create(company=self.company, user=user, job_title='Tech', department='Ops')
+        other = create_service(self.company, name='Maintenance')
+        first = book_appointment(self.service, self.customer, tomorrow_at(9), tomorrow_at(10), staff=[member])
+        moved = book_appointment(other, self.customer, tomorrow_at(14), tomorrow_at(15), staff=[member])
+        self.assertEqual(list(rescheduling_conflicts(moved, other, tomorrow_at(9, 30), tomorrow_at(10, 30))), [first])
+        self.assertFalse(rescheduling_conflicts(moved, other, tomorrow_at(14, 30), tomorrow_at(15, 30)).exists())
+        moved.assigned_staff.clear()
+        self.assertFalse(rescheduling_conflicts(moved, other, tomorrow_at(9, 30), tomorrow_at(10, 30)).exists())
+
+    def test_past_locks_are_purged(self):
+        book_appointment(self.service, self.customer, tomorrow_at(9), tomorrow_at(10))
+        ServiceBookingLock.objects.create(resource=f'service:{self.service.pk}', day=timezone.localdate() - timedelta(days=2))
+        self.assertEqual(purge_booking_locks(), 1)
+        self.assertEqual(list(ServiceBookingLock.objects.values_list('day', flat=True)), [tomorrow_at(9).date()])
+
+    def test_booking_outside_availability_is_rejected(self):
+        with self.assertRaises(BookingConflict):
+            book_appointment(self.service, self.customer, tomorrow_at(19), tomorrow_at(20))
+
+
+
+class ConversionFunnelTests(TestCase):
+    def setUp(self):
+        self.company = create_company('3')
+        self.service = create_service(self.company)
+
+    def quote(self, customer, status='sent', service=None):
+        return ServiceQuote.objects.create(
+            service=service or self.service, customer=customer, requirements='', estimated_duration=60,
+            estimated_cost=100, valid_until=timezone.now() + timedelta(days=30), status=status, terms_conditions='',
+        )
+
+    def test_conversions_count_customers_once(self):
+        loyal, hesitant, elsewhere = (create_customer(self.company, index) for index in range(3))
+        for status in ('sent', 'sent', 'accepted'):
+            self.quote(loyal, status)
+        self.quote(hesitant)
+        self.quote(elsewhere)
+        book_appointment(self.service, loyal, tomorrow_at(9), tomorrow_at(10))
+        book_appointment(create_service(self.company, 'Maintenance'), elsewhere, tomorrow_at(11), tomorrow_at(12))
+        [row] = quotes.conversion_funnel()
+        self.assertEqual(
+            {key: row[key] for key in ('quotes', 'customers', 'sent', 'accepted', 'converted')},
+            {'quotes': 5, 'customers': 3, 'sent': 5, 'accepted': 1, 'converted': 1},
+        )
+        self.assertAlmostEqual(row['conversion_rate'], 1 / 3)
+        self.assertEqual(row['acceptance_rate'], 1 / 5)
+
+    def test_appointment_before_the_quote_is_not_a_conversion(self):
+        customer = create_customer(self.company)
+        appointment = book_appointment(self.service, customer, tomorrow_at(9), tomorrow_at(10))
+        ServiceAppointment.objects.filter(pk=appointment.pk).update(created_at=timezone.now() - timedelta(days=1))
+        self.quote(customer)
+        self.assertEqual(quotes.conversion_funnel()[0]['converted'], 0)
+
+
+def rating_summaries():
+    return {
+        summary.service_id: (
+            summary.rating_count, summary.rating_sum, summary.histogram, summary.average_rating,
+            summary.attribute_totals,
+        )
+        for summary in ServiceRatingSummary.objects.filter(rating_count__gt=0)
+    }
+
+
+class RatingSummaryTests(TestCase):
+    def setUp(self):
+        self.company = create_company('1')
+        self.customer = create_customer(self.company)
+        self.services = [create_service(self.company, name) for name in ('Installation', 'Entretien')]
+        self.appointments = [
+            book_appointment(service, self.customer, tomorrow_at(9), tomorrow_at(10)) for service in self.services
+        ]
+
+    def review(self, appointment, rating, **attributes):
+        return ServiceReview.objects.create(
+            appointment=appointment, customer=self.customer, rating=rating, review_text='', attributes=attributes,
+        )
+
+    def assertMatchesRebuild(self):
+        incremental = rating_summaries()
+        ratings.rebuild()
+        self.assertEqual(incremental, rating_summaries())
+
+    def test_signals_keep_summary_equal_to_rebuild(self):
+        first = self.review(self.appointments[0], 5, pontualidade=4)
+        second = self.review(self.appointments[0], 3, pontualidade=2, qualidade=5)
+        self.review(self.appointments[1], 4)
+        self.assertEqual(rating_summaries()[self.services[0].pk][:3], (2, 8, {1: 0, 2: 0, 3: 1, 4: 0, 5: 1}))
+        self.assertMatchesRebuild()
+
+        first.rating, first.attributes = 2, {'pontualidade': 1}
+        first.save()
+        second.appointment = self.appointments[1]
+        second.save()
+        self.assertMatchesRebuild()
+
+        first.is_public = False
+        first.save()
+        self.assertMatchesRebuild()
+        first.is_public = True
+        first.save()
+        second.delete()
+        self.assertMatchesRebuild()
+
+    def test_partial_instances_update_the_summary(self):
+        review = self.review(self.appointments[0], 5)
+        partial = ServiceReview.objects.only('pk', 'rating').get(pk=review.pk)
+        partial.rating = 1
+        partial.save(update_fields=['rating'])
+        self.assertEqual(rating_summaries()[self.services[0].pk][:2], (1, 1))
+        self.assertMatchesRebuild()
+        ServiceReview.objects.defer('appointment', 'is_public').get(pk=review.pk).delete()
+        self.assertEqual(rating_summaries(), {})
+        self.assertMatchesRebuild()
+
+
+@override_settings(AUDIT_ASYNC=False)
+class AvailabilityTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.company = create_company('3')
+        self.customer = create_customer(self.company)
+        self.service = create_service(self.company)
+        self.day = tomorrow_at(0).date()
+
+    def test_bitmaps_follow_rules_and_bookings(self):
+        tz = timezone.get_current_timezone()
+        blocks = 60 // availability.GRANULARITY_MINUTES
+        self.assertEqual(availability.open_bitmap(self.service, self.day), ((1 << 10 * blocks) - 1) << 8 * blocks)
+        busy = availability.busy_bitmap([(tomorrow_at(9), tomorrow_at(10))], self.day, tz)
+        self.assertEqual(busy, ((1 << blocks) - 1) << 9 * blocks)
+
+    def test_exception_closes_the_day(self):
+        self.service.availability_rules['exceptions'] = {self.day.isoformat(): []}
+        self.service.save()
+        self.assertEqual(availability.open_bitmap(self.service, self.day), 0)
+        slots = availability.find_free_slots([self.service], limit=1, start=tomorrow_at(0))
+        self.assertGreater(slots[0].start.date(), self.day)
+
+    def test_free_slots_skip_bookings_and_refresh_after_save(self):
+        slots = availability.find_free_slots([self.service], limit=3, start=tomorrow_at(0))
+        self.assertEqual([slot.start for slot in slots], [tomorrow_at(8), tomorrow_at(8, 30), tomorrow_at(9)])
+        with self.captureOnCommitCallbacks(execute=True):
+            book_appointment(self.service, self.customer, tomorrow_at(8), tomorrow_at(9))
+        slots = availability.find_free_slots([self.service], limit=1, start=tomorrow_at(0))
+        self.assertEqual(slots[0].start, tomorrow_at(9))
+
+    def test_free_bitmaps_are_cached(self):
+        availability.free_bitmaps([self.service], [self.day])
+        with self.assertNumQueries(0):
+            availability.free_bitmaps([self.service], [self.day])
+
+    def test_reschedule_invalidates_old_and_new_days(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment = book_appointment(self.service, self.customer, tomorrow_at(8), tomorrow_at(9))
+        self.assertFalse(availability.is_slot_free(self.service, tomorrow_at(8), tomorrow_at(9)))
+        appointment = ServiceAppointment.objects.get(pk=appointment.pk)
+        appointment.scheduled_start = tomorrow_at(8) + timedelta(days=1)
+        appointment.scheduled_end = tomorrow_at(9) + timedelta(days=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment.save()
+        self.assertTrue(availability.is_slot_free(self.service, tomorrow_at(8), tomorrow_at(9)))
+
+    def test_deferred_appointment_load_does_not_query_again(self):
+        book_appointment(self.service, self.customer, tomorrow_at(8), tomorrow_at(9))
+        with self.assertNumQueries(1):
+            appointments = list(ServiceAppointment.objects.only('pk'))
+        self.assertEqual(len(appointments), 1)
+
+
+@override_settings(AUDIT_ASYNC=False)
+class ConcurrentBookingStressTests(TransactionTestCase):
+    threads = 12
+
+    def setUp(self):
+        self.company = create_company('2')
+        self.service = create_service(self.company)
+        self.customers = [create_customer(self.company, index) for index in range(self.threads)]
+
+    def test_parallel_overlapping_bookings_never_overlap(self):
+        barrier = threading.Barrier(self.threads)
+        outcomes = []
+
+        def worker(index):
+            # Todos pedem uma hora começando entre 9h00 e 9h55: todos se sobrepõem
+            start = tomorrow_at(9, 5 * index)
+            try:
+                barrier.wait()
+                book_appointment(self.service, self.customers[index], start, start + timedelta(hours=1))
+                outcomes.append('booked')
+            except BookingConflict:
+                outcomes.append('conflict')
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker, args=(index,)) for index in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        self.assertEqual(len(outcomes), self.threads)
+        self.assertEqual(outcomes.count('booked'), 1)
+        booked = list(ServiceAppointment.objects.filter(service=self.service).order_by('scheduled_start'))
+        self.assertEqual(len(booked), 1)
@@ -87,6 +87,7 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "core.middleware.AuditContextMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     'requestlogs.middleware.RequestLogsMiddleware',
@@ -255,3 +256,11 @@ DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL')
 SERVER_EMAIL = DEFAULT_FROM_EMAIL
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# Auditoria (core.audit) gravada em lote por um thread; False grava cada entrada no commit (testes)
+AUDIT_ASYNC = os.getenv('AUDIT_ASYNC', 'True').lower() == 'true'
+
+# Pub/sub dos eventos em tempo real (core.pubsub). O backend em memória só entrega dentro de um
+# único processo ASGI: com vários workers, ou publicando de WSGI, comandos e workers, use o Redis
+PUSH_BACKEND = os.getenv('PUSH_BACKEND', 'core.pubsub.InProcessBackend')
+PUSH_REDIS_URL = os.getenv('PUSH_REDIS_URL', 'redis://localhost:6379/0')
@@ -16,12 +16,15 @@ Including another URLconf
 """
 
 from django.contrib import admin
-from django.urls import path
+from django.urls import include, path
 from django.conf import settings
 from django.conf.urls.static import static
 
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("api/", include("commerce.urls")),
+    path("api/analytics/", include("analytics.api_urls")),
+    path("events/", include("core.urls")),
 ]
 if settings.DEBUG:  # update 03/11/2024: (em homologa com debug true adiciona rota static)
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)